@@ -0,0 +1,299 @@
+"""Admission control of the api requests.
+
+Two mechanisms protect the app when the database slows down:
+
+- a concurrency limiter, only a limited number of requests is handled at
+  the same time, the rest waits in a bounded queue ordered by the route
+  priority and is rejected with 503 when it can not start before the queue
+  deadline,
+- an optional per client token bucket rate limit, requests over the limit
+  are rejected with 429.
+
+The limiter state is kept in the process. Rate limit buckets are in the
+process as well, unless a shared (redis) backend is configured.
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from flask import request
+from werkzeug import exceptions as werk_ex
+
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+LOW_PRIORITY = 2
+
+
+class _Waiter:
+    """Request waiting for a free slot."""
+
+    __slots__ = ("priority", "seq", "event", "admitted")
+
+    def __init__(self, priority: int, seq: int):
+        """Create a waiter."""
+        self.priority = priority
+        self.seq = seq
+        self.event = threading.Event()
+        self.admitted = False
+
+    def __lt__(self, other):
+        """Order by priority, then by arrival."""
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ConcurrencyLimiter:
+    """Limit of concurrently handled requests with a priority queue.
+
+    A released slot is handed over to the waiter with the highest priority
+    (the lowest number). When the queue is full, the waiter with the lowest
+    priority is shed in favour of a more important request.
+    :param max_concurrency: number of requests handled at the same time
+    :max_concurrency type: int
+    :param max_queue: number of requests allowed to wait
+    :max_queue type: int
+    :param queue_timeout: seconds a request can wait for a slot
+    :queue_timeout type: float
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int,
+                 queue_timeout: float):
+        """Create a limiter."""
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    @property
+    def active(self) -> int:
+        """Return the number of requests being handled."""
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """Return the number of waiting requests."""
+        return len(self._waiters)
+
+    def acquire(self, priority: int = NORMAL_PRIORITY) -> bool:
+        """Wait for a free slot.
+
+        :param priority: priority of the request, lower is more important
+        :priority type: int
+        :return: True if the slot was acquired, False if the request is shed
+        :rtype: bool
+        """
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                return True
+
+            if len(self._waiters) >= self.max_queue:
+                worst = max(self._waiters) if self._waiters else None
+
+                if worst is None or worst.priority <= priority:
+                    return False
+
+                self._remove(worst)
+                worst.event.set()
+
+            waiter = _Waiter(priority, next(self._seq))
+            heapq.heappush(self._waiters, waiter)
+
+        waiter.event.wait(self.queue_timeout)
+
+        with self._lock:
+            if not waiter.admitted and waiter in self._waiters:
+                self._remove(waiter)
+
+            return waiter.admitted
+
+    def release(self) -> None:
+        """Free a slot, hand it over to the most important waiter."""
+        with self._lock:
+            if self._waiters:
+                waiter = heapq.heappop(self._waiters)
+                waiter.admitted = True
+                waiter.event.set()
+                return
+
+            self._active -= 1
+
+    def _remove(self, waiter: _Waiter) -> None:
+        """Remove the waiter from the queue, the lock has to be held."""
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+
+
+class InMemoryRateLimitBackend:
+    """Token buckets kept in the process memory.
+
+    :param max_clients: number of clients remembered, the least recently
+        seen are forgotten
+    :max_clients type: int
+    """
+
+    def __init__(self, max_clients: int = 100000):
+        """Create a backend."""
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        """Take a token from the client bucket.
+
+        :param key: client identifier
+        :key type: str
+        :param rate: tokens added per second
+        :rate type: float
+        :param burst: size of the bucket
+        :burst type: int
+        :return: if the request is allowed and seconds to the next token
+        :rtype: Tuple[bool, float]
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared by all processes through redis.
+
+    Requires the `redis` package.
+    :param url: redis connection url
+    :url type: str
+    """
+
+    _SCRIPT = """
+        local tokens = tonumber(redis.call('HGET', KEYS[1], 't') or ARGV[2])
+        local updated = tonumber(redis.call('HGET', KEYS[1], 'u') or ARGV[3])
+        tokens = math.min(tonumber(ARGV[2]),
+                          tokens + (ARGV[3] - updated) * ARGV[1])
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 't', tokens, 'u', ARGV[3])
+        redis.call('EXPIRE', KEYS[1], math.ceil(ARGV[2] / ARGV[1]) + 1)
+        return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: str):
+        """Create a backend."""
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self._SCRIPT)
+
+    def take(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        """Take a token from the client bucket.
+
+        See `InMemoryRateLimitBackend.take`.
+        """
+        allowed, tokens = self._take(keys=[f"trivia:rate:{key}"],
+                                     args=[rate, burst, time.time()])
+        tokens = float(tokens)
+
+        return bool(allowed), 0.0 if allowed else (1 - tokens) / rate
+
+
+def create_rate_limit_backend(url: str = None):
+    """Return rate limit backend, shared if the redis url is provided."""
+    if url:
+        return RedisRateLimitBackend(url)
+
+    return InMemoryRateLimitBackend()
+
+
+def route_priority(config: dict, endpoint: str, method: str) -> int:
+    """Return priority of the request.
+
+    Routes listed in `ADMISSION_ROUTE_PRIORITIES` get the configured value,
+    other reads are high, other writes normal priority.
+    """
+    priority = config["ADMISSION_ROUTE_PRIORITIES"].get(endpoint)
+    if priority is not None:
+        return priority
+
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return HIGH_PRIORITY
+
+    return NORMAL_PRIORITY
+
+
+def init_admission(app) -> None:
+    """Register admission control of the app requests.
+
+    Configuration is taken from the app config: `ADMISSION_ENABLED`,
+    `ADMISSION_MAX_CONCURRENCY`, `ADMISSION_MAX_QUEUE`,
+    `ADMISSION_QUEUE_TIMEOUT`, `ADMISSION_ROUTE_PRIORITIES`,
+    `ADMISSION_EXEMPT_ENDPOINTS`, `RATE_LIMIT_PER_SECOND`,
+    `RATE_LIMIT_BURST`, `RATE_LIMIT_REDIS_URL`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    config = app.config
+    if not config["ADMISSION_ENABLED"]:
+        return
+
+    limiter = ConcurrencyLimiter(config["ADMISSION_MAX_CONCURRENCY"],
+                                 config["ADMISSION_MAX_QUEUE"],
+                                 config["ADMISSION_QUEUE_TIMEOUT"])
+    rate = config["RATE_LIMIT_PER_SECOND"]
+    rate_limits = \
+        create_rate_limit_backend(config["RATE_LIMIT_REDIS_URL"]) \
+        if rate else None
+
+    app.extensions["admission"] = limiter
+
+    @app.before_request
+    def admit_request():
+        """Reject the request if the client or the app is overloaded."""
+        if request.endpoint in config["ADMISSION_EXEMPT_ENDPOINTS"]:
+            return
+
+        if rate_limits is not None:
+            allowed, retry_after = rate_limits.take(
+                request.remote_addr or "unknown", rate,
+                config["RATE_LIMIT_BURST"])
+
+            if not allowed:
+                raise werk_ex.TooManyRequests(
+                    "Rate limit exceeded.",
+                    retry_after=math.ceil(retry_after))
+
+        priority = route_priority(config, request.endpoint, request.method)
+
+        if not limiter.acquire(priority):
+            raise werk_ex.ServiceUnavailable(
+                "Server is overloaded.",
+                retry_after=math.ceil(limiter.queue_timeout))
+
+        # kept on the request, `g` is shared with batch sub-requests
+        request.environ["trivia.admitted"] = True
+
+    @app.teardown_request
+    def release_request(error=None):
+        """Free the slot taken by the request."""
+        if request.environ.pop("trivia.admitted", False):
+            limiter.release()
@@ -0,0 +1,183 @@
+"""Buffered ingestion of quiz attempts.
+
+`POST /api/v1.0/quizzes/attempts` only appends the attempts to a buffer of
+the process, a flusher thread writes them in batches (see
+`QuizAttempt.insert_many`, `COPY` on postgres):
+
+- when `QUIZ_ATTEMPTS_FLUSH_SIZE` attempts are waiting,
+- every `QUIZ_ATTEMPTS_FLUSH_INTERVAL` seconds otherwise.
+
+A batch failed on the connection is kept and written with the next one. A
+batch refused by the db (a value out of range, a missing value) is split in
+halves written separately, the refused attempts are logged and dropped. The
+buffer holds at most `QUIZ_ATTEMPTS_MAX_PENDING` attempts, new attempts are
+rejected with 503 when it is full. The waiting attempts are written when the
+process exits (`atexit`, and the `worker_exit` hook of gunicorn), attempts
+of a killed process are lost.
+"""
+
+import atexit
+import os
+import threading
+import weakref
+
+from sqlalchemy import exc
+from werkzeug import exceptions as werk_ex
+
+from logs import logger
+from models import QuizAttempt, db
+
+
+class AttemptBuffer:
+    """Attempts waiting to be written, shared by the requests of a process.
+
+    :param app: flask application
+    :app type: `Flask`
+    :param flush_size: number of waiting attempts starting a flush
+    :flush_size type: int
+    :param flush_interval: seconds between flushes
+    :flush_interval type: float
+    :param max_pending: the highest number of waiting attempts
+    :max_pending type: int
+    """
+
+    def __init__(self, app, flush_size: int = 500,
+                 flush_interval: float = 1.0, max_pending: int = 50000):
+        """Create a buffer."""
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._reset()
+
+    def _reset(self) -> None:
+        """Start with an empty buffer and no flusher thread."""
+        self._rows = []
+        self._lock = threading.Lock()
+        # one flush at a time, keeps the order of the batches
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self) -> int:
+        """Return the number of attempts waiting to be written."""
+        return len(self._rows)
+
+    def add(self, rows: list) -> None:
+        """Append attempts to the buffer, never waits for the db.
+
+        :param rows: values of `QuizAttempt.COLUMNS`
+        :rows type: a list of tuples
+        :raises werkzeug.exceptions.ServiceUnavailable: the buffer is full
+        """
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_pending:
+                raise werk_ex.ServiceUnavailable(
+                    "Too many attempts waiting to be recorded.")
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.flush_size
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="quiz-attempts",
+                                                daemon=True)
+                self._thread.start()
+
+        if full:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        """Flush the buffer when it is full or the interval passed."""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write the waiting attempts in one transaction.
+
+        A batch refused by the db is split in halves, each written in its
+        own transaction, until the refused attempts are found and dropped.
+        :return: number of attempts written
+        :rtype: int
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            written = 0
+            batches = [rows]
+            with self.app.app_context():
+                try:
+                    while batches:
+                        batch = batches[0]
+                        try:
+                            QuizAttempt.insert_many(batch)
+                            db.session.commit()
+                            written += len(batch)
+
+                        except (exc.DataError, exc.IntegrityError) as e:
+                            db.session.rollback()
+                            if len(batch) > 1:
+                                middle = len(batch) // 2
+                                batches[:1] = [batch[:middle], batch[middle:]]
+                                continue
+                            logger.warning(f"Quiz attempt {batch[0]} refused "
+                                           f"by the db, dropped: {e}")
+
+                        batches.pop(0)
+
+                except Exception as e:
+                    db.session.rollback()
+                    rows = [row for batch in batches for row in batch]
+                    logger.warning(f"{len(rows)} quiz attempts not "
+                                   f"recorded, kept for the next flush: {e}")
+                    with self._lock:
+                        # the oldest are dropped if the buffer overflows
+                        self._rows = (rows + self._rows)[-self.max_pending:]
+
+                finally:
+                    db.session.remove()
+
+        return written
+
+
+def flush_all() -> None:
+    """Write the waiting attempts of all buffers of the process."""
+    for buffer in list(_buffers):
+        buffer.flush()
+
+
+def _reset_buffers() -> None:
+    """Drop the attempts and the threads of the parent in a forked child.
+
+    The parent writes its own attempts.
+    """
+    for buffer in list(_buffers):
+        buffer._reset()
+
+
+# buffers of the apps created in the process
+_buffers = weakref.WeakSet()
+
+os.register_at_fork(after_in_child=_reset_buffers)
+atexit.register(flush_all)
+
+
+def init_attempts(app) -> None:
+    """Register the attempt buffer of the app.
+
+    Configuration keys: `QUIZ_ATTEMPTS_FLUSH_SIZE`,
+    `QUIZ_ATTEMPTS_FLUSH_INTERVAL`, `QUIZ_ATTEMPTS_MAX_PENDING`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    buffer = AttemptBuffer(app, app.config["QUIZ_ATTEMPTS_FLUSH_SIZE"],
+                           app.config["QUIZ_ATTEMPTS_FLUSH_INTERVAL"],
+                           app.config["QUIZ_ATTEMPTS_MAX_PENDING"])
+    app.extensions["attempts"] = buffer
+    _buffers.add(buffer)
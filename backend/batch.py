@@ -0,0 +1,121 @@
+"""Dispatch of sub-requests of a batch api call.
+
+Sub-requests are handled by the view functions of the app in the app context
+of the batch request, sharing its db session. The request hooks (admission,
+compression, logging) are not run for them, they were run once for the
+batch request.
+
+A sub-request failing with an exception has its transaction rolled back,
+so the shared session stays usable for the next sub-requests.
+
+When every sub-request is a read and concurrent reads are enabled, the
+sub-requests are handled by a thread pool, each in its own app context.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from flask import g, request
+from werkzeug.test import EnvironBuilder
+
+from models import db
+
+READ_METHODS = ("GET", "HEAD")
+
+_executor_lock = threading.Lock()
+
+
+def dispatch_subrequest(app, sub: dict, remote_addr: str = None) -> dict:
+    """Handle a sub-request, needs app context.
+
+    :param app: flask application
+    :app type: `Flask`
+    :param sub: method, path and optional body of the sub-request
+    :sub type: dict
+    :param remote_addr: address of the client
+    :remote_addr type: str
+    :return: status and json body of the sub-request response
+    :rtype: dict
+    """
+    builder = EnvironBuilder(path=sub["path"],
+                             method=sub.get("method", "GET").upper(),
+                             json=sub.get("body"),
+                             environ_base={"REMOTE_ADDR": remote_addr})
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+
+    # error handlers of the sub-request must not mark the batch as failed
+    error = g.pop("error", None)
+
+    with app.request_context(environ):
+        try:
+            response = app.make_response(app.dispatch_request())
+
+        except Exception as e:
+            # a failed write leaves the session in a failed transaction
+            db.session.rollback()
+            response = app.make_response(app.handle_user_exception(e))
+
+    if error is None:
+        g.pop("error", None)
+    else:
+        g.error = error
+
+    try:
+        return {
+            "status": response.status_code,
+            "body": response.get_json(silent=True),
+        }
+    finally:
+        # runs the close callbacks of the view, as a server would
+        response.close()
+
+
+def _dispatch_in_context(app, sub: dict, remote_addr: str) -> dict:
+    """Handle a sub-request in a new app context, for the thread pool."""
+    with app.app_context():
+        return dispatch_subrequest(app, sub, remote_addr)
+
+
+def _get_executor(app) -> ThreadPoolExecutor:
+    """Return thread pool of the app, create if needed."""
+    with _executor_lock:
+        executor = app.extensions.get("batch")
+        if executor is None:
+            executor = ThreadPoolExecutor(app.config["BATCH_MAX_WORKERS"],
+                                          thread_name_prefix="batch")
+            app.extensions["batch"] = executor
+
+    return executor
+
+
+def run_batch(app, subrequests: List[dict]) -> List[dict]:
+    """Handle sub-requests, return their responses in the same order.
+
+    Sub-requests are handled one after another, so a sub-request sees the
+    changes made by the previous ones. If `BATCH_CONCURRENT_READS` is set
+    and all sub-requests are reads, they are handled concurrently.
+    :param app: flask application
+    :app type: `Flask`
+    :param subrequests: method, path and optional body of sub-requests
+    :subrequests type: List[dict]
+    :rtype: List[dict]
+    """
+    concurrent = app.config["BATCH_CONCURRENT_READS"] \
+        and len(subrequests) > 1 \
+        and all(sub.get("method", "GET").upper() in READ_METHODS
+                for sub in subrequests)
+
+    if not concurrent:
+        return [dispatch_subrequest(app, sub, request.remote_addr)
+                for sub in subrequests]
+
+    executor = _get_executor(app)
+    futures = [executor.submit(_dispatch_in_context, app, sub,
+                               request.remote_addr)
+               for sub in subrequests]
+
+    return [future.result() for future in futures]
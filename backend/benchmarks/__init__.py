@@ -0,0 +1 @@
+"""Benchmarks of the api, each module can be run as a script."""
@@ -0,0 +1,161 @@
+"""Simulation of concurrent players of adaptive quizzes.
+
+Players with a random skill (1 - 5) play adaptive quizzes at the same time,
+each in its own thread. A player answers right with a chance falling with
+the difficulty above the skill. Questions are drawn by
+`quiz_sampler.draw_adaptive_question` from a binary question store of a
+synthetic bank (no database needed). Printed are the draw latency, the
+draws per second of all players and how close the difficulty of the last
+questions is to the player skill; for comparison, the latency of a draw
+scanning the bank for the questions of a difficulty. Run from the `backend`
+directory:
+
+    python -m benchmarks.adaptive_quiz [players] [questions per quiz]
+"""
+
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict
+
+import question_store
+from quiz_sampler import draw_adaptive_question, next_difficulty
+
+BANK_SIZES = (10_000, 100_000, 1_000_000)
+
+CATEGORIES = 20
+
+# difficulty of the last questions of a quiz compared with the skill
+CONVERGED_QUESTIONS = 5
+
+
+def write_bank(directory: str, size: int) -> question_store.QuestionStore:
+    """Write a store of a synthetic bank and return it mapped."""
+    rng = random.Random(size)
+    categories = [(i, f"Category {i}") for i in range(1, CATEGORIES + 1)]
+    questions = [(i, rng.randint(1, CATEGORIES), rng.randint(1, 5), 1,
+                  f"Question {i}", f"Answer {i}")
+                 for i in range(1, size + 1)]
+
+    path = os.path.join(directory, f"bank-{size}.bin")
+    with open(path, "wb") as f:
+        f.write(question_store.encode_store(categories, questions))
+
+    return question_store.QuestionStore(path)
+
+
+def answers_right(skill: float, difficulty: int, rng: random.Random) -> bool:
+    """Return True if the player answers a question right."""
+    return rng.random() < 1 / (1 + math.exp(1.5 * (difficulty - skill)))
+
+
+def play(store, skill: float, questions: int, category_id: int,
+         rng: random.Random, latencies: list) -> list:
+    """Play an adaptive quiz, return difficulties of the questions."""
+    weights = {category_id: 1} if category_id else None
+    seen, difficulties = [], []
+    previous = correct = None
+
+    for _ in range(questions):
+        started = time.perf_counter()
+        question = draw_adaptive_question(weights, previous, correct, seen,
+                                          store)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if question is None:
+            break
+
+        seen.append(question["id"])
+        previous = question["difficulty"]
+        correct = answers_right(skill, previous, rng)
+        difficulties.append(previous)
+
+    return difficulties
+
+
+def simulate(store, players: int, questions: int) -> Dict[str, float]:
+    """Let the players play at the same time.
+
+    :return: median and 99th percentile draw latency in ms, draws per
+        second, mean distance of the last difficulties from the skill
+    :rtype: Dict[str, float]
+    """
+    latencies, distances = [], []
+    start = threading.Barrier(players + 1)
+    lock = threading.Lock()
+
+    def player(number: int) -> None:
+        rng = random.Random(number)
+        skill = rng.uniform(1, 5)
+        # every other player chooses a category
+        category_id = rng.randint(1, CATEGORIES) if number % 2 else None
+        durations = []
+        start.wait()
+
+        difficulties = play(store, skill, questions, category_id, rng,
+                            durations)
+
+        last = difficulties[-CONVERGED_QUESTIONS:]
+        with lock:
+            latencies.extend(durations)
+            distances.append(abs(statistics.mean(last) - skill))
+
+    threads = [threading.Thread(target=player, args=(number,))
+               for number in range(players)]
+    for thread in threads:
+        thread.start()
+
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "per second": len(latencies) / elapsed,
+        "distance": statistics.mean(distances),
+    }
+
+
+def scan_latency(store, repeat: int = 20) -> float:
+    """Return median ms of a draw scanning the bank for a difficulty."""
+    durations = []
+    for _ in range(repeat):
+        difficulty = next_difficulty(random.randint(1, 5),
+                                     random.random() < 0.5)
+        started = time.perf_counter()
+        random.choice([question_id for question_id, _, question_difficulty
+                       in store.rows() if question_difficulty == difficulty])
+        durations.append((time.perf_counter() - started) * 1000)
+
+    return statistics.median(durations)
+
+
+def main(players: str = "200", questions: str = "20") -> None:
+    """Print latency and accuracy of the adaptive draws by bank size."""
+    players, questions = int(players), int(questions)
+    print(f"{players} concurrent players, {questions} questions per quiz")
+    print(f"{'questions':>10}{'p50 ms':>9}{'p99 ms':>9}{'draws/s':>10}"
+          f"{'|d - skill|':>13}{'scan ms':>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in BANK_SIZES:
+            store = write_bank(directory, size)
+            # the buckets are built once per store, not measured
+            store.buckets
+
+            result = simulate(store, players, questions)
+            print(f"{size:10}{result['p50']:9.3f}{result['p99']:9.3f}"
+                  f"{result['per second']:10.0f}{result['distance']:13.2f}"
+                  f"{scan_latency(store):10.1f}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
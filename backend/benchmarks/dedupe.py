@@ -0,0 +1,85 @@
+"""Latency of the near-duplicate lookup by bank size.
+
+A synthetic bank of random word questions is signed and indexed (no
+database needed). Looked up are misspelled bank questions (a letter changed)
+and new questions; printed are the lookup latency, the share of misspelled
+questions found and, for comparison, the latency of comparing the
+signature with every question of the bank. Run from the `backend`
+directory:
+
+    python -m benchmarks.dedupe [lookups]
+"""
+
+import random
+import statistics
+import string
+import sys
+import time
+
+import minhash
+from dedupe import DuplicateIndex
+
+BANK_SIZES = (1_000, 10_000, 50_000)
+
+_rng = random.Random(0)
+WORDS = ["".join(_rng.choices(string.ascii_lowercase, k=_rng.randint(3, 9)))
+         for _ in range(5_000)]
+
+
+def make_text(rng: random.Random) -> str:
+    """Return a random question of 8 - 14 words."""
+    return " ".join(rng.choices(WORDS, k=rng.randint(8, 14))) + "?"
+
+
+def misspell(text: str, rng: random.Random) -> str:
+    """Return the text with one letter changed."""
+    i = rng.randrange(len(text) - 1)
+    return text[:i] + rng.choice(string.ascii_lowercase) + text[i + 1:]
+
+
+def median_ms(call, arguments: list) -> float:
+    """Return median milliseconds of the call with every argument."""
+    durations = []
+    for argument in arguments:
+        started = time.perf_counter()
+        call(argument)
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def main(lookups: str = "200") -> None:
+    """Print lookup latency and recall by bank size."""
+    lookups = int(lookups)
+    print(f"{lookups} lookups, threshold 0.8")
+    print(f"{'questions':>10}{'sign ms':>9}{'lookup ms':>11}"
+          f"{'found':>8}{'scan ms':>9}")
+
+    for size in BANK_SIZES:
+        rng = random.Random(size)
+        texts = [make_text(rng) for _ in range(size)]
+
+        started = time.perf_counter()
+        signatures = [minhash.signature(text) for text in texts]
+        sign_ms = (time.perf_counter() - started) * 1000 / size
+
+        index = DuplicateIndex(ttl=float("inf"))
+        index.load(enumerate(signatures))
+
+        misspelled = [minhash.signature(misspell(texts[i], rng))
+                      for i in rng.sample(range(size), lookups)]
+        new = [minhash.signature(make_text(rng)) for _ in range(lookups)]
+
+        lookup_ms = median_ms(index.find, misspelled + new)
+        found = sum(bool(index.find(s)) for s in misspelled) / lookups
+
+        def scan(signature):
+            return [i for i, other in enumerate(signatures)
+                    if minhash.similarity(signature, other) >= 0.8]
+
+        scan_ms = median_ms(scan, new[:10])
+        print(f"{size:10}{sign_ms:9.2f}{lookup_ms:11.3f}{found:8.0%}"
+              f"{scan_ms:9.1f}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,156 @@
+"""Throughput of question creation with and without group commit.
+
+Concurrent clients post questions to the app (through the flask test client,
+without a web server). Needs a postgres database, the benchmark works in its
+own schema `trivia_bench` (dropped and created again). Run from the
+`backend` directory:
+
+    python -m benchmarks.group_commit [database url] [requests] [delay]
+
+The url defaults to `TRIVIA_BENCH_DB_URL` or
+`postgresql://postgres@localhost/postgres`, `delay` is
+`QUESTION_GROUP_COMMIT_DELAY` in seconds.
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import text
+
+from config import Config
+from flaskr import create_app
+from models import Category, db
+
+SCHEMA = "trivia_bench"
+
+DEFAULT_URL = "postgresql://postgres@localhost/postgres"
+
+# stays under max_connections of a default postgres (100)
+CONCURRENCY = (1, 4, 16, 32)
+
+CATEGORIES = 10
+
+
+def bench_config(url: str, group_commit: bool, delay: float) -> type:
+    """Return configuration of an app using the benchmark schema."""
+    max_concurrency = max(CONCURRENCY)
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = url
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            "connect_args": {"options": f"-csearch_path={SCHEMA}"},
+            # a connection for every client and the writer
+            "pool_size": max_concurrency + 1,
+            "max_overflow": 0,
+        }
+        MIGRATE_ENABLED = False
+        # measured is the db, not the queue of the admission control
+        ADMISSION_ENABLED = False
+        SNAPSHOT_DIR = None
+        QUESTION_STORE_DIR = None
+        CATEGORY_REGISTRY_SHARED = False
+        LOG_FILE = os.path.join(tempfile.gettempdir(), "trivia_bench.log")
+        QUESTION_GROUP_COMMIT = group_commit
+        QUESTION_GROUP_COMMIT_DELAY = delay
+
+    return BenchConfig
+
+
+def create_schema(app) -> None:
+    """Create the tables in the benchmark schema with a few categories."""
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(
+                text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+        db.create_all()
+        for i in range(CATEGORIES):
+            Category(f"Category {i}").insert()
+        db.session.remove()
+
+
+def measure(app, concurrency: int, requests: int) -> Dict[str, float]:
+    """Post the questions from concurrent clients.
+
+    :return: requests per second, median and 99th percentile latency in ms
+    :rtype: Dict[str, float]
+    """
+    per_client = max(requests // concurrency, 1)
+    latencies = []
+    start = threading.Barrier(concurrency + 1)
+
+    def client(number: int) -> None:
+        test_client = app.test_client()
+        durations = []
+        start.wait()
+
+        for i in range(per_client):
+            started = time.perf_counter()
+            response = test_client.post("/api/v1.0/questions", json={
+                "question": f"Question {number}-{i}",
+                "answer": f"Answer {number}-{i}",
+                "category": 1 + i % CATEGORIES,
+                "difficulty": 1 + i % 5,
+            })
+            durations.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 201, response.status_code
+
+        latencies.extend(durations)
+
+    threads = [threading.Thread(target=client, args=(number,))
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "per second": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+def main(url: str = None, requests: str = "2000",
+         delay: str = "0.005") -> None:
+    """Print throughput of every concurrency with and without the writer."""
+    url = url or os.environ.get("TRIVIA_BENCH_DB_URL", DEFAULT_URL)
+    requests, delay = int(requests), float(delay)
+
+    apps = {
+        "per request": create_app(bench_config(url, False, delay)),
+        "group commit": create_app(bench_config(url, True, delay)),
+    }
+    create_schema(apps["per request"])
+
+    print(f"{requests} questions per run, group commit delay "
+          f"{delay * 1000:g} ms")
+    print(f"{'clients':>8}{'mode':>14}{'per second':>12}{'p50 ms':>9}"
+          f"{'p99 ms':>9}")
+    for concurrency in CONCURRENCY:
+        for mode, app in apps.items():
+            result = measure(app, concurrency, requests)
+            with app.app_context():
+                db.engine.dispose()
+            print(f"{concurrency:8}{mode:>14}{result['per second']:12.0f}"
+                  f"{result['p50']:9.2f}{result['p99']:9.2f}")
+
+    with apps["per request"].app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+        db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
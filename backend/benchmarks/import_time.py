@@ -0,0 +1,71 @@
+"""Import time of the app measured with `python -X importtime`.
+
+Run from the `backend` directory, with a function of the module to call
+after the import (`create_app` for the app factory):
+
+    python -m benchmarks.import_time [module] [function]
+"""
+
+import subprocess
+import sys
+from typing import Dict, Tuple
+
+DEFAULT_MODULE = "flaskr"
+
+# modules which must not be imported to serve requests
+HEAVY_MODULES = ("pandas", "numpy", "distutils", "alembic")
+
+
+def measure_import(module: str = DEFAULT_MODULE,
+                   function: str = None) -> Tuple[int, Dict[str, int]]:
+    """Import the module in a fresh interpreter and return the timing.
+
+    :param module: name of the module to import
+    :module type: str
+    :param function: name of a function of the module called (without
+        arguments) after the import, its imports are measured too
+    :function type: str
+    :return: total import time of the module (and of the function) in
+        microseconds and cumulative time of every imported module
+    :rtype: Tuple[int, Dict[str, int]]
+    """
+    code = f"import {module}"
+    if function:
+        code += f"; {module}.{function}()"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True)
+
+    total, modules = 0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = int(cumulative)
+        # top level imports from the module on, the interpreter start
+        # up imports are reported before it
+        if module in modules and not name[1:].startswith(" "):
+            total += int(cumulative)
+
+    return total, modules
+
+
+def main(module: str = DEFAULT_MODULE, function: str = None) -> None:
+    """Print the total import time and the slowest imports."""
+    total, modules = measure_import(module, function)
+    called = f", {function}()" if function else ""
+    print(f"import {module}{called}: {total / 1000:.1f} ms")
+
+    slowest = sorted(modules.items(), key=lambda item: item[1],
+                     reverse=True)[:15]
+    for name, cumulative in slowest:
+        print(f"{cumulative / 1000:10.1f} ms  {name}")
+
+    heavy = [m for m in modules if m.split(".")[0] in HEAVY_MODULES]
+    if heavy:
+        print(f"heavy modules imported: {', '.join(sorted(heavy))}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,142 @@
+"""Latency of per category queries before and after partitioning.
+
+Needs a postgres database, the benchmark works in its own schema
+`trivia_bench` (dropped and created again). Run from the `backend`
+directory:
+
+    python -m benchmarks.partitioning [database url] [rows] [categories]
+
+The url defaults to `TRIVIA_BENCH_DB_URL` or
+`postgresql://postgres@localhost/postgres`.
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Dict
+
+from sqlalchemy import create_engine, text
+
+import partitioning
+from models import db
+
+SCHEMA = "trivia_bench"
+
+DEFAULT_URL = "postgresql://postgres@localhost/postgres"
+
+QUERIES = {
+    "questions of category": (
+        "SELECT id, category_id, question_text, answer, difficulty "
+        "FROM questions WHERE category_id = :category_id ORDER BY id"),
+    "count of category": (
+        "SELECT count(*) FROM questions WHERE category_id = :category_id"),
+    "quiz draw in category": (
+        "SELECT id FROM questions WHERE category_id = :category_id "
+        "AND difficulty BETWEEN 2 AND 4 ORDER BY random() LIMIT 10"),
+    "question by id": (
+        "SELECT id, question_text FROM questions WHERE id = :question_id"),
+}
+
+
+def create_schema(engine, rows: int, categories: int) -> None:
+    """Create the tables in the benchmark schema and fill them."""
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    db.Model.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO categories (type) "
+            "SELECT 'Category ' || g FROM generate_series(1, :categories) g"),
+            {"categories": categories})
+        connection.execute(text(
+            "INSERT INTO questions "
+            "(question_text, answer, category_id, difficulty) "
+            "SELECT 'Question ' || g, 'Answer ' || g, "
+            "1 + g % :categories, 1 + g % 5 "
+            "FROM generate_series(1, :rows) g"),
+            {"rows": rows, "categories": categories})
+
+    analyze(engine)
+
+
+def analyze(engine) -> None:
+    """Update planner statistics of the tables."""
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT") \
+                  .execute(text("ANALYZE"))
+
+
+def timed(call: Callable[[], None], repeat: int) -> float:
+    """Return median duration of the call in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        durations.append((time.perf_counter() - started) * 1000)
+
+    return statistics.median(durations)
+
+
+def measure(engine, rows: int, categories: int,
+            repeat: int) -> Dict[str, float]:
+    """Return median latency of every query and of a category delete."""
+    results = {}
+
+    with engine.connect() as connection:
+        for name, query in QUERIES.items():
+            def run():
+                connection.execute(text(query), {
+                    "category_id": random.randint(1, categories),
+                    "question_id": random.randint(1, rows),
+                }).fetchall()
+
+            results[name] = timed(run, repeat)
+
+        def delete_category():
+            transaction = connection.begin()
+            connection.execute(
+                text("DELETE FROM questions WHERE category_id = :id"),
+                {"id": random.randint(1, categories)})
+            transaction.rollback()
+
+        results["delete of category"] = timed(delete_category,
+                                              max(repeat // 4, 1))
+
+    return results
+
+
+def main(url: str = None, rows: str = "1000000",
+         categories: str = "100", repeat: str = "40") -> None:
+    """Print latencies of the plain and the partitioned table."""
+    url = url or os.environ.get("TRIVIA_BENCH_DB_URL", DEFAULT_URL)
+    rows, categories, repeat = int(rows), int(categories), int(repeat)
+
+    engine = create_engine(url, connect_args={
+        "options": f"-csearch_path={SCHEMA}"})
+
+    print(f"{rows} questions in {categories} categories")
+    create_schema(engine, rows, categories)
+    plain = measure(engine, rows, categories, repeat)
+
+    started = time.perf_counter()
+    partitioning.partition_questions(engine, batch_size=50000,
+                                     log=lambda message: None)
+    print(f"partitioned online in {time.perf_counter() - started:.1f} s")
+    analyze(engine)
+    partitioned = measure(engine, rows, categories, repeat)
+
+    print(f"{'median ms':24}{'plain':>10}{'partitioned':>14}")
+    for name in plain:
+        print(f"{name:24}{plain[name]:10.2f}{partitioned[name]:14.2f}")
+
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
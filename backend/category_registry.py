@@ -0,0 +1,226 @@
+"""Categories shared by the worker processes of a host.
+
+Categories are read on almost every request and change rarely. The registry
+keeps them in a file of a shared memory filesystem (`/dev/shm`) with a
+version stamp in a separate, memory-mapped file:
+
+- a reader compares the stamp with the version it has parsed, a read of an
+  unchanged registry touches neither the db nor the filesystem,
+- a writer publishes a new version by replacing the data file and then
+  increasing the stamp, under a file lock, readers see the old or the new
+  version whole.
+
+If the shared files can not be created, the registry keeps the categories
+in the memory of the process. In both cases the categories are loaded from
+the db again after `ttl` seconds, to see changes not made by the models.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from logs import logger
+
+# version, publish time (seconds since epoch), payload length
+DATA_HEADER = struct.Struct("<QdI")
+STAMP = struct.Struct("<Q")
+
+# category id: (type, question count)
+Categories = Dict[int, Tuple[str, int]]
+
+
+class CategoryRegistry:
+    """Versioned categories, shared by processes if a path is opened.
+
+    :param ttl: seconds after which published categories are loaded again
+    :ttl type: float
+    """
+
+    def __init__(self, ttl: float = 60):
+        """Create a registry kept in the process until `open` is called."""
+        self.ttl = ttl
+        self.path = None
+
+        self._stamp = None
+        self._version = 0
+        self._published_at = 0.0
+        self._categories = None
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self) -> bool:
+        """Check if the registry is shared with other processes."""
+        return self._stamp is not None
+
+    @property
+    def version(self) -> int:
+        """Return the version of the categories read by the process."""
+        return self._version
+
+    def open(self, path: str) -> bool:
+        """Share the registry through files at the path.
+
+        :param path: path of the data file, the stamp and the lock files get
+            suffixes
+        :path type: str
+        :return: True if shared, False if kept in the process
+        :rtype: bool
+        """
+        try:
+            fd = os.open(f"{path}.version", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < STAMP.size:
+                    os.ftruncate(fd, STAMP.size)
+                stamp = mmap.mmap(fd, STAMP.size)
+            finally:
+                os.close(fd)
+
+        except OSError as e:
+            logger.warning(f"Categories are not shared, kept in the "
+                           f"process: {e}")
+            self.close()
+            return False
+
+        with self._lock:
+            self.close()
+            self.path = path
+            self._stamp = stamp
+
+        return True
+
+    def close(self) -> None:
+        """Stop sharing, keep the categories in the process."""
+        self.path = None
+        self._stamp = None
+        self._version = 0
+        self._categories = None
+
+    def get(self) -> Optional[Categories]:
+        """Return the categories, None if they have to be loaded."""
+        stamp = self._stamp
+        if stamp is not None \
+                and STAMP.unpack_from(stamp)[0] != self._version:
+            with self._lock:
+                self._read()
+
+        if self._categories is None \
+                or time.time() - self._published_at > self.ttl:
+            return None
+
+        return self._categories
+
+    def publish(self, load: Callable[[], Categories]) -> Categories:
+        """Load the categories and publish them as a new version.
+
+        Publishers of all processes run one at a time, the categories are
+        loaded with the lock held, so an older load never replaces a newer.
+        :param load: callable returning the categories from the db
+        :load type: Callable[[], Categories]
+        """
+        with self._lock, self._file_lock():
+            categories = load()
+            self._write(categories)
+
+        return categories
+
+    def invalidate(self) -> None:
+        """Make every process load the categories again."""
+        with self._lock, self._file_lock():
+            self._write(None)
+
+    def _file_lock(self):
+        """Return a context holding the lock of the shared files."""
+        return _FileLock(f"{self.path}.lock" if self.shared else None)
+
+    def _read(self) -> None:
+        """Read the shared data file, the lock has to be held."""
+        try:
+            with open(self.path, "rb") as f:
+                content = f.read()
+            version, published_at, length = \
+                DATA_HEADER.unpack_from(content)
+            payload = json.loads(content[DATA_HEADER.size:
+                                         DATA_HEADER.size + length])
+        except (OSError, struct.error, ValueError):
+            # not published yet, or by another version of the code
+            version, published_at, payload = \
+                STAMP.unpack_from(self._stamp)[0], 0.0, None
+
+        self._version = version
+        self._published_at = published_at
+        self._categories = {
+            category_id: (category_type, question_count)
+            for category_id, category_type, question_count in payload
+        } if payload is not None else None
+
+    def _write(self, categories: Optional[Categories]) -> None:
+        """Publish a new version, the locks have to be held."""
+        published_at = time.time()
+
+        if self.shared:
+            version = STAMP.unpack_from(self._stamp)[0] + 1
+            payload = json.dumps(None if categories is None else [
+                [category_id, category_type, question_count]
+                for category_id, (category_type, question_count)
+                in sorted(categories.items())
+            ]).encode()
+
+            temporary = f"{self.path}.{uuid.uuid4().hex}"
+            with open(temporary, "wb") as f:
+                f.write(DATA_HEADER.pack(version, published_at,
+                                         len(payload)))
+                f.write(payload)
+            os.replace(temporary, self.path)
+            STAMP.pack_into(self._stamp, 0, version)
+
+        else:
+            version = self._version + 1
+
+        self._version = version
+        self._published_at = published_at
+        self._categories = categories
+
+
+class _FileLock:
+    """Exclusive lock of a file, no-op without a path."""
+
+    def __init__(self, path: Optional[str]):
+        """Create a lock."""
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        """Acquire the lock."""
+        if self.path is not None:
+            self._file = open(self.path, "w")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the lock."""
+        if self._file is not None:
+            self._file.close()
+
+
+def registry_path(directory: str, database_uri: str) -> Optional[str]:
+    """Return path of the registry of the database, None if not shareable.
+
+    Processes share the registry of the same database, an in-memory sqlite
+    database is not shared.
+    :param directory: directory of the registry files
+    :directory type: str
+    :param database_uri: SQLAlchemy uri of the database
+    :database_uri type: str
+    """
+    if database_uri in ("sqlite://", "sqlite:///:memory:"):
+        return None
+
+    digest = hashlib.sha256(database_uri.encode()).hexdigest()[:16]
+    return os.path.join(directory, f"trivia-categories-{digest}")
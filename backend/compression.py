@@ -0,0 +1,105 @@
+"""Compression of the api responses.
+
+The response body is compressed with brotli (if the `brotli` package is
+installed) or gzip, whichever the client prefers in `Accept-Encoding`.
+Small bodies are sent as they are, compression would not pay off.
+
+Compressed bodies are kept in a cache keyed by the digest of the body, a hot
+response (the same categories, the same page of questions) is compressed once
+and then served from the cache.
+"""
+
+import gzip
+import hashlib
+
+from cache import LruCache
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover, brotli is optional
+    brotli = None
+
+
+def available_encodings() -> list:
+    """Return supported encodings, the preferred first."""
+    if brotli is not None:
+        return ["br", "gzip"]
+
+    return ["gzip"]
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6,
+             brotli_level: int = 4) -> bytes:
+    """Return the body compressed.
+
+    :param body: body to compress
+    :body type: bytes
+    :param encoding: `br` or `gzip`
+    :encoding type: str
+    :param gzip_level: gzip compression level, 1 - 9
+    :gzip_level type: int
+    :param brotli_level: brotli compression level, 0 - 11
+    :brotli_level type: int
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_level)
+
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+def init_compression(app) -> None:
+    """Register compression of the app responses.
+
+    Has to be called before other `after_request` functions are registered,
+    they are called in the reverse order and the compression has to see the
+    final response.
+    Configuration is taken from the app config: `COMPRESS_ENABLED`,
+    `COMPRESS_MIN_SIZE`, `COMPRESS_GZIP_LEVEL`, `COMPRESS_BROTLI_LEVEL`,
+    `COMPRESS_CACHE_SIZE`, `COMPRESS_MIMETYPES`, `COMPRESS_EXEMPT_ENDPOINTS`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    config = app.config
+    if not config["COMPRESS_ENABLED"]:
+        return
+
+    cache = LruCache(config["COMPRESS_CACHE_SIZE"])
+    encodings = available_encodings()
+
+    app.extensions["compression"] = cache
+
+    @app.after_request
+    def compress_response(response):
+        """Compress the body if the client accepts it and it is big enough."""
+        response.vary.add("Accept-Encoding")
+
+        if (request.method == "HEAD"
+                or request.endpoint in config["COMPRESS_EXEMPT_ENDPOINTS"]
+                or response.direct_passthrough
+                or response.is_streamed
+                or not 200 <= response.status_code < 300
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in config["COMPRESS_MIMETYPES"]):
+            return response
+
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        body = response.get_data()
+        if len(body) < config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress(body, encoding,
+                                  config["COMPRESS_GZIP_LEVEL"],
+                                  config["COMPRESS_BROTLI_LEVEL"])
+            cache.put(key, compressed)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+
+        return response
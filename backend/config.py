@@ -1,6 +1,7 @@
 """Module with Flask configurations."""
 
 import os
+import tempfile
 from enum import Enum
 
 
@@ -38,6 +39,11 @@ class PostgresDbParams:
                 if not self.database:
                     self.database = "trivia_test"
 
+                # one database per process of parallel run (pytest-xdist)
+                worker = os.environ.get("PYTEST_XDIST_WORKER")
+                if worker:
+                    self.database = f"{self.database}_{worker}"
+
         if enviroment == Enviroment.PROD:
 
             self.username = os.environ.get("TRIVIA_DB_USERNAME_PROD")
@@ -61,16 +67,229 @@ class PostgresDbParams:
                         f"/{self.database}"
 
 
+class LazyConnStr:
+    """Connection string built from the environment on the first access.
+
+    Used as a class attribute, so the db parameters are not read when the
+    module is imported, but when the config is loaded into the app.
+    :param enviroment: enviroment to build the connection string for
+    :enviroment type: `Enviroment`
+    """
+
+    def __init__(self, enviroment: Enviroment):
+        """Create a descriptor."""
+        self.enviroment = enviroment
+
+    def __get__(self, instance, owner) -> str:
+        """Return the connection string."""
+        return PostgresDbParams(self.enviroment).conn_str
+
+
 class Config:
     """Configuration of the flask app for a production."""
 
     SECRET_KEY = os.urandom(32)
-    SQLALCHEMY_DATABASE_URI = PostgresDbParams(Enviroment.PROD).conn_str
+    SQLALCHEMY_DATABASE_URI = LazyConnStr(Enviroment.PROD)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # register Flask-Migrate for every app, not only for the `flask` command
+    # line (`flask db` commands), not needed for serving
+    MIGRATE_ENABLED = \
+        os.environ.get("TRIVIA_MIGRATE_ENABLED", "False").capitalize() \
+        == "True"
+
+    # admission control, see `admission.py`
+    ADMISSION_ENABLED = \
+        os.environ.get("TRIVIA_ADMISSION_ENABLED", "True").capitalize() \
+        == "True"
+    ADMISSION_MAX_CONCURRENCY = \
+        int(os.environ.get("TRIVIA_ADMISSION_MAX_CONCURRENCY", 8))
+    ADMISSION_MAX_QUEUE = int(os.environ.get("TRIVIA_ADMISSION_MAX_QUEUE", 32))
+    # seconds a request can wait for a slot before 503 is returned
+    ADMISSION_QUEUE_TIMEOUT = \
+        float(os.environ.get("TRIVIA_ADMISSION_QUEUE_TIMEOUT", 2.0))
+    # endpoint: priority, 0 high, 1 normal, 2 low; other reads are high,
+    # other writes normal
+    ADMISSION_ROUTE_PRIORITIES = {
+        "search": 2,
+        "create_question": 2,
+    }
+    # event streams are long lived, they would hold the slots
+    ADMISSION_EXEMPT_ENDPOINTS = {"static", "events_stream"}
+    # per client token bucket, disabled if not set
+    RATE_LIMIT_PER_SECOND = \
+        float(os.environ.get("TRIVIA_RATE_LIMIT_PER_SECOND", 0)) or None
+    RATE_LIMIT_BURST = int(os.environ.get("TRIVIA_RATE_LIMIT_BURST", 20))
+    # buckets shared by all processes, in-process if not set
+    RATE_LIMIT_REDIS_URL = os.environ.get("TRIVIA_RATE_LIMIT_REDIS_URL")
+
+    # quiz draws, seconds after which question buckets are reloaded from db
+    # (changes made by other processes), number of cached alias tables
+    QUIZ_BUCKETS_TTL = float(os.environ.get("TRIVIA_QUIZ_BUCKETS_TTL", 60))
+    QUIZ_ALIAS_TABLES = int(os.environ.get("TRIVIA_QUIZ_ALIAS_TABLES", 256))
+    # the highest number of questions of a quiz returned in one call
+    QUIZ_BATCH_MAX = int(os.environ.get("TRIVIA_QUIZ_BATCH_MAX", 50))
+
+    # POST /api/v1.0/quizzes/attempts, see `attempts.py`; attempts are
+    # written when QUIZ_ATTEMPTS_FLUSH_SIZE of them wait or every
+    # QUIZ_ATTEMPTS_FLUSH_INTERVAL seconds, at most QUIZ_ATTEMPTS_MAX_PENDING
+    # wait in a process; the highest number of attempts in one call
+    QUIZ_ATTEMPTS_FLUSH_SIZE = \
+        int(os.environ.get("TRIVIA_QUIZ_ATTEMPTS_FLUSH_SIZE", 500))
+    QUIZ_ATTEMPTS_FLUSH_INTERVAL = \
+        float(os.environ.get("TRIVIA_QUIZ_ATTEMPTS_FLUSH_INTERVAL", 1.0))
+    QUIZ_ATTEMPTS_MAX_PENDING = \
+        int(os.environ.get("TRIVIA_QUIZ_ATTEMPTS_MAX_PENDING", 50000))
+    QUIZ_ATTEMPTS_MAX_BATCH = \
+        int(os.environ.get("TRIVIA_QUIZ_ATTEMPTS_MAX_BATCH", 50))
+
+    # games kept on the leaderboard of a category and of all games, see
+    # `models.LeaderboardEntry`; the default number of games returned
+    LEADERBOARD_SIZE = int(os.environ.get("TRIVIA_LEADERBOARD_SIZE", 100))
+    LEADERBOARD_DEFAULT_LIMIT = \
+        int(os.environ.get("TRIVIA_LEADERBOARD_DEFAULT_LIMIT", 10))
+
+    # near-duplicate questions, see `dedupe.py`; what happens to a new
+    # question similar to an existing one: off, warn, reject or merge; the
+    # lowest estimated similarity (0 - 1) of a duplicate; seconds after
+    # which the index is reloaded from db (changes made by other processes)
+    QUESTION_DEDUPE_MODE = \
+        os.environ.get("TRIVIA_QUESTION_DEDUPE_MODE", "warn").lower()
+    QUESTION_DEDUPE_THRESHOLD = \
+        float(os.environ.get("TRIVIA_QUESTION_DEDUPE_THRESHOLD", 0.8))
+    QUESTION_DEDUPE_TTL = \
+        float(os.environ.get("TRIVIA_QUESTION_DEDUPE_TTL", 300))
+
+    # formatted questions looked up by id, seconds after which a question is
+    # read from db again (changes made by other processes)
+    QUESTION_CACHE_SIZE = \
+        int(os.environ.get("TRIVIA_QUESTION_CACHE_SIZE", 1024))
+    QUESTION_CACHE_TTL = \
+        float(os.environ.get("TRIVIA_QUESTION_CACHE_TTL", 60))
+
+    # categories shared by the workers of a host, see `category_registry.py`,
+    # in a shared memory filesystem; kept in each process if not shared,
+    # loaded from db again after CATEGORY_REGISTRY_TTL seconds
+    CATEGORY_REGISTRY_SHARED = os.environ.get(
+        "TRIVIA_CATEGORY_REGISTRY_SHARED", "True").capitalize() == "True"
+    CATEGORY_REGISTRY_DIR = os.environ.get(
+        "TRIVIA_CATEGORY_REGISTRY_DIR",
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+    CATEGORY_REGISTRY_TTL = \
+        float(os.environ.get("TRIVIA_CATEGORY_REGISTRY_TTL", 60))
+
+    # POST /api/v1.0/questions, questions of concurrent requests created in
+    # one transaction by a writer thread, see `group_commit.py`; the writer
+    # waits QUESTION_GROUP_COMMIT_DELAY seconds for up to
+    # QUESTION_GROUP_COMMIT_MAX_SIZE questions, a request waits at most
+    # QUESTION_GROUP_COMMIT_TIMEOUT seconds for the commit (then 503)
+    QUESTION_GROUP_COMMIT = \
+        os.environ.get("TRIVIA_QUESTION_GROUP_COMMIT", "False").capitalize() \
+        == "True"
+    QUESTION_GROUP_COMMIT_DELAY = \
+        float(os.environ.get("TRIVIA_QUESTION_GROUP_COMMIT_DELAY", 0.005))
+    QUESTION_GROUP_COMMIT_MAX_SIZE = \
+        int(os.environ.get("TRIVIA_QUESTION_GROUP_COMMIT_MAX_SIZE", 100))
+    QUESTION_GROUP_COMMIT_TIMEOUT = \
+        float(os.environ.get("TRIVIA_QUESTION_GROUP_COMMIT_TIMEOUT", 10))
+
+    # the highest number of questions requested by ids in one call
+    QUESTIONS_IDS_MAX = int(os.environ.get("TRIVIA_QUESTIONS_IDS_MAX", 100))
+
+    # GET /api/v1.0/questions/changes, default and the highest page size
+    QUESTION_CHANGES_PAGE_SIZE = \
+        int(os.environ.get("TRIVIA_QUESTION_CHANGES_PAGE_SIZE", 100))
+    QUESTION_CHANGES_MAX_PAGE_SIZE = \
+        int(os.environ.get("TRIVIA_QUESTION_CHANGES_MAX_PAGE_SIZE", 1000))
+
+    # POST /api/v1.0/batch, the highest number of sub-requests, reads
+    # handled concurrently by a pool of BATCH_MAX_WORKERS threads if enabled
+    BATCH_MAX_REQUESTS = int(os.environ.get("TRIVIA_BATCH_MAX_REQUESTS", 20))
+    BATCH_CONCURRENT_READS = \
+        os.environ.get("TRIVIA_BATCH_CONCURRENT_READS", "False").capitalize() \
+        == "True"
+    BATCH_MAX_WORKERS = int(os.environ.get("TRIVIA_BATCH_MAX_WORKERS", 4))
+
+    # GET /api/v1.0/events, seconds between heartbeats of an idle stream,
+    # subscribers per process, events waiting for a slow subscriber before
+    # it is dropped
+    EVENTS_HEARTBEAT = float(os.environ.get("TRIVIA_EVENTS_HEARTBEAT", 15))
+    EVENTS_MAX_SUBSCRIBERS = \
+        int(os.environ.get("TRIVIA_EVENTS_MAX_SUBSCRIBERS", 1000))
+    EVENTS_QUEUE_SIZE = int(os.environ.get("TRIVIA_EVENTS_QUEUE_SIZE", 100))
+
+    # response compression, see `compression.py`, bodies smaller than
+    # COMPRESS_MIN_SIZE bytes are sent uncompressed
+    COMPRESS_ENABLED = \
+        os.environ.get("TRIVIA_COMPRESS_ENABLED", "True").capitalize() \
+        == "True"
+    COMPRESS_MIN_SIZE = int(os.environ.get("TRIVIA_COMPRESS_MIN_SIZE", 500))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get("TRIVIA_COMPRESS_GZIP_LEVEL", 6))
+    COMPRESS_BROTLI_LEVEL = \
+        int(os.environ.get("TRIVIA_COMPRESS_BROTLI_LEVEL", 4))
+    # number of compressed bodies kept in memory
+    COMPRESS_CACHE_SIZE = \
+        int(os.environ.get("TRIVIA_COMPRESS_CACHE_SIZE", 256))
+    COMPRESS_MIMETYPES = {"application/json"}
+    COMPRESS_EXEMPT_ENDPOINTS = {"static", "events_stream"}
+
+    # static snapshot of the question bank, see `snapshots.py`, not built
+    # if SNAPSHOT_DIR is not set; the files are served from SNAPSHOT_URL by
+    # a web server, SNAPSHOT_KEEP versions are kept
+    SNAPSHOT_DIR = os.environ.get("TRIVIA_SNAPSHOT_DIR")
+    SNAPSHOT_URL = os.environ.get("TRIVIA_SNAPSHOT_URL", "/snapshots")
+    SNAPSHOT_KEEP = int(os.environ.get("TRIVIA_SNAPSHOT_KEEP", 3))
+    # rebuilt SNAPSHOT_BUILD_DELAY seconds after a change is committed
+    SNAPSHOT_AUTO_BUILD = \
+        os.environ.get("TRIVIA_SNAPSHOT_AUTO_BUILD", "True").capitalize() \
+        == "True"
+    SNAPSHOT_BUILD_DELAY = \
+        float(os.environ.get("TRIVIA_SNAPSHOT_BUILD_DELAY", 5))
+    # files are compressed once per version, the highest levels pay off
+    SNAPSHOT_GZIP_LEVEL = int(os.environ.get("TRIVIA_SNAPSHOT_GZIP_LEVEL", 9))
+    SNAPSHOT_BROTLI_LEVEL = \
+        int(os.environ.get("TRIVIA_SNAPSHOT_BROTLI_LEVEL", 11))
+    # seconds clients and proxies may cache the manifest
+    SNAPSHOT_MANIFEST_MAX_AGE = \
+        int(os.environ.get("TRIVIA_SNAPSHOT_MANIFEST_MAX_AGE", 10))
+
+    # read-only binary question store mapped by every worker, see
+    # `question_store.py`; when a store is built in QUESTION_STORE_DIR, the
+    # question lists, lookups by id and quiz draws are served from it
+    QUESTION_STORE_DIR = os.environ.get("TRIVIA_QUESTION_STORE_DIR")
+    # seconds between checks for a new store, store files kept
+    QUESTION_STORE_CHECK_INTERVAL = \
+        float(os.environ.get("TRIVIA_QUESTION_STORE_CHECK_INTERVAL", 1))
+    QUESTION_STORE_KEEP = int(os.environ.get("TRIVIA_QUESTION_STORE_KEEP", 2))
+
+    # logging, records are json lines written by a background thread
+    LOG_FILE = os.environ.get("TRIVIA_LOG_FILE", "err_record.log")
+    LOG_LEVEL = os.environ.get("TRIVIA_LOG_LEVEL", "WARNING")
+    LOG_ROTATE_WHEN = os.environ.get("TRIVIA_LOG_ROTATE_WHEN", "midnight")
+    LOG_BACKUP_COUNT = int(os.environ.get("TRIVIA_LOG_BACKUP_COUNT", 7))
+    LOG_QUEUE_SIZE = int(os.environ.get("TRIVIA_LOG_QUEUE_SIZE", 10000))
+    # fraction of 4xx responses logged, 1.0 logs all of them
+    LOG_4XX_SAMPLE_RATE = \
+        float(os.environ.get("TRIVIA_LOG_4XX_SAMPLE_RATE", 1.0))
 
 
 class TestConfig(Config):
-    """Configuration of the flask app for a test env."""
+    """Configuration of the flask app for a test env.
+
+    Tests run against in-memory SQLite by default, set `TRIVIA_TEST_DB` to
+    `postgres` to run them against the postgres test database.
+    """
 
-    SQLALCHEMY_DATABASE_URI = PostgresDbParams(Enviroment.TEST).conn_str
+    TEST_DB = os.environ.get("TRIVIA_TEST_DB", "sqlite").lower()
+    if TEST_DB == "postgres":
+        SQLALCHEMY_DATABASE_URI = LazyConnStr(Enviroment.TEST)
+    else:
+        SQLALCHEMY_DATABASE_URI = "sqlite://"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    MIGRATE_ENABLED = False
+    SNAPSHOT_DIR = None
+    QUESTION_STORE_DIR = None
+    # attempts are flushed by the tests
+    QUIZ_ATTEMPTS_FLUSH_INTERVAL = 3600
+    LOG_FILE = os.environ.get(
+        "TRIVIA_LOG_FILE",
+        os.path.join(tempfile.gettempdir(), "trivia_test.log"))
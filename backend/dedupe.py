@@ -0,0 +1,355 @@
+"""Near-duplicate detection of questions.
+
+Every question has a MinHash signature of its text stored in the db (see
+`minhash` and `models.QuestionSignature`). A process keeps an LSH index of
+the signatures in memory: a question is looked up by the bands of its
+signature, only questions sharing a band are compared, the cost does not
+grow with the number of questions.
+
+`QUESTION_DEDUPE_MODE` decides what happens to a new question with an
+estimated similarity of at least `QUESTION_DEDUPE_THRESHOLD` to an existing
+one:
+
+- `warn`: the question is created, the duplicates are logged and returned,
+- `reject`: the question is not created (409 in the api),
+- `merge`: the question is not created, the existing one is returned,
+- `off`: no check.
+
+The index is loaded from the db on the first use (or by the warm up) and
+again after `QUESTION_DEDUPE_TTL` seconds (to see changes made by other
+processes). Changes committed by this process are applied right away.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import minhash
+from models import Question, QuestionSignature, on_change
+
+MODES = ("off", "warn", "reject", "merge")
+
+
+def _put(buckets: dict, signatures: dict, question_id: int,
+         signature: bytes) -> None:
+    """Add or change a question in the index dicts."""
+    _pop(buckets, signatures, question_id)
+
+    signatures[question_id] = signature
+    for band in minhash.bands(signature):
+        key = hash(band)
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = question_id
+        elif isinstance(bucket, set):
+            bucket.add(question_id)
+        else:
+            buckets[key] = {bucket, question_id}
+
+
+def _pop(buckets: dict, signatures: dict, question_id: int) -> None:
+    """Remove a question from the index dicts."""
+    signature = signatures.pop(question_id, None)
+    if signature is None:
+        return
+
+    for band in minhash.bands(signature):
+        key = hash(band)
+        bucket = buckets.get(key)
+        if not isinstance(bucket, set):
+            if bucket == question_id:
+                del buckets[key]
+            continue
+
+        bucket.discard(question_id)
+        if len(bucket) == 1:
+            buckets[key] = bucket.pop()
+
+
+class DuplicateIndex:
+    """LSH index of question signatures.
+
+    A reload reads the db and builds a new index without holding the lock,
+    the lookups use the old index until it is swapped in.
+    :param ttl: seconds after which the index is reloaded
+    :ttl type: float
+    :param threshold: the lowest similarity of a duplicate
+    :threshold type: float
+    """
+
+    def __init__(self, ttl: float = 300, threshold: float = 0.8):
+        """Create an index."""
+        self.ttl = ttl
+        self.threshold = threshold
+
+        self._lock = threading.RLock()
+        # one load at a time, lookups do not wait for it
+        self._load_lock = threading.Lock()
+        # hash of a band: id of a question, or a set of ids if shared
+        self._buckets = {}
+        self._signatures = {}
+        self._loaded_at = None
+        # changes applied during a load, replayed on the new index
+        self._changes = None
+        # increased by `clear`, a load started before is dropped
+        self._generation = 0
+
+    def __len__(self) -> int:
+        """Return the number of indexed questions."""
+        return len(self._signatures)
+
+    @property
+    def loaded(self) -> bool:
+        """Return True if the index was loaded."""
+        return self._loaded_at is not None
+
+    def clear(self) -> None:
+        """Forget the index, it is loaded again on the next use."""
+        with self._lock:
+            self._buckets = {}
+            self._signatures = {}
+            self._loaded_at = None
+            self._generation += 1
+
+    def load(self, rows: Iterable[Tuple[int, bytes]] = None) -> None:
+        """Load the index.
+
+        :param rows: (question id, signature) of all questions, loaded from
+            the db if not provided (needs app context)
+        :rows type: Iterable[Tuple[int, bytes]]
+        """
+        with self._load_lock:
+            self._load(rows)
+
+    def _load(self, rows: Iterable[Tuple[int, bytes]] = None) -> None:
+        """Build a new index and swap it in, the load lock has to be held."""
+        with self._lock:
+            generation = self._generation
+            self._changes = []
+
+        try:
+            if rows is None:
+                rows = QuestionSignature.get_all()
+
+            buckets, signatures = {}, {}
+            for question_id, signature in rows:
+                _put(buckets, signatures, question_id, bytes(signature))
+
+            with self._lock:
+                if generation != self._generation:
+                    return
+
+                # committed after the rows were read, or notified late
+                for question_id, signature in self._changes:
+                    if signature is None:
+                        _pop(buckets, signatures, question_id)
+                    else:
+                        _put(buckets, signatures, question_id, signature)
+
+                self._buckets, self._signatures = buckets, signatures
+                self._loaded_at = time.monotonic()
+
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def _ensure_loaded(self) -> None:
+        """Load the index if not loaded, reload it if expired.
+
+        Called without the lock. An index never loaded is waited for, a
+        reload of an expired index is left to the thread which started it.
+        """
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._load()
+
+        elif time.monotonic() - self._loaded_at > self.ttl \
+                and self._load_lock.acquire(blocking=False):
+            try:
+                # another thread may have reloaded meanwhile
+                loaded_at = self._loaded_at
+                if loaded_at is None or \
+                        time.monotonic() - loaded_at > self.ttl:
+                    self._load()
+            finally:
+                self._load_lock.release()
+
+    def add(self, question_id: int, signature: bytes) -> None:
+        """Add or change a question.
+
+        :param question_id: id of the question
+        :question_id type: int
+        :param signature: `minhash.signature` of the question text
+        :signature type: bytes
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((question_id, signature))
+            if self._loaded_at is not None:
+                _put(self._buckets, self._signatures, question_id,
+                     signature)
+
+    def remove(self, question_id: int) -> None:
+        """Remove a question.
+
+        :param question_id: id of the question
+        :question_id type: int
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((question_id, None))
+            _pop(self._buckets, self._signatures, question_id)
+
+    def find(self, signature: bytes, threshold: float = None,
+             limit: int = 5) -> List[Tuple[int, float]]:
+        """Return questions similar to the signature, the closest first.
+
+        Loads the index if needed (needs app context then).
+        :param signature: `minhash.signature` of a text
+        :signature type: bytes
+        :param threshold: the lowest similarity, `threshold` if not given
+        :threshold type: float
+        :param limit: the highest number of questions returned
+        :limit type: int
+        :return: (question id, estimated similarity) pairs
+        :rtype: List[Tuple[int, float]]
+        """
+        if threshold is None:
+            threshold = self.threshold
+
+        self._ensure_loaded()
+        with self._lock:
+            candidates = set()
+            for band in minhash.bands(signature):
+                bucket = self._buckets.get(hash(band))
+                if isinstance(bucket, set):
+                    candidates.update(bucket)
+                elif bucket is not None:
+                    candidates.add(bucket)
+
+            found = [(question_id, minhash.similarity(
+                        signature, self._signatures[question_id]))
+                     for question_id in candidates]
+
+        found = [pair for pair in found if pair[1] >= threshold]
+        found.sort(key=lambda pair: (-pair[1], pair[0]))
+        return found[:limit]
+
+
+duplicate_index = DuplicateIndex()
+
+
+def init_dedupe(app) -> None:
+    """Configure the index from the app config.
+
+    Configuration keys: `QUESTION_DEDUPE_MODE`, `QUESTION_DEDUPE_THRESHOLD`,
+    `QUESTION_DEDUPE_TTL`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    if app.config["QUESTION_DEDUPE_MODE"] not in MODES:
+        raise ValueError(f"QUESTION_DEDUPE_MODE has to be one of {MODES}.")
+
+    duplicate_index.ttl = app.config["QUESTION_DEDUPE_TTL"]
+    duplicate_index.threshold = app.config["QUESTION_DEDUPE_THRESHOLD"]
+
+
+@on_change
+def _update_index(event_name: str, data: dict) -> None:
+    """Apply a committed question change to the index."""
+    if event_name in ('question.created', 'question.updated'):
+        # not signed if the index is not used by the process
+        if duplicate_index.loaded:
+            duplicate_index.add(data['id'],
+                                QuestionSignature.sign(data['question']))
+
+    elif event_name == 'question.deleted':
+        duplicate_index.remove(data['id'])
+
+
+def find_duplicates(text: str, threshold: float = None,
+                    limit: int = 5) -> List[Tuple[int, float]]:
+    """Return questions similar to the text, see `DuplicateIndex.find`."""
+    return duplicate_index.find(QuestionSignature.sign(text), threshold,
+                                limit)
+
+
+def format_duplicates(duplicates: List[Tuple[int, float]]) -> List[dict]:
+    """Return duplicates in format easy to serialize with json."""
+    return [{"id": question_id, "similarity": round(similarity, 3)}
+            for question_id, similarity in duplicates]
+
+
+def find_clusters(threshold: float = 0.8,
+                  rows: Iterable[Tuple[int, bytes]] = None) -> List[List[int]]:
+    """Return groups of near-duplicate questions of the whole bank.
+
+    The signatures are bucketed by their bands, only questions sharing a
+    bucket are compared; similar pairs are joined into clusters (union-find).
+    :param threshold: the lowest similarity of two questions of a cluster
+    :threshold type: float
+    :param rows: (question id, signature) of all questions, loaded from the
+        db if not provided (needs app context)
+    :rows type: Iterable[Tuple[int, bytes]]
+    :return: ids of the questions of every cluster, sorted; the clusters in
+        the order of their lowest ids
+    :rtype: List[List[int]]
+    """
+    if rows is None:
+        rows = QuestionSignature.get_all()
+
+    signatures = {question_id: bytes(signature)
+                  for question_id, signature in rows}
+    buckets = {}
+    for question_id, signature in signatures.items():
+        for band in minhash.bands(signature):
+            buckets.setdefault(band, []).append(question_id)
+
+    parents = {}
+
+    def root(question_id: int) -> int:
+        while parents.get(question_id, question_id) != question_id:
+            question_id = parents[question_id]
+        return question_id
+
+    compared = set()
+    for bucket in buckets.values():
+        for i, first in enumerate(bucket):
+            for second in bucket[i + 1:]:
+                pair = (first, second)
+                if pair in compared:
+                    continue
+                compared.add(pair)
+
+                if minhash.similarity(signatures[first],
+                                      signatures[second]) >= threshold:
+                    parents[root(second)] = root(first)
+
+    clusters = {}
+    for question_id in parents:
+        clusters.setdefault(root(question_id), []).append(question_id)
+    clusters = [sorted(set(ids) | {top}) for top, ids in clusters.items()]
+    return sorted(clusters)
+
+
+def dedupe_report(threshold: float = 0.8) -> List[dict]:
+    """Return the near-duplicate clusters with the question texts.
+
+    Signatures missing in the db (questions loaded by sql) are stored
+    first. Needs app context.
+    :param threshold: the lowest similarity of two questions of a cluster
+    :threshold type: float
+    :return: clusters, each a dict with its `questions` formatted
+    :rtype: List[dict]
+    """
+    QuestionSignature.backfill()
+    clusters = find_clusters(threshold)
+
+    questions: Dict[int, dict] = {
+        data["id"]: data for data in
+        Question.get_many_formatted([i for ids in clusters for i in ids])}
+
+    return [{"questions": [questions[question_id] for question_id in ids
+                           if question_id in questions]}
+            for ids in clusters]
@@ -0,0 +1,344 @@
+"""Server-sent events of committed data changes.
+
+Committed changes (see `models.on_change`) are published to subscribers of
+`GET /api/v1.0/events`:
+
+- on postgres through `NOTIFY` sent in the transaction of the change (and
+  delivered on its commit), one notification carries all the events of the
+  transaction; every process of every api instance listens on a single
+  connection and passes the events to its own subscribers,
+- on other databases to the subscribers of the process only.
+
+A subscriber has a bounded queue. A subscriber too slow to read its events
+is dropped with a `reset` event, the client reconnects and fetches the
+current data again (or follows `/api/v1.0/questions/changes`).
+"""
+
+import json
+import os
+import queue
+import select
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from logs import logger
+from models import db, on_change, pop_staged_changes
+
+CHANNEL = "trivia_events"
+
+# postgres refuses longer notification payloads (8000 bytes)
+MAX_PAYLOAD_BYTES = 7999
+
+# events published to the subscribers, named by the change events
+EVENT_NAMES = {
+    "question.created": "question.created",
+    "question.updated": "question.updated",
+    "question.deleted": "question.deleted",
+    "category.created": "category.changed",
+    "category.deleted": "category.changed",
+}
+
+# put to a subscriber queue when the subscriber is dropped
+_RESET = ("reset", None)
+
+
+class Subscriber:
+    """Queue of events of one client.
+
+    :param max_queue: number of events waiting to be sent
+    :max_queue type: int
+    """
+
+    __slots__ = ("queue", "dropped")
+
+    def __init__(self, max_queue: int):
+        """Create a subscriber."""
+        # one slot is kept for the reset event
+        self.queue = queue.Queue(max_queue + 1)
+        self.dropped = False
+
+    def get(self, timeout: float) -> Optional[Tuple[str, dict]]:
+        """Return the next event, None if none came in time."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """Fan-out of events to the subscribers of the process.
+
+    :param max_subscribers: number of subscribers allowed
+    :max_subscribers type: int
+    :param max_queue: number of events waiting for a subscriber
+    :max_queue type: int
+    """
+
+    def __init__(self, max_subscribers: int = 1000, max_queue: int = 100):
+        """Create a broker."""
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def subscribers(self) -> int:
+        """Return the number of subscribers."""
+        return len(self._subscribers)
+
+    def subscribe(self) -> Optional[Subscriber]:
+        """Return a new subscriber, None if there are too many."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+
+            subscriber = Subscriber(self.max_queue)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Remove the subscriber."""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_name: str, data: dict) -> None:
+        """Put the event to the queues of all subscribers.
+
+        Never blocks, a subscriber with a full queue is dropped.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            if subscriber.dropped:
+                continue
+
+            try:
+                if subscriber.queue.qsize() < self.max_queue:
+                    subscriber.queue.put_nowait((event_name, data))
+                    continue
+            except queue.Full:
+                pass
+
+            self._drop(subscriber)
+
+    def _drop(self, subscriber: Subscriber) -> None:
+        """Remove the subscriber, tell it to reset."""
+        subscriber.dropped = True
+        self.unsubscribe(subscriber)
+        try:
+            subscriber.queue.put_nowait(_RESET)
+        except queue.Full:
+            pass
+
+    def clear(self) -> None:
+        """Drop all subscribers."""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+
+        for subscriber in subscribers:
+            self._drop(subscriber)
+
+
+broker = EventBroker()
+
+
+class PostgresListener:
+    """Thread passing `NOTIFY` events of the channel to the broker.
+
+    Started with the first subscriber of the process, uses one connection
+    regardless of the number of subscribers.
+    :param engine: engine of the postgres database
+    :engine type: `sqlalchemy.engine.Engine`
+    """
+
+    def __init__(self, engine):
+        """Create a listener."""
+        self.engine = engine
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        """Start the listening thread if not running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name="events-listener")
+            self._thread.start()
+
+    def _run(self) -> None:
+        """Listen on the channel, reconnect on a connection failure."""
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning(f"Events listener failed: {e}")
+                broker.clear()
+                threading.Event().wait(1)
+
+    def _listen(self) -> None:
+        """Pass notifications to the broker until the connection fails."""
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.set_session(autocommit=True)
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+
+            while True:
+                select.select([dbapi_connection], [], [], 60)
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    for event_name, data in json.loads(notify.payload):
+                        broker.publish(event_name, data)
+        finally:
+            connection.invalidate()
+
+
+_listener = None
+
+
+def _reset_listener() -> None:
+    """Forget the listener of the parent in a forked child."""
+    global _listener
+    _listener = None
+
+
+os.register_at_fork(after_in_child=_reset_listener)
+
+
+def init_events(app) -> None:
+    """Configure the broker from the app config.
+
+    Configuration keys: `EVENTS_MAX_SUBSCRIBERS`, `EVENTS_QUEUE_SIZE`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    broker.max_subscribers = app.config["EVENTS_MAX_SUBSCRIBERS"]
+    broker.max_queue = app.config["EVENTS_QUEUE_SIZE"]
+
+
+def subscribe() -> Optional[Subscriber]:
+    """Return a new subscriber of the broker, needs app context.
+
+    On postgres, the listener of the process is started if needed.
+    """
+    global _listener
+
+    if db.engine.dialect.name == "postgresql":
+        if _listener is None:
+            _listener = PostgresListener(db.engine)
+        _listener.ensure_started()
+
+    return broker.subscribe()
+
+
+def format_event(event_name: str, data: dict) -> str:
+    """Return the event formatted as a server-sent event."""
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(subscriber: Subscriber, heartbeat: float,
+           retry_ms: int = 3000) -> Iterator[str]:
+    """Yield events of the subscriber, a comment if there is none in time.
+
+    :param subscriber: subscriber to stream events of
+    :subscriber type: `Subscriber`
+    :param heartbeat: seconds after which an idle stream gets a comment,
+        keeps proxies from closing the connection
+    :heartbeat type: float
+    :param retry_ms: milliseconds the client waits before reconnecting
+    :retry_ms type: int
+    """
+    try:
+        yield f"retry: {retry_ms}\n\n"
+
+        while True:
+            event = subscriber.get(heartbeat)
+            if event is None and subscriber.dropped:
+                event = _RESET
+
+            elif event is None:
+                yield ": heartbeat\n\n"
+                continue
+
+            event_name, data = event
+            yield format_event(event_name, data)
+
+            if event is _RESET:
+                return
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def notify_payloads(changes: List[Tuple[str, dict]]) -> List[str]:
+    """Return `NOTIFY` payloads of the changes, as few as the limit allows.
+
+    A payload is a json list of (event name, data) pairs. An event too
+    large for a payload of its own is logged and skipped.
+    :param changes: (change event name, data) pairs
+    :changes type: List[Tuple[str, dict]]
+    :rtype: List[str]
+    """
+    payloads, parts, size = [], [], 2
+    for change_name, data in changes:
+        event_name = EVENT_NAMES.get(change_name)
+        if event_name is None:
+            continue
+
+        part = json.dumps([event_name, data])
+        part_size = len(part.encode("utf8")) + 1
+        if part_size + 2 > MAX_PAYLOAD_BYTES:
+            logger.warning(f"Event {event_name} of {data.get('id')} not "
+                           f"published, too large")
+            continue
+
+        if size + part_size > MAX_PAYLOAD_BYTES:
+            payloads.append(f"[{','.join(parts)}]")
+            parts, size = [], 2
+        parts.append(part)
+        size += part_size
+
+    if parts:
+        payloads.append(f"[{','.join(parts)}]")
+    return payloads
+
+
+@event.listens_for(Session, "before_commit")
+def _notify_changes(session) -> None:
+    """Send the changes of the committed transaction by `NOTIFY`.
+
+    Postgres delivers the notifications on commit, in a single statement
+    and without a transaction of their own.
+    """
+    changes = pop_staged_changes(session)
+    if not changes or session.get_bind().dialect.name != "postgresql":
+        return
+
+    payloads = notify_payloads(changes)
+    if payloads:
+        session.execute(
+            text("SELECT pg_notify(:channel, payload) FROM "
+                 "unnest(CAST(:payloads AS text[])) WITH ORDINALITY "
+                 "AS p(payload, n) ORDER BY n"),
+            {"channel": CHANNEL, "payloads": payloads})
+
+
+@on_change
+def _publish_change(event_name: str, data: dict) -> None:
+    """Publish a committed change to the subscribers of the process.
+
+    On postgres the change was sent by `NOTIFY` in its transaction, every
+    process gets it back from its listener.
+    """
+    event_name = EVENT_NAMES.get(event_name)
+    if event_name is not None \
+            and db.engine.dialect.name != "postgresql":
+        broker.publish(event_name, data)
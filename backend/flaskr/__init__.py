@@ -1,52 +1,87 @@
 """Backend of trivia game built as a api."""
 
-from asyncio.log import logger
 import json
-import logging
-import os
-import sys
-import random
-from distutils.log import debug
-from unicodedata import category
-from urllib import response
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 
+import click
+import dedupe
 import helpers as help
-import werkzeug
-from flask import Flask, abort, jsonify, make_response, request, url_for
+import partitioning
+import question_store
+import snapshots
+from admission import init_admission
+from attempts import init_attempts
+from batch import run_batch
+from compression import init_compression
+import events
+from group_commit import init_group_commit
+from flask import (Flask, Response, g, jsonify, make_response, request,
+                   url_for)
 from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
-from models import Category, Question, setup_db
-from sqlalchemy import exc
+from models import (Category, Game, LeaderboardEntry, Question,
+                    QuestionChange, question_cache, setup_db)
+from quiz_sampler import (draw_adaptive_question, draw_question,
+                          init_quiz_sampler)
 from werkzeug import exceptions as werk_ex
-from logging.handlers import TimedRotatingFileHandler
+from logs import log_request, logger, setup_logging
 
 
 QUESTIONS_PER_PAGE = 10
 
 
-def create_app():
-    """Create and configure the app."""
-    logging.basicConfig(filename='err_record.log', level=logging.WARNING,
-                        format=f"%(asctime)s %(levelname)s "
-                               f"%(name)s %(threadName)s "
-                               f"%(lineno)d %(funcName)s : %(message)s"
-                        )
+def create_app(config: str = 'config.Config'):
+    """Create and configure the app.
 
+    :param config: configuration object or its import path
+    :config type: str
+    """
     app = Flask(__name__)
-    app.config.from_object('config.Config')
+    app.config.from_object(config)
+    setup_logging(app)
     db = setup_db(app)
+    init_quiz_sampler(app)
+    dedupe.init_dedupe(app)
+    events.init_events(app)
+    snapshots.init_snapshots(app)
+    question_store.init_question_store(app)
+    init_group_commit(app)
+    init_attempts(app)
     CORS(app)
 
+    @app.before_request
+    def before_request():
+        """Mark the request start and assign the request id."""
+        g.started = time.perf_counter()
+        g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+
+    init_admission(app)
+    # registered first to be called last, sees the final response
+    init_compression(app)
+
     @app.after_request
     def after_request(response):
         """Add headers to the response."""
         response.headers["Access-Control-Allow-Origin"] = "*"
         response.headers["Access-Control-Allow-Methods"] = \
             "GET,PUT,PATCH,POST,DELETE,OPTION"
-        response.headers["Content-Type"] = "application/json"
+        if not response.is_streamed:
+            response.headers["Content-Type"] = "application/json"
+
+        request_id = g.get("request_id")
+        if request_id:
+            response.headers["X-Request-ID"] = request_id
+            log_request(request, response, g.started, request_id,
+                        g.get("error"))
 
         return response
 
+    def current_store():
+        """Return the binary question store serving reads, None if none."""
+        watcher = app.extensions.get("question_store")
+        return watcher.current() if watcher is not None else None
+
     @app.route('/api/v1.0/categories', methods=['GET'])
     def get_categories():
         """Get categories.
@@ -55,9 +90,6 @@ def create_app():
             False: return only categories with some questions
         :param type: bool, optional, default True
         """
-        categories = Category.all_as_dict()
-        questions = Question.get_all()
-
         empty_incl = str(request.args.get("emptyIncluded", None))
 
         def is_empty_included(empty_incl):
@@ -71,12 +103,8 @@ def create_app():
 
         empty_included = is_empty_included(empty_incl)
 
-        if empty_included:
-            categories = Category.all_as_dict()
-
-        if not empty_included:
-            categories = help. \
-                filter_categories_without_questions(categories, questions)
+        # answered from the categories table alone, using question counts
+        categories = Category.all_as_dict(non_empty_only=not empty_included)
 
         if not categories:
             raise werk_ex.NotFound("`Categories` not found.")
@@ -86,6 +114,33 @@ def create_app():
             "categories": categories
         })
 
+    def get_questions_by_ids(ids):
+        """Return response with questions of given ids, in the given order.
+
+        :param ids: comma separated ids or a list of ids
+        :ids type: Union[str, list]
+        """
+        question_ids = help.parse_question_ids(ids)
+
+        # ids are not valid: 400
+        if question_ids is None:
+            raise werk_ex.BadRequest("Wrong format of `ids`.")
+
+        # too many ids: 400
+        if len(question_ids) > app.config["QUESTIONS_IDS_MAX"]:
+            raise werk_ex.BadRequest(
+                f"At most {app.config['QUESTIONS_IDS_MAX']} `ids` allowed.")
+
+        questions = Question.get_many_formatted(question_ids)
+        found = {q["id"] for q in questions}
+
+        return jsonify({
+            "success": True,
+            "total_questions": len(questions),
+            "questions": questions,
+            "missing_ids": [i for i in question_ids if i not in found]
+        })
+
     @app.route('/api/v1.0/questions', methods=["GET"])
     def get_questions():
         """Return all questions, paginated.
@@ -94,22 +149,33 @@ def create_app():
             page from returned questions will be returned,
             page size is 10, optional
         :page type: int, default 1
+        :param ids: query param, comma separated ids of questions to return
+            instead of a page, optional
+        :ids type: str
         """
+        if "ids" in request.args:
+            return get_questions_by_ids(request.args["ids"])
+
         page = request.args.get("page", 1, type=int)
-        questions = Question.get_paginated(page, QUESTIONS_PER_PAGE)
+        store = current_store()
+
+        if store is not None:
+            questions = store.get_page(page, QUESTIONS_PER_PAGE)
+        else:
+            questions = [question.format() for question
+                         in Question.get_paginated(page, QUESTIONS_PER_PAGE)]
 
         if not questions:
             # if not existed, return 404
             raise werk_ex.NotFound("`Questions` not found. "
                                    "Requested page does not exist?")
 
-        total = Question.get_count()
-        categories = Category.all_as_dict()
-        categories = \
-            help.filter_categories_without_questions(categories, questions)
-
-        questions = [question.format() for question
-                     in questions]
+        if store is not None:
+            total = store.question_count
+            categories = store.categories_as_dict(non_empty_only=True)
+        else:
+            total = Question.get_count()
+            categories = Category.all_as_dict(non_empty_only=True)
 
         return jsonify({
             'success': True,
@@ -119,6 +185,52 @@ def create_app():
             'categories': categories
         })
 
+    @app.route('/api/v1.0/questions/changes', methods=["GET"])
+    def get_question_changes():
+        """Return changes of questions made after a given change.
+
+        A mirror of the questions reads `head_seq`, fetches all questions,
+        then follows the changes from `head_seq`; changes committed during
+        the fetch are seen again, they carry the whole question.
+        :param since: query param, sequence number of the last change seen,
+            optional
+        :since type: int, default 0
+        :param limit: query param, the highest number of changes returned,
+            optional
+        :limit type: int, default `QUESTION_CHANGES_PAGE_SIZE`
+        """
+        since = request.args.get("since", 0, type=int)
+        limit = request.args.get("limit",
+                                 app.config["QUESTION_CHANGES_PAGE_SIZE"],
+                                 type=int)
+
+        # wrong paging: 400
+        if since < 0 or not 0 < limit <= app.config[
+                "QUESTION_CHANGES_MAX_PAGE_SIZE"]:
+            raise werk_ex.BadRequest("Wrong `since` or `limit`.")
+
+        # changes after `since` were pruned, the mirror has to resync: 410
+        first_seq = QuestionChange.get_first_seq()
+        if first_seq is not None and since + 1 < first_seq:
+            error = werk_ex.Gone("Changes were pruned, fetch all questions "
+                                 "and follow the changes from `head_seq`.")
+            # read before the questions are fetched, nothing is missed
+            error.data = {"head_seq": QuestionChange.get_head_seq()}
+            raise error
+
+        changes = QuestionChange.get_since(since, limit + 1)
+        has_more = len(changes) > limit
+        changes = [change.format() for change in changes[:limit]]
+
+        return jsonify({
+            "success": True,
+            "changes": changes,
+            "last_seq": changes[-1]["seq"] if changes else since,
+            # read after the changes, never lower than `last_seq`
+            "head_seq": QuestionChange.get_head_seq(),
+            "has_more": has_more
+        })
+
     @app.route("/api/v1.0/questions/<int:question_id>", methods=["DELETE", "GET"])
     def get_delete_question(question_id: int):
         """As DELETE method: delete a question from database.
@@ -145,15 +257,17 @@ def create_app():
             })
 
         if request.method == "GET":
-            question = Question.get_by_id(question_id)
+            store = current_store()
+            if store is not None:
+                question = store.get(question_id)
+            else:
+                question = Question.get_formatted(question_id)
 
             # if not found return 404 with a message
             if not question:
                 raise werk_ex.NotFound(
                     "Requested `Question` doesn not exists.")
 
-            question = question.format()
-
             response = jsonify({
                 "success": True,
                 "question": question
@@ -163,6 +277,66 @@ def create_app():
 
         raise werk_ex.MethodNotAllowed(f"{request.method} is not allowed.")
 
+    @app.route("/api/v1.0/questions/<int:question_id>", methods=["PATCH"])
+    def patch_question(question_id: int):
+        """Change some fields of a question.
+
+        The change is applied only if the question still has the given
+        version, a concurrent change is not overwritten. Body parameters:
+        :param version: version of the question the change is based on
+        :version type: int
+        :param question: text of the question, optional
+        :question type: str
+        :param answer: text of the answer, optional
+        :answer type: str
+        :param category: id of the question category, optional
+        :category type: int
+        :param difficulty: level of difficulty of the question, optional
+        :difficulty type: int, accepted values: 1-5
+        """
+        try:
+            data = request.data.decode('utf8')
+            data = json.loads(data)
+
+        # can't deserialize body: 400
+        except json.JSONDecodeError:
+            raise werk_ex.BadRequest("Can not deseriaze json.")
+
+        # no version or no valid field to change: 400
+        if not help.is_valid_question_patch(data):
+            raise werk_ex.BadRequest(
+                "Wrong format of the `Question` change.")
+
+        fields = {"question": "question_text", "answer": "answer",
+                  "category": "category_id", "difficulty": "difficulty"}
+        changes = {column: data[key] for key, column in fields.items()
+                   if key in data}
+        for column in ("category_id", "difficulty"):
+            if column in changes:
+                changes[column] = int(changes[column])
+
+        # category not found: 400
+        if "category_id" in changes and \
+                str(changes["category_id"]) not in Category.all_as_dict():
+            raise werk_ex.BadRequest('Given category doesn not exist.')
+
+        question = Question.patch(question_id, data["version"], changes)
+
+        if question is None:
+            # no such question: 404
+            if Question.get_by_id(question_id) is None:
+                raise werk_ex.NotFound(
+                    "Requested `Question` doesn not exists.")
+
+            # changed since the client read it: 409
+            raise werk_ex.Conflict(
+                "`Question` was changed meanwhile, fetch it and try again.")
+
+        return jsonify({
+            "success": True,
+            "question": question
+        })
+
     @app.route('/api/v1.0/questions', methods=['POST'])
     def create_question():
         """Create a new question in a database.
@@ -176,6 +350,11 @@ def create_app():
         :category type: int, accepted only existing in a db values
         :param difficulty: level of difficulty of the question
         :dufficylty type: int, accepted values: 1-5
+
+        A question similar to existing ones is handled by
+        `QUESTION_DEDUPE_MODE`: created with the `duplicates` listed (warn),
+        refused with 409 (reject) or not created, the closest existing
+        question is returned with 200 (merge).
         """
         try:
             data = request.data.decode('utf8')
@@ -201,24 +380,76 @@ def create_app():
                 difficulty=data.get("difficulty")
             )
 
-        question = map_to_question(data)
-        question = question.insert()
+        mode = app.config["QUESTION_DEDUPE_MODE"]
+        duplicates = []
+        if mode != "off":
+            duplicates = dedupe.find_duplicates(data["question"])
 
-        body = jsonify({
+        # near-duplicate of an existing question: 409
+        if duplicates and mode == "reject":
+            ids = ", ".join(str(i) for i, _ in duplicates)
+            raise werk_ex.Conflict(
+                f"Near-duplicate of existing questions: {ids}.")
+
+        if duplicates and mode == "merge":
+            response = make_response(jsonify({
+                "success": True,
+                "message": "Question already exists.",
+                "duplicates": dedupe.format_duplicates(duplicates)
+            }))
+            response.location = url_for('get_delete_question',
+                                        question_id=duplicates[0][0],
+                                        _external=True)
+            return response, 200
+
+        # committed with questions of concurrent requests if enabled
+        writer = app.extensions.get("group_commit")
+        if writer is not None:
+            question_id = writer.create(data)["id"]
+        else:
+            question_id = map_to_question(data).insert().id
+
+        body = {
             "success": True,
             "message": "Question has been created."
-            })
+            }
+        if duplicates:
+            logger.warning(f"Question {question_id} created as a "
+                           f"near-duplicate of {duplicates}")
+            body["duplicates"] = dedupe.format_duplicates(duplicates)
 
-        response = make_response(body)
+        response = make_response(jsonify(body))
         location = url_for(
                            'get_delete_question',
-                           question_id=question.id,
+                           question_id=question_id,
                            _external=True
                            )
         response.location = location
 
         return response, 201
 
+    @app.route('/api/v1.0/questions/lookups', methods=['POST'])
+    def lookup_questions():
+        """Return questions by ids, for lists too long for a query string.
+
+        Body parameters:
+        :param ids: ids of questions to return
+        :ids type: a list of ints
+        """
+        try:
+            data = request.data.decode('utf8')
+            data = json.loads(data)
+
+        # can't deserialize requst body: 400
+        except json.JSONDecodeError:
+            raise werk_ex.BadRequest("Can not deseriaze json.")
+
+        # ids have to be a list in the body: 400
+        if not isinstance(data, dict) or not isinstance(data.get("ids"), list):
+            raise werk_ex.BadRequest("Wrong data format.")
+
+        return get_questions_by_ids(data.get("ids"))
+
     @app.route('/api/v1.0/questions/searches', methods=['POST'])
     def search():
         """Get questions by search term.
@@ -263,22 +494,29 @@ def create_app():
         :return: a collection of `Questions`,
             total number of returned questions and current `Category`
         """
-        category = Category.get_by_id(category_id)
+        store = current_store()
+        if store is not None:
+            category = store.get_category(category_id)
+        else:
+            category = Category.get_by_id(category_id)
 
         # category not found: 404
         if not category:
             raise werk_ex.NotFound("Category not found.")
 
-        questions = Question.get_by_category_id(category_id)
+        if store is not None:
+            questions_f = store.get_by_category(category_id)
+        else:
+            category = category.format()
+            questions_f = [q.format() for q in
+                           Question.get_by_category_id(category_id)]
 
         # questions not found: 404
-        if not questions:
+        if not questions_f:
             raise werk_ex.NotFound(
                 "No questions for a given category found.")
 
-        total_questions = len(questions)
-        category = category.format()
-        questions_f = [q.format() for q in questions]
+        total_questions = len(questions_f)
 
         response = jsonify({
             "success": True,
@@ -301,6 +539,17 @@ def create_app():
             if 0 is provided as category.id question from all categories
             is draw
         :previous_questions type: `Category`
+        :param difficulty: difficulty of the question, a number or a range
+            `{"min": 1, "max": 3}`, optional
+        :difficulty type: int or dict
+        :param categories: weights of categories to draw from, e.g.
+            `{"1": 0.5, "4": 0.5}`, replaces quiz_category, optional
+        :categories type: dict
+        :param adaptive: adaptive difficulty, `true` for the first question,
+            then the difficulty of the previous question and if it was
+            answered right, `{"difficulty": 3, "correct": true}`, replaces
+            difficulty, optional
+        :adaptive type: bool or dict
         """
         try:
             data = request.data.decode('utf8')
@@ -314,44 +563,409 @@ def create_app():
         if not help.is_valid_quize_data(data):
             raise werk_ex.BadRequest("Wrong data format.")
 
-        category_id = data.get("quiz_category").get("id")
+        difficulty = help.get_difficulty_range(data)
+        weights = help.get_category_weights(data)
+        store = current_store()
+
+        if weights is None:
+            category_id = int(data.get("quiz_category").get("id"))
+
+            if category_id != 0:
+                if store is not None:
+                    category = store.get_category(category_id)
+                    question_count = \
+                        store.category_question_count(category_id)
+                else:
+                    category = Category.get_by_id(category_id)
+                    question_count = category and category.question_count
+
+                # no such category is the database: 404
+                if category is None:
+                    raise werk_ex.NotFound("Category not found.")
+
+                # empty category, no need to look for questions: 404
+                if question_count == 0:
+                    raise werk_ex.NotFound(
+                        "No questions with specified criteria found.")
+
+                weights = {category_id: 1}
+
+        else:
+            if store is not None:
+                categories = store.categories_as_dict()
+            else:
+                categories = Category.all_as_dict()
+
+            # one of weighted categories not in the database: 404
+            if any(str(c) not in categories for c in weights):
+                raise werk_ex.NotFound("Category not found.")
+
+        previous_questions = [int(q) for q in data.get("previous_questions")]
+        adaptive = help.get_adaptive_answer(data)
+        if adaptive is not None:
+            question = draw_adaptive_question(weights, *adaptive,
+                                              previous_questions, store)
+        else:
+            question = draw_question(weights, difficulty, previous_questions,
+                                     store)
+
+        # no question with specified criteria: 404
+        if question is None:
+            raise werk_ex.NotFound(
+                "No questions with specified criteria found.")
+
+        return jsonify({
+            "success": True,
+            "question": question
+        })
+
+    @app.route("/api/v1.0/quizzes/batch", methods=["POST"])
+    def create_quiz_batch():
+        """Return distinct random questions for a whole quiz in one call.
+
+        Questions are sampled without replacement by the db in a single
+        query. Body parameters:
+        :param count: number of questions, 1 - `QUIZ_BATCH_MAX`
+        :count type: int
+        :param quiz_category: a category to take questions from,
+            if 0 is provided as category.id questions from all categories
+            are drawn
+        :quiz_category type: `Category`
+        :param previous_questions: questions to exclude represent by ids,
+            optional
+        :previous_questions type: a list of ints
+        """
+        try:
+            data = request.data.decode('utf8')
+            data = json.loads(data)
+
+        # can't deserialize data: 400
+        except json.JSONDecodeError:
+            raise werk_ex.BadRequest("Can not deseriaze json.")
+
+        # data are not valid: 400
+        if not help.is_valid_quiz_batch_data(data,
+                                             app.config["QUIZ_BATCH_MAX"]):
+            raise werk_ex.BadRequest("Wrong data format.")
+
+        category_id = int(data.get("quiz_category").get("id"))
 
-        questions = []
         if category_id == 0:
-            questions = Question.get_all()
+            category_id = None
 
         else:
-            is_category = Category.get_by_id(category_id)
+            category = Category.get_by_id(category_id)
 
             # no such category is the database: 404
-            if is_category is None:
+            if category is None:
                 raise werk_ex.NotFound("Category not found.")
 
-            else:
-                questions = Question.get_by_category_id(category_id)
-
-        prev_question = data.get("previous_question")
-        if prev_question:
-            questions = \
-                [q for q in questions if q.id not in prev_question]
+        previous_questions = \
+            [int(q) for q in data.get("previous_questions", [])]
+        questions = Question.get_random(int(data.get("count")), category_id,
+                                        previous_questions)
 
         # no question with specified criteria: 404
-        if len(questions) == 0:
+        if not questions:
             raise werk_ex.NotFound(
                 "No questions with specified criteria found.")
 
-        ran_question = random.choice(questions)
-        ran_question = ran_question.format()
+        return jsonify({
+            "success": True,
+            "total_questions": len(questions),
+            "questions": [q.format() for q in questions]
+        })
+
+    @app.route("/api/v1.0/quizzes/attempts", methods=["POST"])
+    def record_quiz_attempts():
+        """Record answers of a player, for analytics.
+
+        The attempts are buffered and written in batches, see `attempts.py`,
+        the response does not wait for the db. Body parameters:
+        :param attempts: answered questions, `question_id`, `correct` and
+            `time_ms` (milliseconds taken to answer)
+        :attempts type: a list of dicts, 1 - `QUIZ_ATTEMPTS_MAX_BATCH`
+        """
+        try:
+            data = request.data.decode('utf8')
+            data = json.loads(data)
+
+        # can't deserialize data: 400
+        except json.JSONDecodeError:
+            raise werk_ex.BadRequest("Can not deseriaze json.")
+
+        attempts = help.parse_attempts(data,
+                                       app.config["QUIZ_ATTEMPTS_MAX_BATCH"])
+        # data are not valid: 400
+        if attempts is None:
+            raise werk_ex.BadRequest("Wrong data format.")
+
+        answered_at = datetime.now(timezone.utc)
+        app.extensions["attempts"].add(
+            [attempt + (answered_at,) for attempt in attempts])
+
+        return jsonify({
+            "success": True,
+            "recorded": len(attempts)
+        }), 202
+
+    @app.route("/api/v1.0/games", methods=["POST"])
+    def create_game():
+        """Record a finished quiz game and put it on the leaderboards.
+
+        Body parameters:
+        :param player: name of the player, up to 64 characters
+        :player type: str
+        :param score: number of correct answers
+        :score type: int
+        :param questions: number of answered questions, 1 - `QUIZ_BATCH_MAX`
+        :questions type: int
+        :param category: id of the quiz category, 0 or none for all
+            categories, optional
+        :category type: int
+        """
+        try:
+            data = request.data.decode('utf8')
+            data = json.loads(data)
+
+        # can't deserialize data: 400
+        except json.JSONDecodeError:
+            raise werk_ex.BadRequest("Can not deseriaze json.")
+
+        # data are not valid: 400
+        if not help.is_valid_game(data, app.config["QUIZ_BATCH_MAX"]):
+            raise werk_ex.BadRequest("Wrong data format.")
+
+        category_id = data.get("category") or None
+        # category not found: 400
+        if category_id is not None \
+                and str(category_id) not in Category.all_as_dict():
+            raise werk_ex.BadRequest("Given category does not exist.")
+
+        game = Game(data["player"].strip(), category_id, data["score"],
+                    data["questions"])
+        game = game.insert(app.config["LEADERBOARD_SIZE"])
+
+        return jsonify({
+            "success": True,
+            "game": game
+        }), 201
+
+    @app.route("/api/v1.0/leaderboard", methods=["GET"])
+    def get_leaderboard():
+        """Return the best games, of a category or of all games.
+
+        :param category: query param, id of the category, optional
+        :category type: int, default all games
+        :param limit: query param, number of games, optional
+        :limit type: int, default `LEADERBOARD_DEFAULT_LIMIT`, at most
+            `LEADERBOARD_SIZE`
+        """
+        category_id = request.args.get("category", 0, type=int) or None
+        limit = request.args.get("limit",
+                                 app.config["LEADERBOARD_DEFAULT_LIMIT"],
+                                 type=int)
+
+        # wrong limit: 400
+        if not 0 < limit <= app.config["LEADERBOARD_SIZE"]:
+            raise werk_ex.BadRequest("Wrong `limit`.")
+
+        # no such category: 404
+        if category_id is not None \
+                and str(category_id) not in Category.all_as_dict():
+            raise werk_ex.NotFound("Category not found.")
+
+        entries = LeaderboardEntry.get_top(limit, category_id)
+
+        return jsonify({
+            "success": True,
+            "category": category_id,
+            "games": [entry.format(rank)
+                      for rank, entry in enumerate(entries, start=1)]
+        })
+
+    @app.route("/api/v1.0/batch", methods=["POST"])
+    def batch():
+        """Handle several api calls in one request.
+
+        Sub-requests are handled in the given order by the api endpoints,
+        within the app context and the db session of this request.
+        Body parameters:
+        :param requests: sub-requests, each with `method` (default GET),
+            `path` (with query string) and optional json `body`
+        :requests type: a list of dicts
+        """
+        try:
+            data = request.data.decode('utf8')
+            data = json.loads(data)
+
+        # can't deserialize data: 400
+        except json.JSONDecodeError:
+            raise werk_ex.BadRequest("Can not deseriaze json.")
+
+        # data are not valid: 400
+        if not help.is_valid_batch_data(data,
+                                        app.config["BATCH_MAX_REQUESTS"]):
+            raise werk_ex.BadRequest("Wrong data format.")
+
+        return jsonify({
+            "success": True,
+            "responses": run_batch(app, data["requests"])
+        })
+
+    @app.route("/api/v1.0/events", methods=["GET"])
+    def events_stream():
+        """Stream committed changes as server-sent events.
+
+        Events: `question.created`, `question.updated`, `question.deleted`,
+        `category.changed`. An idle stream gets a heartbeat comment, a client
+        too slow to read its events gets `reset` and the stream is closed.
+        """
+        subscriber = events.subscribe()
+
+        # too many subscribers in the process: 503
+        if subscriber is None:
+            raise werk_ex.ServiceUnavailable(
+                "Too many event subscribers.", retry_after=5)
+
+        response = Response(
+            events.stream(subscriber, app.config["EVENTS_HEARTBEAT"]),
+            mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        # nginx would buffer the stream otherwise
+        response.headers["X-Accel-Buffering"] = "no"
+        # the body of a HEAD request or of a client gone before the first
+        # event is never iterated, the stream would not unsubscribe
+        response.call_on_close(
+            lambda: events.broker.unsubscribe(subscriber))
+
+        return response
+
+    @app.route("/api/v1.0/snapshot", methods=["GET"])
+    def get_snapshot():
+        """Return the manifest of the current static snapshot.
+
+        The manifest has the `version` of the snapshot and urls of its files:
+        `categories`, `questions` and `category_questions` by category id.
+        Clients fetch the files instead of the api, refetch them when the
+        version changes.
+        """
+        directory = app.config["SNAPSHOT_DIR"]
+        manifest = snapshots.read_manifest(directory) if directory else None
+
+        # snapshots are disabled or not built yet: 404
+        if manifest is None:
+            raise werk_ex.NotFound("`Snapshot` not found.")
+
+        response = jsonify({
+            "success": True,
+            "snapshot": snapshots.manifest_urls(manifest,
+                                                app.config["SNAPSHOT_URL"])
+        })
+        response.headers["Cache-Control"] = \
+            f"public, max-age={app.config['SNAPSHOT_MANIFEST_MAX_AGE']}"
+
+        return response
+
+    @app.route("/api/v1.0/stats/caches", methods=["GET"])
+    def get_cache_stats():
+        """Return size and hit rate of the in-memory caches of the process."""
+        caches = {"questions": question_cache.stats()}
+
+        compressed = app.extensions.get("compression")
+        if compressed is not None:
+            caches["compressed_responses"] = compressed.stats()
 
         return jsonify({
             "success": True,
-            "question": ran_question
+            "caches": caches
         })
 
+    @app.cli.command("repair-question-counts")
+    def repair_question_counts():
+        """Recompute question counts of categories."""
+        Category.repair_question_counts()
+        print("Question counts repaired.")
+
+    @app.cli.command("partition-questions")
+    @click.option("--batch-size", default=10000, show_default=True,
+                  help="Rows copied in one transaction.")
+    def partition_questions(batch_size):
+        """Partition questions by category online (postgres only)."""
+        partitioning.partition_questions(db.engine, batch_size)
+
+    @app.cli.command("unpartition-questions")
+    def unpartition_questions():
+        """Convert partitioned questions back to a plain table."""
+        partitioning.unpartition_questions(db.engine)
+
+    @app.cli.command("rebuild-leaderboard")
+    def rebuild_leaderboard():
+        """Fill the leaderboards from all recorded games again."""
+        count = LeaderboardEntry.rebuild(app.config["LEADERBOARD_SIZE"])
+        print(f"{count} leaderboard entries.")
+
+    @app.cli.command("dedupe-report")
+    @click.option("--threshold", type=float, default=None,
+                  help="The lowest similarity of duplicates, "
+                       "`QUESTION_DEDUPE_THRESHOLD` if not given.")
+    @click.option("--output", type=click.File("w"), default="-",
+                  help="File of the report, json.")
+    def dedupe_report(threshold, output):
+        """Write clusters of near-duplicate questions of the whole bank."""
+        if threshold is None:
+            threshold = app.config["QUESTION_DEDUPE_THRESHOLD"]
+
+        clusters = dedupe.dedupe_report(threshold)
+        json.dump({"threshold": threshold, "clusters": clusters}, output,
+                  indent=2)
+        output.write("\n")
+        click.echo(f"{len(clusters)} clusters of near-duplicate questions.",
+                   err=True)
+
+    @app.cli.command("prune-question-changes")
+    @click.option("--days", default=30, show_default=True,
+                  help="Keep changes made in the last days.")
+    def prune_question_changes(days):
+        """Delete old entries of the question change log."""
+        before = datetime.now(timezone.utc) - timedelta(days=days)
+        print(f"{QuestionChange.prune(before)} changes deleted.")
+
+    @app.cli.command("build-snapshot")
+    @click.option("--directory", default=None,
+                  help="Directory of the snapshots, `SNAPSHOT_DIR` if not "
+                       "given.")
+    def build_snapshot(directory):
+        """Write a static snapshot of categories and questions."""
+        directory = directory or app.config["SNAPSHOT_DIR"]
+        if not directory:
+            raise click.UsageError("Set `TRIVIA_SNAPSHOT_DIR` or --directory.")
+
+        manifest = snapshots.build_snapshot(
+            directory, app.config["SNAPSHOT_KEEP"],
+            app.config["SNAPSHOT_GZIP_LEVEL"],
+            app.config["SNAPSHOT_BROTLI_LEVEL"])
+        print(f"Snapshot {manifest['version']} is current.")
+
+    @app.cli.command("build-question-store")
+    @click.option("--directory", default=None,
+                  help="Directory of the store, `QUESTION_STORE_DIR` if not "
+                       "given.")
+    def build_question_store(directory):
+        """Write the binary question store served by the workers."""
+        directory = directory or app.config["QUESTION_STORE_DIR"]
+        if not directory:
+            raise click.UsageError(
+                "Set `TRIVIA_QUESTION_STORE_DIR` or --directory.")
+
+        path = question_store.build_store(directory,
+                                          app.config["QUESTION_STORE_KEEP"])
+        print(f"Question store {path} is current.")
+
     @app.errorhandler(werk_ex.NotFound)
     def resource_not_found(error):
         """Resource not found error handler."""
-        logger.error(error)
+        g.error = error
         response = jsonify({
             "success": False,
             "error_code": 404,
@@ -360,9 +974,35 @@ def create_app():
 
         return response, 404
 
+    @app.errorhandler(werk_ex.Conflict)
+    def conflict(error):
+        """Conflicting change error handler."""
+        g.error = error
+        response = jsonify({
+            "success": False,
+            "error_code": 409,
+            "error_message": error.description
+        })
+
+        return response, 409
+
+    @app.errorhandler(werk_ex.Gone)
+    def resource_gone(error):
+        """Resource no longer available error handler."""
+        g.error = error
+        response = jsonify({
+            "success": False,
+            "error_code": 410,
+            "error_message": error.description,
+            # where to resume, e.g. `head_seq` of the change feed
+            **getattr(error, "data", {})
+        })
+
+        return response, 410
+
     @app.errorhandler(422)
     def unprocessable_entity(error):
-        logger.error(error)
+        g.error = error
         response = jsonify({
             "success": False,
             "error_code": 422,
@@ -373,7 +1013,7 @@ def create_app():
 
     @app.errorhandler(werk_ex.MethodNotAllowed)
     def method_not_allowed(error):
-        logger.error(error)
+        g.error = error
         response = jsonify({
             "success": False,
             "error_code": 405,
@@ -384,7 +1024,7 @@ def create_app():
 
     @app.errorhandler(werk_ex.BadRequest)
     def bad_request(error):
-        logger.error(error)
+        g.error = error
         response = jsonify({
             "success": False,
             "error_code": 400,
@@ -393,9 +1033,24 @@ def create_app():
 
         return response, 400
 
+    @app.errorhandler(werk_ex.TooManyRequests)
+    @app.errorhandler(werk_ex.ServiceUnavailable)
+    def overloaded(error):
+        """Request rejected by the admission control."""
+        g.error = error
+        response = jsonify({
+            "success": False,
+            "error_code": error.code,
+            "error_message": error.description
+        })
+        if error.retry_after is not None:
+            response.headers["Retry-After"] = str(error.retry_after)
+
+        return response, error.code
+
     @app.errorhandler(Exception)
     def unexpected_error(error):
-        logger.error(error)
+        g.error = error
         response = jsonify({
             "success": False,
             "error_code": 500,
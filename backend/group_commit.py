@@ -0,0 +1,198 @@
+"""Group commit of created questions.
+
+Every `POST /api/v1.0/questions` commits its own transaction, the write
+throughput is limited by the commit latency (a flush of the db log). With
+`QUESTION_GROUP_COMMIT` on, the requests hand the questions to a writer
+thread of the process instead:
+
+- the writer takes the first waiting question and collects others for up to
+  `QUESTION_GROUP_COMMIT_DELAY` seconds or until it has
+  `QUESTION_GROUP_COMMIT_MAX_SIZE` of them,
+- all of them are created by one multi-row insert in one transaction,
+- each request waits for the commit and gets its question, with its id.
+
+A request is answered only after its question is committed, as without the
+writer. If the group fails, its questions are created one by one, so a
+wrong question fails only its own request. A request waiting longer than
+`QUESTION_GROUP_COMMIT_TIMEOUT` seconds gets 503; its question is not
+created if the writer has not taken it yet.
+"""
+
+import math
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError
+
+from werkzeug import exceptions as werk_ex
+
+from logs import logger
+from models import Question, db, notify_change
+
+
+class GroupCommitWriter:
+    """Creates questions of concurrent requests in shared transactions.
+
+    The writer thread is started by the first question.
+    :param app: flask application
+    :app type: `Flask`
+    :param max_delay: seconds the writer waits for more questions
+    :max_delay type: float
+    :param max_size: the highest number of questions of one commit
+    :max_size type: int
+    :param timeout: seconds a request waits for its commit
+    :timeout type: float
+    """
+
+    def __init__(self, app, max_delay: float = 0.005, max_size: int = 100,
+                 timeout: float = 10.0):
+        """Create a writer."""
+        self.app = app
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: dict) -> Future:
+        """Queue a question to be created, return the future of the commit.
+
+        :param item: question fields, `question`, `answer`, `category` and
+            `difficulty` as in the api
+        :item type: dict
+        :return: future of the created question formatted with `format()`
+        :rtype: `concurrent.futures.Future`
+        """
+        future = Future()
+        self._queue.put((item, future))
+        self._ensure_thread()
+        return future
+
+    def create(self, item: dict) -> dict:
+        """Create the question, return it once its group is committed.
+
+        :raises werkzeug.exceptions.ServiceUnavailable: not committed in
+            `timeout` seconds
+        """
+        future = self.submit(item)
+        try:
+            return future.result(self.timeout)
+
+        except TimeoutError:
+            # a question still waiting for the writer is not created
+            cancelled = future.cancel()
+            logger.warning(f"Question not committed in {self.timeout} s, "
+                           f"cancelled: {cancelled}")
+            raise werk_ex.ServiceUnavailable(
+                "Question not stored in time." if cancelled else
+                "Question not stored in time, it can still be created.",
+                retry_after=math.ceil(self.timeout))
+
+    def _ensure_thread(self) -> None:
+        """Start the writer thread if not running."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="group-commit",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        """Commit groups of waiting questions."""
+        while True:
+            # questions of requests which stopped waiting are skipped
+            group = [pair for pair in self._collect()
+                     if pair[1].set_running_or_notify_cancel()]
+            if group:
+                self.write(group)
+
+    def _collect(self) -> list:
+        """Wait for a question, return it with the ones coming shortly."""
+        group = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+
+        while len(group) < self.max_size:
+            # after the deadline only the already waiting ones are taken
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    group.append(self._queue.get(timeout=timeout))
+                else:
+                    group.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return group
+
+    def write(self, group: list) -> None:
+        """Create the questions of the group, resolve their futures.
+
+        :param group: pairs of question fields and their futures
+        :group type: list
+        """
+        error = None
+        with self.app.app_context():
+            try:
+                created = Question.insert_many([item for item, _ in group],
+                                               notify=False)
+            except Exception as e:
+                db.session.rollback()
+                error = e
+            else:
+                # committed, not in the `try`: a failing listener must not
+                # get the group created again
+                for question in created:
+                    notify_change('question.created', question)
+            finally:
+                db.session.remove()
+
+        if error is None:
+            for (_, future), question in zip(group, created):
+                future.set_result(question)
+
+        elif len(group) == 1:
+            group[0][1].set_exception(error)
+
+        else:
+            logger.warning(f"Group of {len(group)} questions not created, "
+                           f"creating them one by one: {error}")
+            for pair in group:
+                self.write([pair])
+
+
+def _reset_writers() -> None:
+    """Forget the writer threads of the parent in a forked child."""
+    for writer in list(_writers):
+        writer._queue = queue.SimpleQueue()
+        writer._thread = None
+        writer._lock = threading.Lock()
+
+
+# writers of the apps created in the process
+_writers = weakref.WeakSet()
+
+os.register_at_fork(after_in_child=_reset_writers)
+
+
+def init_group_commit(app) -> None:
+    """Register the group commit writer of the app if enabled.
+
+    Configuration keys: `QUESTION_GROUP_COMMIT`,
+    `QUESTION_GROUP_COMMIT_DELAY`, `QUESTION_GROUP_COMMIT_MAX_SIZE`,
+    `QUESTION_GROUP_COMMIT_TIMEOUT`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    if not app.config.get("QUESTION_GROUP_COMMIT"):
+        return
+
+    writer = GroupCommitWriter(app,
+                               app.config["QUESTION_GROUP_COMMIT_DELAY"],
+                               app.config["QUESTION_GROUP_COMMIT_MAX_SIZE"],
+                               app.config["QUESTION_GROUP_COMMIT_TIMEOUT"])
+    app.extensions["group_commit"] = writer
+    _writers.add(writer)
@@ -0,0 +1,75 @@
+"""Gunicorn configuration of the api.
+
+Loaded by gunicorn from the working directory, run from `backend`:
+
+    gunicorn wsgi:app
+
+Settings can be changed with environment variables:
+`TRIVIA_BIND` (default `0.0.0.0:8000`), `TRIVIA_WEB_WORKERS` (default
+2 * cpu count + 1), `TRIVIA_WEB_THREADS` (default cpu count, within 2 - 8),
+`TRIVIA_WEB_WORKER_CLASS`, `TRIVIA_WEB_TIMEOUT`, `TRIVIA_WEB_GRACEFUL_TIMEOUT`,
+`TRIVIA_WEB_MAX_REQUESTS`, `TRIVIA_PID_FILE`.
+
+Reload:
+- `kill -HUP <master pid>` replaces the workers gracefully, the app
+  preloaded in the master is reused,
+- to deploy a new code without downtime, send `USR2` to the master (a new
+  master with new workers is started next to the old one), then `WINCH` and
+  `QUIT` to the old master (pid file `<pid file>.oldbin`).
+"""
+
+import multiprocessing
+import os
+
+_cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get("TRIVIA_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("TRIVIA_WEB_WORKERS", _cpu_count * 2 + 1))
+threads = int(os.environ.get("TRIVIA_WEB_THREADS",
+                             min(max(_cpu_count, 2), 8)))
+# an open event stream holds a thread, for many streams use an async worker
+# (`TRIVIA_WEB_WORKER_CLASS=gevent`, requires the `gevent` package)
+worker_class = os.environ.get("TRIVIA_WEB_WORKER_CLASS",
+                              "gthread" if threads > 1 else "sync")
+
+# the app is created and warmed up in the master, workers are forked from it
+preload_app = True
+
+timeout = int(os.environ.get("TRIVIA_WEB_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("TRIVIA_WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# recycle workers from time to time, jitter prevents all restarting together
+max_requests = int(os.environ.get("TRIVIA_WEB_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+pidfile = os.environ.get("TRIVIA_PID_FILE")
+
+# every thread of a worker can hold one connection
+os.environ.setdefault("TRIVIA_DB_POOL_SIZE", str(threads))
+
+
+def post_fork(server, worker):
+    """Drop the db connections inherited from the master."""
+    from wsgi import app, dispose_inherited_connections
+
+    dispose_inherited_connections(app)
+
+
+def post_worker_init(worker):
+    """Open the worker connections before the first request."""
+    from wsgi import app, warm_up
+
+    warm_up(app)
+
+
+def worker_exit(server, worker):
+    """Write the buffered quiz attempts of a stopping worker."""
+    from attempts import flush_all
+
+    flush_all()
+
+
+def pre_exec(server):
+    """Log the start of a new master on `USR2`."""
+    server.log.info("Forked child, re-executing.")
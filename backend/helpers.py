@@ -1,11 +1,13 @@
 """Additional tools used in api endpoints."""
 
-import os
 import json
-from unicodedata import category
+from typing import Dict, List, Optional, Tuple
 
-from models import Question
-from typing import List
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+# the highest value of an `Integer` column (4 bytes on postgres)
+MAX_INTEGER = 2 ** 31 - 1
 
 
 def is_valid_question(data: json) -> bool:
@@ -36,6 +38,48 @@ def is_valid_question(data: json) -> bool:
     return True
 
 
+def is_valid_question_patch(data: json) -> bool:
+    """Check if body request (PATCH questions/<id>) is valid.
+
+    A version and at least one of the question fields are required, the
+    given fields have to be valid as in `is_valid_question`.
+    :param data: request data
+    :data type: dict
+    :rtype: bool
+    """
+    if not isinstance(data, dict):
+        return False
+
+    version = data.get("version")
+    if not isinstance(version, int) or isinstance(version, bool) \
+            or version <= 0:
+        return False
+
+    fields = [key for key in ("question", "answer", "category", "difficulty")
+              if key in data]
+    if not fields or set(data) - set(fields) - {"version"}:
+        return False
+
+    for key in ("question", "answer"):
+        if key in data and (not isinstance(data[key], str)
+                            or not data[key].strip()):
+            return False
+
+    try:
+        if "difficulty" in data:
+            difficulty = int(data["difficulty"])
+            if difficulty < MIN_DIFFICULTY or difficulty > MAX_DIFFICULTY:
+                raise ValueError
+
+        if "category" in data and int(data["category"]) <= 0:
+            raise ValueError
+
+    except (TypeError, ValueError):
+        return False
+
+    return True
+
+
 def is_valid_quize_data(data: json) -> bool:
     """Check if body request (POST /quizes) is valid.
 
@@ -46,6 +90,10 @@ def is_valid_quize_data(data: json) -> bool:
     prev_questions = data.get("previous_questions", None)
     category = data.get("quiz_category", None)
 
+    # quiz category is not needed if categories are weighted
+    if category is None and data.get("categories") is not None:
+        category = {"id": 0, "type": "weighted"}
+
     if prev_questions is None or category is None:
         return False
 
@@ -64,21 +112,258 @@ def is_valid_quize_data(data: json) -> bool:
             for question in prev_questions:
                 int(question)
 
-    except ValueError:
+        get_difficulty_range(data)
+        get_category_weights(data)
+        get_adaptive_answer(data)
+
+    except (ValueError, TypeError):
         return False
 
     return True
 
 
-def filter_categories_without_questions(
-        categories: dict, questions: List[Question]):
-    """Filter categories with no questions.
+def is_valid_quiz_batch_data(data: json, max_count: int) -> bool:
+    """Check if body request (POST /quizzes/batch) is valid.
+
+    :param data: request data
+    :data type: dict
+    :param max_count: the highest number of questions allowed
+    :max_count type: int
+    :rtype: bool
+    """
+    category = data.get("quiz_category", None)
+    prev_questions = data.get("previous_questions", [])
+
+    if not isinstance(category, dict) or not isinstance(prev_questions, list):
+        return False
+
+    try:
+        count = int(data.get("count", None))
+        int(category.get("id", None))
+        for question in prev_questions:
+            int(question)
+
+    except (ValueError, TypeError):
+        return False
+
+    return 0 < count <= max_count
+
+
+def is_valid_batch_data(data: json, max_requests: int) -> bool:
+    """Check if body request (POST /batch) is valid.
+
+    :param data: request data
+    :data type: dict
+    :param max_requests: the highest number of sub-requests allowed
+    :max_requests type: int
+    :rtype: bool
+    """
+    subrequests = data.get("requests", None) if isinstance(data, dict) \
+        else None
+
+    if not isinstance(subrequests, list):
+        return False
+
+    if not 0 < len(subrequests) <= max_requests:
+        return False
+
+    for sub in subrequests:
+        if not isinstance(sub, dict):
+            return False
+
+        path = sub.get("path", None)
+        method = sub.get("method", "GET")
+
+        if not isinstance(path, str) or not path.startswith("/api/"):
+            return False
+
+        # batches can not be nested, streams never end
+        if path.split("?")[0].rstrip("/") in ("/api/v1.0/batch",
+                                              "/api/v1.0/events"):
+            return False
+
+        if not isinstance(method, str) or method.upper() not in \
+                ("GET", "POST", "PUT", "PATCH", "DELETE"):
+            return False
+
+    return True
+
+
+def parse_question_ids(ids) -> Optional[List[int]]:
+    """Return question ids without duplicates, in the given order.
+
+    :param ids: comma separated ids (query param) or a list of ids (body)
+    :ids type: Union[str, list]
+    :return: ids, None if not valid
+    :rtype: List[int]
+    """
+    if isinstance(ids, str):
+        ids = [i for i in ids.split(",") if i.strip()]
+
+    if not isinstance(ids, list) or not ids:
+        return None
+
+    try:
+        ids = [int(i) for i in ids]
+
+    except (ValueError, TypeError):
+        return None
+
+    return list(dict.fromkeys(ids))
+
+
+def parse_attempts(data: json, max_count: int) \
+        -> Optional[List[Tuple[int, bool, int]]]:
+    """Return quiz attempts of a body request (POST /quizzes/attempts).
+
+    :param data: request data, `attempts` is a list of objects with
+        `question_id`, `correct` (bool) and `time_ms`
+    :data type: dict
+    :param max_count: the highest number of attempts allowed
+    :max_count type: int
+    :return: question id, correct, time in milliseconds of every attempt,
+        None if not valid
+    :rtype: List[Tuple[int, bool, int]]
+    """
+    attempts = data.get("attempts") if isinstance(data, dict) else None
+    if not isinstance(attempts, list) or not 0 < len(attempts) <= max_count:
+        return None
+
+    parsed = []
+    for attempt in attempts:
+        if not isinstance(attempt, dict) \
+                or not isinstance(attempt.get("correct"), bool):
+            return None
+
+        try:
+            question_id = int(attempt.get("question_id"))
+            time_ms = int(attempt.get("time_ms"))
+
+        except (ValueError, TypeError):
+            return None
+
+        if not 0 < question_id <= MAX_INTEGER \
+                or not 0 <= time_ms <= MAX_INTEGER:
+            return None
+        parsed.append((question_id, attempt["correct"], time_ms))
 
-    :param categories: a collection to filter
-    :category type: dict
-    :param questions: a collection to use as filter
-    :questions type: `List[Question]`
+    return parsed
+
+
+def is_valid_game(data: json, max_questions: int) -> bool:
+    """Check if body request (POST /games) is valid.
+
+    :param data: request data, `player`, `score`, `questions` and optional
+        `category`
+    :data type: dict
+    :param max_questions: the highest number of questions of a game
+    :max_questions type: int
+    :rtype: bool
     """
-    ids = [q.category_id for q in questions]
+    if not isinstance(data, dict):
+        return False
+
+    player = data.get("player")
+    if not isinstance(player, str) or not player.strip() or len(player) > 64:
+        return False
+
+    values = [data.get("score"), data.get("questions"),
+              data.get("category") or 0]
+    if any(not isinstance(value, int) or isinstance(value, bool)
+           for value in values):
+        return False
+
+    score, questions, category = values
+    return 0 < questions <= max_questions and 0 <= score <= questions \
+        and category >= 0
+
+
+def get_difficulty_range(data: json) -> Tuple[int, int]:
+    """Return the lowest and the highest difficulty of a quiz.
+
+    Difficulty is given by `difficulty` key as a number or as a range
+    `{"min": 1, "max": 3}`, all difficulties if not provided.
+    :param data: request data
+    :data type: dict
+    :rtype: Tuple[int, int]
+    :raise ValueError: wrong format of the difficulty
+    """
+    difficulty = data.get("difficulty", None)
+
+    if difficulty is None:
+        return MIN_DIFFICULTY, MAX_DIFFICULTY
+
+    if isinstance(difficulty, dict):
+        low = int(difficulty.get("min", MIN_DIFFICULTY))
+        high = int(difficulty.get("max", MAX_DIFFICULTY))
+    else:
+        low = high = int(difficulty)
+
+    if not MIN_DIFFICULTY <= low <= high <= MAX_DIFFICULTY:
+        raise ValueError("Difficulty out of range.")
+
+    return low, high
+
+
+def get_adaptive_answer(data: json) \
+        -> Optional[Tuple[Optional[int], Optional[bool]]]:
+    """Return the previous answer of an adaptive quiz.
+
+    The adaptive mode is requested by `adaptive`: `true` (or `{}`) for the
+    first question, `{"difficulty": <previous question difficulty>,
+    "correct": <bool>}` for the next ones. It can not be combined with a
+    fixed `difficulty`.
+    :param data: request data
+    :data type: dict
+    :return: difficulty of the previous question and if the answer was
+        right, both None for the first question, None if not adaptive
+    :rtype: Tuple[Optional[int], Optional[bool]]
+    :raise ValueError: wrong format of the previous answer
+    """
+    adaptive = data.get("adaptive", None)
+
+    if adaptive is None or adaptive is False:
+        return None
+
+    if data.get("difficulty") is not None:
+        raise ValueError("Adaptive quiz has no fixed difficulty.")
+
+    if adaptive is True or adaptive == {}:
+        return None, None
+
+    if not isinstance(adaptive, dict):
+        raise ValueError("Adaptive has to be true or an object.")
+
+    difficulty, correct = adaptive.get("difficulty"), adaptive.get("correct")
+    if not isinstance(difficulty, int) or isinstance(difficulty, bool) \
+            or not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY \
+            or not isinstance(correct, bool):
+        raise ValueError("Wrong previous answer.")
+
+    return difficulty, correct
+
+
+def get_category_weights(data: json) -> Optional[Dict[int, float]]:
+    """Return weights of categories to draw quiz questions from.
+
+    Weights are given by `categories` key as `{"<category id>": weight}`,
+    e.g. `{"1": 0.5, "4": 0.5}`, None if not provided.
+    :param data: request data
+    :data type: dict
+    :rtype: Dict[int, float]
+    :raise ValueError: wrong format of the weights
+    """
+    categories = data.get("categories", None)
+
+    if categories is None:
+        return None
+
+    if not isinstance(categories, dict) or not categories:
+        raise ValueError("Categories have to be a non empty object.")
+
+    weights = {int(k): float(v) for k, v in categories.items()}
+
+    if any(w < 0 for w in weights.values()) or not any(weights.values()):
+        raise ValueError("Weights have to be positive.")
 
-    return {k: v for k, v in categories.items() if int(k) in ids}
+    return weights
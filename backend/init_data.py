@@ -1,20 +1,22 @@
-"""Create sample data for the application."""
+"""Create sample data for the application.
+
+`pandas` is imported inside the functions reading the files, it is used only
+by this tooling and is too heavy to be imported with the app.
+"""
 
-import inspect
 import pathlib
 from typing import List
 
-import pandas as pd
-import psycopg2
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import inspect
+from flask import Flask, current_app
 
+import dedupe
 from flaskr import create_app
+from logs import logger
 from models import Category, Question, setup_db
 
-CATEGORIES_PATH = pathlib.Path("backend/sample_data/categories.csv")
-QUESTIONS_PATH = pathlib.Path("backend/sample_data/questions.csv")
+SAMPLE_DATA_DIR = pathlib.Path(__file__).parent / "sample_data"
+CATEGORIES_PATH = SAMPLE_DATA_DIR / "categories.csv"
+QUESTIONS_PATH = SAMPLE_DATA_DIR / "questions.csv"
 
 
 def create_app_context(app=None) -> Flask:
@@ -29,8 +31,8 @@ def create_app_context(app=None) -> Flask:
 
 def get_categories() -> List[Category]:
     """Create category collection based on file data."""
-    file_path = CATEGORIES_PATH
-    categories = []
+    import pandas as pd
+
     data = pd.read_csv(CATEGORIES_PATH)
 
     def row_to_category(row):
@@ -44,7 +46,8 @@ def get_categories() -> List[Category]:
 
 def get_questions() -> List[Question]:
     """Create question collection based on file data."""
-    file_path = QUESTIONS_PATH
+    import pandas as pd
+
     data = pd.read_csv(QUESTIONS_PATH)
 
     def row_to_question(row):
@@ -80,14 +83,50 @@ def insert_categories(categories: List[Category]) -> None:
         cat.insert()
 
 
-def insert_questions(questions):
+def insert_questions(questions, mode: str = None) -> list:
     """Insert questions to the db.
 
+    Near-duplicates of questions in the db, or loaded before, are handled
+    by the mode (see `dedupe`): inserted and logged (`warn`), skipped
+    (`reject`), skipped with the existing question returned in their place
+    (`merge`).
     :param questions a collection of Category objects
     :questions type: `List[Question]`
+    :param mode: `off`, `warn`, `reject` or `merge`,
+        `QUESTION_DEDUPE_MODE` of the app if not given
+    :mode type: str
+    :return: the stored questions in the order of the given ones, None for
+        the rejected
+    :rtype: list
     """
+    if mode is None:
+        mode = current_app.config.get("QUESTION_DEDUPE_MODE", "warn")
+
+    stored = []
     for question in questions:
-        question.insert()
+        duplicates = []
+        if mode != "off":
+            duplicates = dedupe.find_duplicates(question.question_text)
+
+        if not duplicates:
+            stored.append(question.insert())
+            continue
+
+        text = question.question_text
+        if mode == "warn":
+            stored.append(question.insert())
+            logger.warning(f"Question {question.id} {text!r} loaded as a "
+                           f"near-duplicate of {duplicates}")
+        elif mode == "merge":
+            stored.append(Question.get_by_id(duplicates[0][0]))
+            logger.warning(f"Question {text!r} merged into question "
+                           f"{duplicates[0][0]}")
+        else:
+            stored.append(None)
+            logger.warning(f"Question {text!r} rejected, near-duplicate of "
+                           f"{duplicates}")
+
+    return stored
 
 
 def delete_categories():
@@ -0,0 +1,292 @@
+"""Non-blocking, structured logging of the api.
+
+Records are put on an in-memory queue by a `QueueHandler` attached to the
+application logger and written to a time rotated file by a single
+`QueueListener` thread, so a request thread never waits for disk io.
+
+Only the process which created the listener writes (and rotates) the file.
+The workers forked from it, by a preloading server, send their records to
+it over a datagram socket.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import os
+import pickle
+import queue
+import random
+import socket
+import threading
+import time
+from logging.handlers import (QueueHandler, QueueListener,
+                              TimedRotatingFileHandler)
+
+
+LOGGER_NAME = "trivia"
+
+logger = logging.getLogger(LOGGER_NAME)
+
+_exc_formatter = logging.Formatter()
+
+# one listener per log file, shared by every app created in the process
+_listeners = {}
+
+# attributes every `LogRecord` has, anything else came from `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+# the largest record sent by a forked worker, larger ones are dropped
+MAX_RECORD_BYTES = 65536
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single line json object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Return the record serialized to json.
+
+        :param record: record to format
+        :record type: `logging.LogRecord`
+        """
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class ClientErrorSampler(logging.Filter):
+    """Pass only a sample of records describing 4xx responses.
+
+    :param rate: fraction of 4xx records to keep, 0.0 - 1.0
+    :rate type: float
+    """
+
+    def __init__(self, rate: float = 1.0):
+        """Create a filter."""
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Decide if the record is logged."""
+        status = getattr(record, "status", None)
+
+        if status is None or not 400 <= status < 500:
+            return True
+
+        if self.rate >= 1.0:
+            return True
+
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """`QueueHandler` which drops records instead of blocking on full queue."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Make the record picklable, keep the message and traceback apart."""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Put a record on the queue without waiting."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ForwardingHandler(logging.Handler):
+    """Send records to the process writing the log file, without waiting.
+
+    Records which can not be sent right away are dropped.
+    :param sock: datagram socket connected to the writing process
+    :sock type: `socket.socket`
+    """
+
+    dropped = 0
+
+    def __init__(self, sock: socket.socket):
+        """Create a handler."""
+        super().__init__()
+        self.sock = sock
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Send a record prepared by `DroppingQueueHandler`."""
+        try:
+            data = pickle.dumps(vars(record))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            data = None
+        if data is None or len(data) > MAX_RECORD_BYTES:
+            self.dropped += 1
+            return
+
+        try:
+            self.sock.send(data, socket.MSG_DONTWAIT)
+        except OSError:
+            self.dropped += 1
+
+
+def _receive_records(sock: socket.socket, listener: QueueListener) -> None:
+    """Put records sent by the forked workers on the queue of the listener."""
+    while True:
+        try:
+            data = sock.recv(MAX_RECORD_BYTES)
+        except OSError:
+            return
+        if not data:
+            return
+
+        try:
+            listener.queue.put_nowait(
+                logging.makeLogRecord(pickle.loads(data)))
+        except queue.Full:
+            pass
+
+
+def _get_listener(filename: str, when: str, backup_count: int,
+                  queue_size: int) -> QueueListener:
+    """Return started listener writing to the file, create if needed."""
+    listener = _listeners.get(filename)
+    if listener is not None:
+        return listener
+
+    file_handler = TimedRotatingFileHandler(
+        filename, when=when, backupCount=backup_count, delay=True,
+        encoding="utf8")
+    file_handler.setFormatter(JsonFormatter())
+
+    listener = QueueListener(queue.Queue(queue_size), file_handler,
+                             respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # forked workers send to `sender`, the records are received by this
+    # process only
+    receiver, listener.sender = socket.socketpair(socket.AF_UNIX,
+                                                  socket.SOCK_DGRAM)
+    threading.Thread(target=_receive_records, args=(receiver, listener),
+                     name=f"log receiver {filename}", daemon=True).start()
+
+    _listeners[filename] = listener
+    return listener
+
+
+def _restart_listeners() -> None:
+    """Start the listeners again in a forked child process.
+
+    Threads do not survive `fork`, a worker of a preloading server would fill
+    the queue inherited from the master and never write it. The worker does
+    not write the file, several processes rotating the same file would lose
+    records; its listener forwards the records to the master instead.
+    """
+    for listener in _listeners.values():
+        listener.queue = queue.Queue(listener.queue.maxsize)
+        listener._thread = None
+        listener.handlers = (ForwardingHandler(listener.sender),)
+        listener.start()
+
+    for handler in logger.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            filename = getattr(handler, "filename", None)
+            if filename in _listeners:
+                handler.queue = _listeners[filename].queue
+
+
+os.register_at_fork(after_in_child=_restart_listeners)
+
+
+def setup_logging(app) -> logging.Logger:
+    """Attach a queue based handler to the application logger.
+
+    Configuration is taken from the app config: `LOG_FILE`, `LOG_LEVEL`,
+    `LOG_ROTATE_WHEN`, `LOG_BACKUP_COUNT`, `LOG_QUEUE_SIZE`,
+    `LOG_4XX_SAMPLE_RATE`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    config = app.config
+    listener = _get_listener(config["LOG_FILE"], config["LOG_ROTATE_WHEN"],
+                             config["LOG_BACKUP_COUNT"],
+                             config["LOG_QUEUE_SIZE"])
+
+    for handler in list(logger.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            logger.removeHandler(handler)
+
+    handler = DroppingQueueHandler(listener.queue)
+    handler.filename = config["LOG_FILE"]
+    handler.addFilter(ClientErrorSampler(config["LOG_4XX_SAMPLE_RATE"]))
+
+    logger.addHandler(handler)
+    logger.setLevel(config["LOG_LEVEL"])
+    logger.propagate = False
+
+    return logger
+
+
+def log_request(request, response, started: float, request_id: str,
+                error: Exception = None) -> None:
+    """Log a finished request as a structured record.
+
+    5xx responses are logged as errors, 4xx as warnings, the rest as info.
+    :param request: handled request
+    :request type: `flask.Request`
+    :param response: response returned to the client
+    :response type: `flask.Response`
+    :param started: `time.perf_counter()` value of the request start
+    :started type: float
+    :param request_id: id of the request
+    :request_id type: str
+    :param error: exception handled by the error handler, optional
+    :error type: Exception
+    """
+    status = response.status_code
+
+    if status >= 500:
+        level = logging.ERROR
+    elif status >= 400:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+
+    if not logger.isEnabledFor(level):
+        return
+
+    url_rule = request.url_rule
+    extra = {
+        "request_id": request_id,
+        "method": request.method,
+        "route": url_rule.rule if url_rule else None,
+        "path": request.path,
+        "status": status,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+    message = str(error) if error is not None else "request handled"
+    exc_info = None
+    if error is not None and status >= 500:
+        exc_info = (type(error), error, error.__traceback__)
+
+    logger.log(level, message, extra=extra, exc_info=exc_info)
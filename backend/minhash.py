@@ -0,0 +1,119 @@
+"""MinHash signatures of question texts and their LSH band keys.
+
+The text is normalized (case, accents, punctuation and spacing are
+ignored) and split into character shingles. A signature keeps, for each of
+`NUM_PERM` hash functions, the lowest hash of the shingles; the share of
+equal positions of two signatures estimates the Jaccard similarity of
+their shingle sets.
+
+For locality sensitive hashing the signature is cut into `BANDS` bands of
+`ROWS` values. Texts with a similarity `s` share at least one band with the
+chance `1 - (1 - s ** ROWS) ** BANDS`: 0.99 for `s = 0.7`, 0.12 for
+`s = 0.3`, so candidates are found by looking up the bands, without
+comparing the text with every question.
+
+The hash functions are drawn from a fixed seed, signatures stored in the db
+stay comparable across processes and releases. Changing any of the
+constants requires computing the stored signatures again.
+"""
+
+import random
+import re
+import struct
+import unicodedata
+import zlib
+from typing import List, Set, Tuple
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# characters of a shingle
+SHINGLE_SIZE = 4
+
+# the values are kept as 32 bit unsigned ints, little endian
+_FORMAT = f"<{NUM_PERM}I"
+_BAND_BYTES = ROWS * 4
+
+# a Mersenne prime, hash functions are (a * x + b) mod _PRIME
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+
+_rng = random.Random(2_718_281)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(_PRIME))
+                 for _ in range(NUM_PERM)]
+del _rng
+
+_NOT_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Return the text lower case, without accents and punctuation.
+
+    :param text: text of a question
+    :text type: str
+    :rtype: str
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NOT_WORD.sub(" ", text.casefold()).strip()
+
+
+def shingles(text: str) -> Set[int]:
+    """Return hashes of the character shingles of the normalized text.
+
+    A text shorter than a shingle is a shingle of its own.
+    :param text: text of a question
+    :text type: str
+    :rtype: Set[int]
+    """
+    text = normalize(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode("utf8"))}
+
+    return {zlib.crc32(text[i:i + SHINGLE_SIZE].encode("utf8"))
+            for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text: str) -> bytes:
+    """Return the MinHash signature of the text, `NUM_PERM * 4` bytes.
+
+    :param text: text of a question
+    :text type: str
+    :rtype: bytes
+    """
+    hashes = shingles(text)
+    return struct.pack(_FORMAT, *(
+        min([(a * x + b) % _PRIME for x in hashes]) & _MASK
+        for a, b in _PERMUTATIONS))
+
+
+def bands(sig: bytes) -> List[Tuple[int, bytes]]:
+    """Return LSH keys of the signature, (band number, band values).
+
+    :param sig: signature made by `signature`
+    :sig type: bytes
+    :rtype: List[Tuple[int, bytes]]
+    """
+    return [(band, sig[band * _BAND_BYTES:(band + 1) * _BAND_BYTES])
+            for band in range(BANDS)]
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    """Return the estimated Jaccard similarity of two signatures.
+
+    :param first: signature made by `signature`
+    :first type: bytes
+    :param second: signature made by `signature`
+    :second type: bytes
+    :rtype: float
+    """
+    equal = sum(a == b for a, b in zip(struct.unpack(_FORMAT, first),
+                                       struct.unpack(_FORMAT, second)))
+    return equal / NUM_PERM
+
+
+def jaccard(first: str, second: str) -> float:
+    """Return the exact Jaccard similarity of the shingles of two texts."""
+    first, second = shingles(first), shingles(second)
+    return len(first & second) / len(first | second)
@@ -1,22 +1,172 @@
 """Database models and interfaces to operate on them."""
 
-import os
-from flask import session
-from numpy import delete
-from sqlalchemy import Column, String, Integer, func
+import csv
+import io
+from datetime import datetime, timezone
+
+import click
+from flask.cli import ScriptInfo
+from sqlalchemy import (DDL, Column, any_, bindparam, event, exc, func,
+                        inspect, literal, select, true)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session, column_property
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-import json
+
+import minhash
+import partitioning
+from cache import LruCache
+from category_registry import CategoryRegistry, registry_path
+from logs import logger
 
 
 db = SQLAlchemy()
 
+# key of the postgres lock serializing writes to the question change log
+CHANGE_LOG_LOCK_ID = 7_301_039
+
+# formatted questions by id, see `Question.get_formatted`
+question_cache = LruCache(max_entries=1024, ttl=60)
+
+# signatures of recently looked up or changed texts, see
+# `QuestionSignature.sign`
+signature_cache = LruCache(max_entries=256, ttl=60)
+
+# categories shared by the processes of the host, see `Category.all_as_dict`
+category_registry = CategoryRegistry(ttl=60)
+
+# callables notified of committed changes, see `on_change`
+_change_listeners = []
+
+
+def on_change(listener):
+    """Register a callable notified after a change is committed.
+
+    The listener is called with the name of the event (`question.created`,
+    `question.updated`, `question.deleted`, `category.created`,
+    `category.deleted`) and the changed object formatted with `format()`.
+    Can be used as a decorator.
+    :param listener: callable taking the event name and the object data
+    :listener type: Callable[[str, dict], None]
+    """
+    _change_listeners.append(listener)
+    return listener
+
+
+def notify_change(event_name: str, data: dict) -> None:
+    """Notify listeners about a committed change.
+
+    The change is committed already, a failing listener is logged and does
+    not keep the others from being notified.
+    """
+    for listener in _change_listeners:
+        try:
+            listener(event_name, data)
+        except Exception:
+            logger.exception(f"Listener of {event_name} failed")
+
+
+def stage_changes(event_name: str, items: list) -> None:
+    """Keep changes of the current transaction until it ends.
+
+    Read by `before_commit` listeners of the session with
+    `pop_staged_changes` (see `events`, the changes are sent by `NOTIFY` in
+    the transaction), forgotten on rollback.
+    :param event_name: name of the change event, as in `on_change`
+    :event_name type: str
+    :param items: changed objects formatted with `format()`
+    :items type: list
+    """
+    db.session.info.setdefault("changes", []).extend(
+        (event_name, data) for data in items)
+
+
+def pop_staged_changes(session) -> list:
+    """Return (event name, data) of the changes staged in the session.
+
+    The changes are forgotten.
+    """
+    return session.info.pop("changes", [])
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_staged_changes(session, previous_transaction):
+    """Drop the changes of a rolled back transaction."""
+    session.info.pop("changes", None)
+
+
+# keeps `categories.question_count` right for statements not going through
+# the models (bulk loads, manual sql), the models update the counts on their
+# own and mark the transaction, so the trigger skips their changes
+QUESTION_COUNT_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION questions_count_trigger() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('trivia.question_counts', true) = 'orm' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE categories c SET question_count = c.question_count + n.count
+        FROM (SELECT category_id, count(*) AS count FROM new_rows
+              GROUP BY category_id) n
+        WHERE c.id = n.category_id;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE categories c SET question_count = c.question_count - o.count
+        FROM (SELECT category_id, count(*) AS count FROM old_rows
+              GROUP BY category_id) o
+        WHERE c.id = o.category_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""")
+
+QUESTION_COUNT_TRIGGERS = [
+    DDL("""
+        CREATE TRIGGER questions_count_insert AFTER INSERT ON questions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION questions_count_trigger()
+    """),
+    DDL("""
+        CREATE TRIGGER questions_count_delete AFTER DELETE ON questions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION questions_count_trigger()
+    """),
+    DDL("""
+        CREATE TRIGGER questions_count_update
+        AFTER UPDATE ON questions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION questions_count_trigger()
+    """),
+]
+
+
+def _loaded_by_cli() -> bool:
+    """Return True if the app is loaded by the `flask` command line."""
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.find_object(ScriptInfo) is not None
+
 
 def setup_db(app):
-    """Binds a flask application and a SQLAlchemy service."""
+    """Binds a flask application and a SQLAlchemy service.
+
+    Flask-Migrate (and alembic with it) is imported only if the app is
+    loaded by the `flask` command line or `MIGRATE_ENABLED` is set, it is
+    not needed to serve requests.
+    """
     db.app = app
     db.init_app(app)
-    Migrate(app, db)
+    question_cache.max_entries = app.config.get("QUESTION_CACHE_SIZE", 1024)
+    question_cache.ttl = app.config.get("QUESTION_CACHE_TTL", 60)
+    category_registry.ttl = app.config.get("CATEGORY_REGISTRY_TTL", 60)
+    path = registry_path(app.config.get("CATEGORY_REGISTRY_DIR", ""),
+                         app.config["SQLALCHEMY_DATABASE_URI"])
+    if path and app.config.get("CATEGORY_REGISTRY_SHARED", True):
+        category_registry.open(path)
+    else:
+        category_registry.close()
+    if app.config.get("MIGRATE_ENABLED", False) or _loaded_by_cli():
+        from flask_migrate import Migrate
+        Migrate(app, db)
     return db
 
 
@@ -33,6 +183,9 @@ class Category(db.Model):
 
     id = db.Column(db.Integer(), primary_key=True)
     type = db.Column(db.String(), nullable=False)
+    # number of questions in the category, kept by `Question` methods
+    question_count = db.Column(db.Integer(), nullable=False, default=0,
+                               server_default='0')
     questions = db.relationship('Question', backref="question")
 
     def __init__(self, type: str):
@@ -43,13 +196,32 @@ class Category(db.Model):
         """Insert new object to the db."""
         db.session.add(self)
         db.session.flush()
+        if Category._questions_partitioned():
+            partitioning.create_partition(db.session, self.id)
+        data = self.format()
+        stage_changes('category.created', [data])
         db.session.commit()
+        Category.publish_registry()
+        notify_change('category.created', data)
         return self
 
     def delete(self):
         """Remove the object from db."""
+        data = self.format()
         db.session.delete(self)
+        if Category._questions_partitioned():
+            db.session.flush()
+            partitioning.drop_partition(db.session, self.id)
+        stage_changes('category.deleted', [data])
         db.session.commit()
+        Category.publish_registry()
+        notify_change('category.deleted', data)
+
+    @classmethod
+    def _questions_partitioned(cls):
+        """Check if questions are partitioned, see `partitioning`."""
+        return db.session.bind.dialect.name == 'postgresql' \
+            and partitioning.is_partitioned(db.session)
 
     @classmethod
     def get_all(cls):
@@ -73,13 +245,103 @@ class Category(db.Model):
             }
 
     @classmethod
-    def all_as_dict(cls):
-        """Return all categories as a dict."""
-        cat_dict = {}
-        all_cat = Category.query.all()
-        for cat in all_cat:
-            cat_dict[f"{cat.id}"] = cat.type
-        return cat_dict
+    def all_as_dict(cls, non_empty_only: bool = False):
+        """Return all categories as a dict.
+
+        Read from the category registry, the db is queried only when the
+        registry has to be loaded.
+        :param non_empty_only: return only categories with any question
+        :non_empty_only type: bool
+        """
+        categories = category_registry.get()
+        if categories is None:
+            categories = Category.publish_registry()
+
+        return {
+            f"{category_id}": category_type
+            for category_id, (category_type, question_count)
+            in categories.items()
+            if question_count > 0 or not non_empty_only
+        }
+
+    @classmethod
+    def publish_registry(cls):
+        """Load categories from the db to the registry as a new version.
+
+        :return: category id: (type, question count)
+        :rtype: dict
+        """
+        def load():
+            rows = db.session.query(Category.id, Category.type,
+                                    Category.question_count) \
+                             .order_by(Category.id)
+            return {row.id: (row.type, row.question_count) for row in rows}
+
+        return category_registry.publish(load)
+
+    @classmethod
+    def mark_counts_kept(cls, kept: bool = True):
+        """Make the count triggers skip changes of the current transaction.
+
+        Has to be called before the questions are changed, the triggers run
+        at the end of each statement.
+        :param kept: False to make the triggers count the next changes again
+        :kept type: bool
+        """
+        if db.session.bind.dialect.name == 'postgresql':
+            # pending changes are flushed after the mark
+            with db.session.no_autoflush:
+                db.session.execute(
+                    select(func.set_config('trivia.question_counts',
+                                           'orm' if kept else '', True)))
+
+    @classmethod
+    def adjust_question_counts(cls, changes: dict) -> bool:
+        """Change question counts in the current transaction.
+
+        :param changes: category id: number of questions added (or removed,
+            if negative)
+        :changes type: dict
+        :return: True if a category became empty or non-empty, the category
+            registry has to be invalidated after the commit then
+        :rtype: bool
+        """
+        Category.mark_counts_kept()
+
+        categories = Category.__table__
+        emptiness_changed = False
+        for category_id, delta in changes.items():
+            if not delta:
+                continue
+
+            statement = categories.update() \
+                                  .where(categories.c.id == category_id) \
+                                  .values(question_count=categories.c
+                                          .question_count + delta)
+            if db.session.bind.dialect.name == 'postgresql':
+                count = db.session.execute(
+                    statement.returning(categories.c.question_count)) \
+                    .scalar()
+            else:
+                db.session.execute(statement)
+                count = db.session.execute(
+                    select(categories.c.question_count)
+                    .where(categories.c.id == category_id)).scalar()
+
+            if count is not None and (count > 0) != (count - delta > 0):
+                emptiness_changed = True
+
+        return emptiness_changed
+
+    @classmethod
+    def repair_question_counts(cls):
+        """Recompute question counts of all categories from questions."""
+        categories, questions = Category.__table__, Question.__table__
+        count = select(func.count(questions.c.id)) \
+            .where(questions.c.category_id == categories.c.id) \
+            .scalar_subquery()
+        db.session.execute(categories.update().values(question_count=count))
+        db.session.commit()
 
 
 class Question(db.Model):
@@ -98,14 +360,26 @@ class Question(db.Model):
     """
 
     __tablename__ = 'questions'
+    __table_args__ = (
+        # per category reads, ordered by id
+        db.Index('ix_questions_category_id_id', 'category_id', 'id'),
+        # per category draws filtered by difficulty
+        db.Index('ix_questions_category_id_difficulty',
+                 'category_id', 'difficulty'),
+    )
 
     id = Column(db.Integer(), primary_key=True)
+    # the previous value is loaded on change, to move the question count
     category_id = \
-        db.Column(
-            db.Integer, db.ForeignKey('categories.id'), nullable=False)
+        column_property(db.Column(
+            db.Integer, db.ForeignKey('categories.id'), nullable=False),
+            active_history=True)
     question_text = Column(db.String(), nullable=False)
     answer = Column(db.String, nullable=False)
     difficulty = Column(db.Integer(), nullable=False)
+    # increased by every change, see `patch`
+    version = Column(db.Integer(), nullable=False, default=1,
+                     server_default='1')
 
     def __init__(self, question: str, answer: str,
                  category_id: int, difficulty: int):
@@ -128,19 +402,171 @@ class Question(db.Model):
 
     def insert(self):
         """Create a new object in the db."""
+        Category.mark_counts_kept()
         db.session.add(self)
         db.session.flush()
+        emptiness_changed = \
+            Category.adjust_question_counts({self.category_id: 1})
+        data = self.format()
+        QuestionChange.record('created', data)
+        QuestionSignature.record_many('created', [data])
         db.session.commit()
+        if emptiness_changed:
+            category_registry.invalidate()
+        notify_change('question.created', data)
         return self
 
+    @classmethod
+    def insert_many(cls, items: list, notify: bool = True):
+        """Create questions in one multi-row insert and one commit.
+
+        Used by the group commit writer, see `group_commit`. The ids of the
+        new rows are taken from the insert: `RETURNING` on postgres, the
+        last row id on other databases (rows of one statement get
+        consecutive ids).
+        :param items: question fields, `question`, `answer`, `category` and
+            `difficulty` as in the api
+        :items type: a list of dicts
+        :param notify: notify the change listeners, else the caller has to
+            notify them of the returned questions
+        :notify type: bool
+        :return: the created questions formatted, in the order of the items
+        :rtype: list
+        """
+        questions = Question.__table__
+        rows = [{'question_text': item['question'],
+                 'answer': item['answer'],
+                 'category_id': item['category'],
+                 'difficulty': item['difficulty']} for item in items]
+
+        Category.mark_counts_kept()
+        statement = questions.insert().values(rows)
+        if db.session.bind.dialect.name == 'postgresql':
+            # ids are drawn from the sequence in the order of the rows
+            created = sorted(db.session.execute(
+                statement.returning(*questions.c)), key=lambda row: row.id)
+        else:
+            last_id = db.session.execute(statement).lastrowid
+            created = db.session.execute(
+                select(questions)
+                .where(questions.c.id.between(last_id - len(rows) + 1,
+                                              last_id))
+                .order_by(questions.c.id)).all()
+        data = [Question._format_row(row) for row in created]
+
+        changes = {}
+        for item in items:
+            changes[item['category']] = changes.get(item['category'], 0) + 1
+        emptiness_changed = Category.adjust_question_counts(changes)
+        QuestionChange.record_many('created', data)
+        QuestionSignature.record_many('created', data)
+        db.session.commit()
+        if emptiness_changed:
+            category_registry.invalidate()
+        if notify:
+            for question in data:
+                notify_change('question.created', question)
+
+        return data
+
     def update(self):
         """Update an existing object."""
+        Category.mark_counts_kept()
+        history = inspect(self).attrs.category_id.history
+        emptiness_changed = False
+        if history.deleted and history.added:
+            emptiness_changed = Category.adjust_question_counts(
+                {history.deleted[0]: -1, history.added[0]: 1})
+        self.version = Question.version + 1
+        db.session.flush()
+        data = self.format()
+        QuestionChange.record('updated', data)
+        QuestionSignature.record_many('updated', [data])
         db.session.commit()
+        question_cache.invalidate(self.id)
+        if emptiness_changed:
+            category_registry.invalidate()
+        notify_change('question.updated', data)
 
     def delete(self):
         """Delete an existing object from the db."""
+        Category.mark_counts_kept()
         db.session.delete(self)
+        db.session.flush()
+        emptiness_changed = \
+            Category.adjust_question_counts({self.category_id: -1})
+        data = self.format()
+        QuestionChange.record('deleted', data)
+        QuestionSignature.record_many('deleted', [data])
         db.session.commit()
+        question_cache.invalidate(self.id)
+        if emptiness_changed:
+            category_registry.invalidate()
+        notify_change('question.deleted', data)
+
+    @classmethod
+    def patch(cls, question_id: int, version: int, changes: dict):
+        """Change the question if it still has the given version.
+
+        On postgres the change is a single `UPDATE ... WHERE id AND version
+        RETURNING` statement, the question is not read before, the count
+        triggers move the question count of a changed category. Other
+        databases read the category first, then update.
+        :param question_id: id of the question
+        :question_id type: int
+        :param version: version of the question the changes are based on
+        :version type: int
+        :param changes: new values by column name (`question_text`,
+            `answer`, `category_id`, `difficulty`)
+        :changes type: dict
+        :return: the changed question formatted, None if no question has
+            the id and the version
+        :rtype: dict
+        """
+        questions = Question.__table__
+        matching = (questions.c.id == question_id,
+                    questions.c.version == version)
+        statement = questions.update().where(*matching) \
+                             .values(version=questions.c.version + 1,
+                                     **changes)
+
+        # the old category is not known on postgres, a move may change
+        # which categories are empty
+        emptiness_changed = 'category_id' in changes
+        if db.session.bind.dialect.name == 'postgresql':
+            # the triggers move the count
+            Category.mark_counts_kept(False)
+            row = db.session.execute(statement.returning(*questions.c)) \
+                            .first()
+
+        else:
+            previous_category = db.session.execute(
+                select(questions.c.category_id).where(*matching)).scalar()
+            row = None
+            if db.session.execute(statement).rowcount:
+                row = db.session.execute(
+                    select(questions).where(questions.c.id == question_id)
+                ).first()
+                new_category = changes.get('category_id', previous_category)
+                emptiness_changed = new_category != previous_category \
+                    and Category.adjust_question_counts(
+                        {previous_category: -1, new_category: 1})
+
+        if row is None:
+            db.session.rollback()
+            return None
+
+        data = Question._format_row(row)
+        QuestionChange.record('updated', data)
+        if 'question_text' in changes:
+            QuestionSignature.record_many('updated', [data])
+        db.session.commit()
+        question_cache.invalidate(question_id)
+        if emptiness_changed:
+            category_registry.invalidate()
+        notify_change('question.updated', data)
+
+        return data
 
     @classmethod
     def get_by_id(cls, question_id: int):
@@ -151,6 +577,85 @@ class Question(db.Model):
         """
         return Question.query.get(question_id)
 
+    @classmethod
+    def get_formatted(cls, question_id: int, category_id: int = None):
+        """Return formatted question, from the cache if possible.
+
+        Use for reads, the cache is shared by all requests of the process.
+        :param question_id: identificator of the question
+        :question_id type: int
+        :param category_id: category of the question if known, only its
+            partition is read when questions are partitioned
+        :category_id type: int
+        :return: question formatted with `format()`, None if not found
+        :rtype: dict
+        """
+        data = question_cache.get(question_id)
+        if data is None:
+            if category_id is None:
+                question = Question.get_by_id(question_id)
+            else:
+                question = Question.query.filter(
+                    Question.category_id == category_id,
+                    Question.id == question_id).first()
+            if question is None:
+                return None
+
+            data = question.format()
+            question_cache.put(question_id, data)
+
+        return dict(data)
+
+    @classmethod
+    def get_many(cls, question_ids: list):
+        """Return questions with the given ids, in a single query.
+
+        On postgres the ids are sent as one array parameter
+        (`id = ANY(:ids)`), the statement is the same for any number of ids.
+        :param question_ids: ids of the questions
+        :question_ids type: list
+        :return: questions in the order of the ids, the missing are skipped
+        :rtype: list
+        """
+        if not question_ids:
+            return []
+
+        if db.session.bind.dialect.name == "postgresql":
+            condition = Question.id == any_(
+                bindparam("question_ids", list(question_ids),
+                          type_=ARRAY(db.Integer)))
+        else:
+            condition = Question.id.in_(question_ids)
+
+        questions = {q.id: q for q in Question.query.filter(condition)}
+        return [questions[i] for i in question_ids if i in questions]
+
+    @classmethod
+    def get_many_formatted(cls, question_ids: list):
+        """Return formatted questions, from the cache if possible.
+
+        Only the questions not cached are read, in a single query (see
+        `get_many`), and cached. Use for reads, see `get_formatted`.
+        :param question_ids: ids of the questions
+        :question_ids type: list
+        :return: questions formatted with `format()` in the order of the
+            ids, the missing are skipped
+        :rtype: list
+        """
+        questions = {}
+        for question_id in question_ids:
+            data = question_cache.get(question_id)
+            if data is not None:
+                questions[question_id] = data
+
+        missing = [i for i in question_ids if i not in questions]
+        for question in Question.get_many(list(dict.fromkeys(missing))):
+            data = question.format()
+            question_cache.put(question.id, data)
+            questions[question.id] = data
+
+        return [dict(questions[i]) for i in question_ids if i in questions]
+
     @classmethod
     def get_all(cls):
         """Return all questions from the db."""
@@ -163,7 +668,27 @@ class Question(db.Model):
         :param category_id: id of category
         :category_id type: int
         """
-        return Question.query.filter(Question.category_id == category_id).all()
+        return Question.query.filter(Question.category_id == category_id) \
+                       .order_by(Question.id).all()
+
+    @classmethod
+    def get_random(cls, count: int, category_id: int = None,
+                   exclude: list = None):
+        """Return distinct random questions sampled in a single query.
+
+        :param count: maximum number of questions to return
+        :count type: int
+        :param category_id: id of the category, all categories if None
+        :category_id type: int
+        :param exclude: ids of questions not to return
+        :exclude type: list
+        """
+        query = Question.query
+        if category_id is not None:
+            query = query.filter(Question.category_id == category_id)
+        if exclude:
+            query = query.filter(Question.id.notin_(exclude))
+        return query.order_by(func.random()).limit(count).all()
 
     @classmethod
     def get_count(cls):
@@ -193,12 +718,497 @@ class Question(db.Model):
             func.lower(
                 Question.question_text).contains(search_term.lower())).all()
 
+    def format(self):
+        """Return the object in format easy to serialize with json."""
+        return Question._format_row(self)
+
+    @staticmethod
+    def _format_row(row):
+        """Return a question or a row of the questions table formatted."""
+        return {
+            'id': row.id,
+            'question': row.question_text,
+            'answer': row.answer,
+            'category': row.category_id,
+            'difficulty': row.difficulty,
+            'version': row.version
+            }
+
+
+class QuestionChange(db.Model):
+    """Represent a change of a question, an entry of the change log.
+
+    Written by `Question` methods in the transaction of the change, so a
+    mirror of the questions can follow the changes by `seq`.
+    :param seq: sequence number, grows with every change
+    :seq type: int
+    :param question_id: id of the changed question
+    :question_id type: int
+    :param operation: `created`, `updated` or `deleted`
+    :operation type: str
+    :param data: the question formatted with `format()` after the change,
+        the last state for a deleted question
+    :data type: dict
+    """
+
+    __tablename__ = 'question_changes'
+    # sqlite would reuse sequence numbers of deleted changes otherwise
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = Column(db.Integer(), primary_key=True)
+    # not a foreign key, changes of deleted questions are kept
+    question_id = Column(db.Integer(), nullable=False)
+    operation = Column(db.String(10), nullable=False)
+    data = Column(db.JSON(), nullable=False)
+    changed_at = Column(db.DateTime(timezone=True), nullable=False,
+                        server_default=func.now())
+
+    @classmethod
+    def record(cls, operation: str, data: dict):
+        """Add a change to the current transaction.
+
+        On postgres the writers are serialized by a transaction lock, a
+        change gets its `seq` only when changes with lower numbers are
+        committed, so a reader never skips a change committed late.
+        :param operation: `created`, `updated` or `deleted`
+        :operation type: str
+        :param data: formatted question
+        :data type: dict
+        """
+        QuestionChange.record_many(operation, [data])
+
+    @classmethod
+    def record_many(cls, operation: str, items: list):
+        """Add changes of several questions to the current transaction.
+
+        The change log lock is taken once, see `record`. The changes are
+        staged for the events too, see `stage_changes`.
+        :param operation: `created`, `updated` or `deleted`
+        :operation type: str
+        :param items: formatted questions
+        :items type: list
+        """
+        if db.session.bind.dialect.name == 'postgresql':
+            db.session.execute(
+                select(func.pg_advisory_xact_lock(CHANGE_LOG_LOCK_ID)))
+
+        db.session.add_all([
+            QuestionChange(question_id=data['id'], operation=operation,
+                           data=data)
+            for data in items
+        ])
+        stage_changes(f'question.{operation}', items)
+
+    @classmethod
+    def get_since(cls, seq: int, limit: int):
+        """Return changes with a higher sequence number, the oldest first.
+
+        :param seq: sequence number of the last change seen
+        :seq type: int
+        :param limit: the highest number of changes returned
+        :limit type: int
+        """
+        return QuestionChange.query.filter(QuestionChange.seq > seq) \
+                             .order_by(QuestionChange.seq) \
+                             .limit(limit).all()
+
+    @classmethod
+    def get_first_seq(cls):
+        """Return sequence number of the oldest kept change, None if none."""
+        return db.session.query(func.min(QuestionChange.seq)).scalar()
+
+    @classmethod
+    def get_head_seq(cls):
+        """Return sequence number of the newest change, 0 if none."""
+        return db.session.query(func.max(QuestionChange.seq)).scalar() or 0
+
+    @classmethod
+    def prune(cls, before) -> int:
+        """Delete changes older than the given time.
+
+        :param before: changes made before are deleted
+        :before type: `datetime.datetime`
+        :return: number of deleted changes
+        :rtype: int
+        """
+        changes = QuestionChange.__table__
+        result = db.session.execute(
+            changes.delete().where(changes.c.changed_at < before))
+        db.session.commit()
+        return result.rowcount
+
+    def format(self):
+        """Return the object in format easy to serialize with json."""
+        return {
+            'seq': self.seq,
+            'operation': self.operation,
+            'question_id': self.question_id,
+            'question': self.data,
+            'changed_at': (self.changed_at.isoformat()
+                           if self.changed_at else None)
+            }
+
+
+class QuestionSignature(db.Model):
+    """Represent the MinHash signature of a question text.
+
+    Written by `Question` methods in the transaction of the change, loaded
+    by the near-duplicate index, see `dedupe`.
+    :param question_id: id of the question
+    :question_id type: int
+    :param signature: `minhash.signature` of the question text
+    :signature type: bytes
+    """
+
+    __tablename__ = 'question_signatures'
+
+    # not a foreign key, the questions table can be partitioned
+    question_id = Column(db.Integer(), primary_key=True,
+                         autoincrement=False)
+    signature = Column(db.LargeBinary(), nullable=False)
+
+    @classmethod
+    def sign(cls, text: str) -> bytes:
+        """Return `minhash.signature` of the text, computed once per text.
+
+        The signature of a new question is looked up by `dedupe`, stored
+        with the question and added to the index of the process; it is
+        computed by the first of them only.
+        :param text: text of a question
+        :text type: str
+        :rtype: bytes
+        """
+        signature = signature_cache.get(text)
+        if signature is None:
+            signature = minhash.signature(text)
+            signature_cache.put(text, signature)
+        return signature
+
+    @classmethod
+    def record_many(cls, operation: str, items: list):
+        """Store signatures of changed questions in the current transaction.
+
+        :param operation: `created`, `updated` or `deleted`
+        :operation type: str
+        :param items: formatted questions
+        :items type: list
+        """
+        signatures = QuestionSignature.__table__
+        if operation != 'created':
+            db.session.execute(signatures.delete().where(
+                signatures.c.question_id.in_([data['id'] for data in items])))
+
+        if operation != 'deleted':
+            db.session.execute(signatures.insert(), [
+                {'question_id': data['id'],
+                 'signature': QuestionSignature.sign(data['question'])}
+                for data in items])
+
+    @classmethod
+    def get_all(cls):
+        """Return (question id, signature) of all questions.
+
+        Signatures left by questions deleted with their category are
+        skipped.
+        """
+        return db.session.query(QuestionSignature.question_id,
+                                QuestionSignature.signature) \
+                         .join(Question,
+                               Question.id == QuestionSignature.question_id) \
+                         .all()
+
+    @classmethod
+    def backfill(cls, batch_size: int = 1000) -> int:
+        """Store signatures of the questions having none.
+
+        :param batch_size: questions signed in one transaction
+        :batch_size type: int
+        :return: number of stored signatures
+        :rtype: int
+        """
+        questions, signatures = Question.__table__, QuestionSignature.__table__
+        count = 0
+        while True:
+            rows = db.session.execute(
+                select(questions.c.id, questions.c.question_text)
+                .where(~questions.c.id.in_(select(signatures.c.question_id)))
+                .order_by(questions.c.id).limit(batch_size)).all()
+            if not rows:
+                return count
+
+            db.session.execute(signatures.insert(), [
+                {'question_id': row.id,
+                 'signature': minhash.signature(row.question_text)}
+                for row in rows])
+            db.session.commit()
+            count += len(rows)
+
+
+class QuizAttempt(db.Model):
+    """Represent an answer of a quiz player to a question.
+
+    Written in batches by `attempts.AttemptBuffer`, not in the request.
+    :param question_id: id of the answered question
+    :question_id type: int
+    :param correct: True if the answer was right
+    :correct type: bool
+    :param time_ms: milliseconds between showing the question and the answer
+    :time_ms type: int
+    :param answered_at: time the attempt was received
+    :answered_at type: `datetime.datetime`
+    """
+
+    __tablename__ = 'quiz_attempts'
+    __table_args__ = (
+        db.Index('ix_quiz_attempts_question_id', 'question_id'),
+    )
+
+    id = Column(db.BigInteger().with_variant(db.Integer(), 'sqlite'),
+                primary_key=True)
+    # not a foreign key, attempts of deleted questions are kept
+    question_id = Column(db.Integer(), nullable=False)
+    correct = Column(db.Boolean(), nullable=False)
+    time_ms = Column(db.Integer(), nullable=False)
+    answered_at = Column(db.DateTime(timezone=True), nullable=False)
+
+    # columns written by the buffer, in the order of its rows
+    COLUMNS = ('question_id', 'correct', 'time_ms', 'answered_at')
+
+    @classmethod
+    def insert_many(cls, rows: list):
+        """Insert attempts in the current transaction, without committing.
+
+        On postgres the rows are sent by `COPY`, on other databases by one
+        `executemany` insert.
+        :param rows: values of `COLUMNS`
+        :rows type: a list of tuples
+        """
+        if not rows:
+            return
+
+        if db.session.bind.dialect.name == 'postgresql':
+            content = io.StringIO()
+            csv.writer(content).writerows(rows)
+            content.seek(0)
+
+            statement = f"COPY {cls.__tablename__} " \
+                        f"({', '.join(cls.COLUMNS)}) FROM STDIN WITH " \
+                        f"(FORMAT csv)"
+            dbapi = db.session.bind.dialect.dbapi
+            cursor = db.session.connection().connection.cursor()
+            try:
+                cursor.copy_expert(statement, content)
+            except dbapi.Error as e:
+                # raised as the errors of the statements sent by sqlalchemy
+                raise exc.DBAPIError.instance(statement, None, e,
+                                              dbapi.Error) from e
+            finally:
+                cursor.close()
+
+        else:
+            db.session.execute(QuizAttempt.__table__.insert(),
+                               [dict(zip(cls.COLUMNS, row)) for row in rows])
+
+
+class Game(db.Model):
+    """Represent a finished quiz game.
+
+    :param player: name of the player
+    :player type: str
+    :param category_id: category of the quiz, None for all categories
+    :category_id type: int
+    :param score: number of correct answers
+    :score type: int
+    :param questions: number of answered questions
+    :questions type: int
+    """
+
+    __tablename__ = 'games'
+
+    id = Column(db.Integer(), primary_key=True)
+    player = Column(db.String(64), nullable=False)
+    # not a foreign key, games of deleted categories are kept
+    category_id = Column(db.Integer(), nullable=True)
+    score = Column(db.Integer(), nullable=False)
+    questions = Column(db.Integer(), nullable=False)
+    played_at = Column(db.DateTime(timezone=True), nullable=False,
+                       server_default=func.now())
+
+    def __init__(self, player: str, category_id: int, score: int,
+                 questions: int):
+        """Create an object."""
+        self.player = player
+        self.category_id = category_id
+        self.score = score
+        self.questions = questions
+        # copied to the leaderboard, known without reading the game back
+        self.played_at = datetime.now(timezone.utc)
+
+    def insert(self, leaderboard_size: int = 100):
+        """Create the game and add it to the leaderboards it enters.
+
+        :param leaderboard_size: number of games kept on a leaderboard
+        :leaderboard_size type: int
+        """
+        db.session.add(self)
+        db.session.flush()
+        LeaderboardEntry.add(self, leaderboard_size)
+        data = self.format()
+        db.session.commit()
+        return data
+
     def format(self):
         """Return the object in format easy to serialize with json."""
         return {
             'id': self.id,
-            'question': self.question_text,
-            'answer': self.answer,
+            'player': self.player,
             'category': self.category_id,
-            'difficulty': self.difficulty
+            'score': self.score,
+            'questions': self.questions,
+            'played_at': (self.played_at.isoformat()
+                          if self.played_at else None)
+            }
+
+
+class LeaderboardEntry(db.Model):
+    """Represent a game on a leaderboard, the best games of a scope.
+
+    Every category has a leaderboard of its games, scope 0 is the leaderboard
+    of all games. A leaderboard keeps only its best `size` games, maintained
+    by `add` when a game is inserted, so reading the top K games reads K
+    rows, however many games were played. Better score first, the earlier
+    game first for the same score.
+    :param scope: id of the category, 0 for all games
+    :scope type: int
+    :param game_id: id of the game
+    :game_id type: int
+    """
+
+    __tablename__ = 'leaderboard_entries'
+    __table_args__ = (
+        # top K of a scope is the first K index entries
+        db.Index('ix_leaderboard_entries_scope_score', 'scope',
+                 db.text('score DESC'), 'game_id'),
+    )
+
+    scope = Column(db.Integer(), primary_key=True)
+    game_id = Column(db.Integer(), db.ForeignKey('games.id'),
+                     primary_key=True)
+    player = Column(db.String(64), nullable=False)
+    score = Column(db.Integer(), nullable=False)
+    played_at = Column(db.DateTime(timezone=True), nullable=False)
+
+    GLOBAL_SCOPE = 0
+
+    @classmethod
+    def add(cls, game: Game, size: int):
+        """Put the game on its leaderboards if it is good enough.
+
+        Runs in the transaction of the game. A game not better than the last
+        game of a full leaderboard costs one indexed read. Otherwise the game
+        is inserted and the games pushed below the `size` best are deleted;
+        games inserted concurrently can leave more than `size` games for a
+        while, never less.
+        :param game: inserted game
+        :game type: `Game`
+        :param size: number of games kept on a leaderboard
+        :size type: int
+        """
+        entries = LeaderboardEntry.__table__
+
+        scopes = [cls.GLOBAL_SCOPE]
+        if game.category_id is not None:
+            scopes.append(game.category_id)
+
+        for scope in scopes:
+            last = db.session.execute(
+                select(entries.c.score, entries.c.game_id)
+                .where(entries.c.scope == scope)
+                .order_by(entries.c.score.desc(), entries.c.game_id)
+                .offset(size - 1).limit(1)).first()
+            # the earlier game stays for the same score
+            if last is not None and game.score <= last.score:
+                continue
+
+            db.session.execute(entries.insert().values(
+                scope=scope, game_id=game.id, player=game.player,
+                score=game.score, played_at=game.played_at))
+            if last is not None:
+                db.session.execute(entries.delete().where(
+                    entries.c.scope == scope,
+                    (entries.c.score < last.score)
+                    | ((entries.c.score == last.score)
+                       & (entries.c.game_id >= last.game_id))))
+
+    @classmethod
+    def get_top(cls, limit: int, category_id: int = None):
+        """Return the best games of a leaderboard, the best first.
+
+        :param limit: number of games, at most the leaderboard size
+        :limit type: int
+        :param category_id: category of the leaderboard, None for all games
+        :category_id type: int
+        """
+        scope = cls.GLOBAL_SCOPE if category_id is None else category_id
+        return LeaderboardEntry.query \
+            .filter(LeaderboardEntry.scope == scope) \
+            .order_by(LeaderboardEntry.score.desc(),
+                      LeaderboardEntry.game_id) \
+            .limit(limit).all()
+
+    @classmethod
+    def rebuild(cls, size: int) -> int:
+        """Fill the leaderboards from all games again.
+
+        :param size: number of games kept on a leaderboard
+        :size type: int
+        :return: number of entries
+        :rtype: int
+        """
+        entries, games = LeaderboardEntry.__table__, Game.__table__
+        db.session.execute(entries.delete())
+
+        order = (games.c.score.desc(), games.c.id)
+        for scope, rank, condition in [
+                (literal(cls.GLOBAL_SCOPE),
+                 func.row_number().over(order_by=order), true()),
+                (games.c.category_id,
+                 func.row_number().over(partition_by=games.c.category_id,
+                                        order_by=order),
+                 games.c.category_id.isnot(None))]:
+            ranked = select(
+                scope.label('scope'), games.c.id.label('game_id'),
+                games.c.player, games.c.score, games.c.played_at,
+                rank.label('rank')
+            ).where(condition).subquery()
+            db.session.execute(entries.insert().from_select(
+                ['scope', 'game_id', 'player', 'score', 'played_at'],
+                select(ranked.c.scope, ranked.c.game_id, ranked.c.player,
+                       ranked.c.score, ranked.c.played_at)
+                .where(ranked.c.rank <= size)))
+
+        count = db.session.query(func.count()) \
+                          .select_from(LeaderboardEntry).scalar()
+        db.session.commit()
+        return count
+
+    def format(self, rank: int):
+        """Return the object in format easy to serialize with json.
+
+        :param rank: position on the leaderboard, from 1
+        :rank type: int
+        """
+        return {
+            'rank': rank,
+            'game_id': self.game_id,
+            'player': self.player,
+            'score': self.score,
+            'played_at': self.played_at.isoformat()
             }
+
+
+event.listen(Question.__table__, 'after_create',
+             QUESTION_COUNT_FUNCTION.execute_if(dialect='postgresql'))
+for trigger in QUESTION_COUNT_TRIGGERS:
+    event.listen(Question.__table__, 'after_create',
+                 trigger.execute_if(dialect='postgresql'))
@@ -0,0 +1,338 @@
+"""List partitioning of the `questions` table by category (postgres).
+
+Every category has its own partition `questions_c<category id>`, questions
+of a category missing a partition go to `questions_default`. Queries filtered
+by a category read only its partition, a per category read or delete costs
+the size of the category, not of the whole bank.
+
+The partitioned table has the primary key `(category_id, id)` (postgres
+requires the partition key in unique constraints), ids stay unique as they
+come from the same sequence. Lookups by id alone use the `ix_questions_id`
+index of every partition.
+
+`partition_questions` converts a plain table online:
+
+1. an empty partitioned copy is created, a trigger on the plain table
+   applies every change to the copy,
+2. existing rows are copied in small batches, each in its own transaction,
+3. in a short transaction the plain table is locked, checked against the
+   copy, dropped, and the copy takes its name.
+
+Reads and writes of the table are blocked only during the last step.
+"""
+
+from typing import Callable
+
+from sqlalchemy import text
+
+COPY_TABLE = "questions_partitioned"
+DEFAULT_PARTITION = "questions_default"
+
+COUNT_FUNCTION = "questions_count_trigger"
+COUNT_TRIGGERS = {
+    "questions_count_insert":
+        "AFTER INSERT ON questions REFERENCING NEW TABLE AS new_rows",
+    "questions_count_delete":
+        "AFTER DELETE ON questions REFERENCING OLD TABLE AS old_rows",
+    "questions_count_update":
+        "AFTER UPDATE ON questions "
+        "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+}
+
+SYNC_FUNCTION = """
+CREATE OR REPLACE FUNCTION questions_partition_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {copy}
+        WHERE category_id = OLD.category_id AND id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {copy} ({columns})
+        VALUES ({values})
+        ON CONFLICT (category_id, id) DO UPDATE
+        SET {updates};
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def question_columns(connection) -> list:
+    """Return names of the columns of `questions`, in the table order.
+
+    The tables are created from the current `questions` table, so the
+    conversions work with the columns of any schema revision.
+    """
+    return connection.execute(text(
+        "SELECT attname FROM pg_attribute "
+        "WHERE attrelid = 'questions'::regclass AND attnum > 0 "
+        "AND NOT attisdropped ORDER BY attnum")).scalars().all()
+
+
+def partition_name(category_id: int) -> str:
+    """Return name of the partition of the category."""
+    return f"questions_c{int(category_id)}"
+
+
+def is_partitioned(connection) -> bool:
+    """Check if the `questions` table is partitioned.
+
+    :param connection: connection or session of a postgres database
+    :connection type: `sqlalchemy.engine.Connection`
+    """
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass('questions'))")).scalar()
+
+
+def create_partition(connection, category_id: int,
+                     table: str = "questions") -> None:
+    """Create the partition of the category if it does not exist.
+
+    The partition is created apart and attached, attaching does not block
+    reads and writes of the table.
+    :param connection: connection or session of a postgres database
+    :connection type: `sqlalchemy.engine.Connection`
+    :param category_id: id of the category
+    :category_id type: int
+    :param table: name of the partitioned table
+    :table type: str
+    """
+    name = partition_name(category_id)
+    exists = connection.execute(
+        text("SELECT to_regclass(:name) IS NOT NULL"),
+        {"name": name}).scalar()
+    if exists:
+        return
+
+    connection.execute(text(
+        f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    connection.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} "
+        f"FOR VALUES IN ({int(category_id)})"))
+
+
+def drop_partition(connection, category_id: int) -> None:
+    """Drop the partition of the category if it exists.
+
+    :param connection: connection or session of a postgres database
+    :connection type: `sqlalchemy.engine.Connection`
+    :param category_id: id of the category
+    :category_id type: int
+    """
+    connection.execute(text(
+        f"DROP TABLE IF EXISTS {partition_name(category_id)}"))
+
+
+def create_partitioned_copy(connection) -> None:
+    """Create the empty partitioned copy of `questions` with partitions.
+
+    :param connection: connection of a postgres database
+    :connection type: `sqlalchemy.engine.Connection`
+    """
+    connection.execute(text(
+        f"CREATE TABLE {COPY_TABLE} (LIKE questions INCLUDING DEFAULTS, "
+        f"CONSTRAINT {COPY_TABLE}_pkey PRIMARY KEY (category_id, id), "
+        f"FOREIGN KEY (category_id) REFERENCES categories (id)) "
+        f"PARTITION BY LIST (category_id)"))
+    connection.execute(text(
+        f"CREATE INDEX {COPY_TABLE}_id ON {COPY_TABLE} (id)"))
+    connection.execute(text(
+        f"CREATE INDEX {COPY_TABLE}_category_id_difficulty "
+        f"ON {COPY_TABLE} (category_id, difficulty)"))
+    connection.execute(text(
+        f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {COPY_TABLE} "
+        f"DEFAULT"))
+
+    category_ids = connection.execute(
+        text("SELECT id FROM categories ORDER BY id")).scalars().all()
+    for category_id in category_ids:
+        connection.execute(text(
+            f"CREATE TABLE {partition_name(category_id)} "
+            f"PARTITION OF {COPY_TABLE} FOR VALUES IN ({int(category_id)})"))
+
+    columns = question_columns(connection)
+    connection.execute(text(SYNC_FUNCTION.format(
+        copy=COPY_TABLE,
+        columns=", ".join(columns),
+        values=", ".join(f"NEW.{column}" for column in columns),
+        updates=", ".join(f"{column} = EXCLUDED.{column}"
+                          for column in columns
+                          if column not in ("id", "category_id")))))
+    connection.execute(text(
+        "CREATE TRIGGER questions_partition_sync "
+        "AFTER INSERT OR UPDATE OR DELETE ON questions "
+        "FOR EACH ROW EXECUTE FUNCTION questions_partition_sync()"))
+
+
+def copy_batch(connection, after_id: int, batch_size: int) -> int:
+    """Copy questions with the next ids to the partitioned copy.
+
+    The copied rows are locked until the transaction ends, a concurrent
+    change of them waits and then is applied by the sync trigger.
+    :param connection: connection of a postgres database
+    :connection type: `sqlalchemy.engine.Connection`
+    :param after_id: the highest id already copied
+    :after_id type: int
+    :param batch_size: number of rows copied
+    :batch_size type: int
+    :return: the highest copied id, None if there was nothing to copy
+    :rtype: int
+    """
+    columns = ", ".join(question_columns(connection))
+    return connection.execute(text(f"""
+        WITH batch AS (
+            SELECT {columns}
+            FROM questions WHERE id > :after_id
+            ORDER BY id LIMIT :batch_size
+            FOR SHARE
+        ), copied AS (
+            INSERT INTO {COPY_TABLE} ({columns})
+            SELECT * FROM batch
+            ON CONFLICT (category_id, id) DO NOTHING
+        )
+        SELECT max(id) FROM batch
+    """), {"after_id": after_id, "batch_size": batch_size}).scalar()
+
+
+def swap_tables(connection) -> None:
+    """Replace the plain table by the partitioned copy.
+
+    Has to run in one transaction, the plain table is locked meanwhile.
+    :param connection: connection of a postgres database
+    :connection type: `sqlalchemy.engine.Connection`
+    """
+    connection.execute(text("LOCK TABLE questions IN ACCESS EXCLUSIVE MODE"))
+
+    counts = connection.execute(text(
+        f"SELECT (SELECT count(*) FROM questions), "
+        f"(SELECT count(*) FROM {COPY_TABLE})")).one()
+    if counts[0] != counts[1]:
+        raise RuntimeError(f"Partitioned copy has {counts[1]} questions, "
+                           f"the table {counts[0]}.")
+
+    connection.execute(text("ALTER SEQUENCE questions_id_seq OWNED BY NONE"))
+    connection.execute(text("DROP TABLE questions"))
+    connection.execute(text("DROP FUNCTION questions_partition_sync()"))
+
+    connection.execute(text(f"ALTER TABLE {COPY_TABLE} RENAME TO questions"))
+    connection.execute(text(
+        f"ALTER TABLE questions RENAME CONSTRAINT {COPY_TABLE}_pkey "
+        f"TO questions_pkey"))
+    connection.execute(text(
+        f"ALTER INDEX {COPY_TABLE}_id RENAME TO ix_questions_id"))
+    connection.execute(text(
+        f"ALTER INDEX {COPY_TABLE}_category_id_difficulty "
+        f"RENAME TO ix_questions_category_id_difficulty"))
+    connection.execute(text(
+        "ALTER SEQUENCE questions_id_seq OWNED BY questions.id"))
+
+    _create_count_triggers(connection)
+
+
+def _create_count_triggers(connection) -> None:
+    """Create the question count triggers if the function exists."""
+    exists = connection.execute(text(
+        f"SELECT to_regproc('{COUNT_FUNCTION}') IS NOT NULL")).scalar()
+    if not exists:
+        return
+
+    for name, definition in COUNT_TRIGGERS.items():
+        connection.execute(text(
+            f"CREATE TRIGGER {name} {definition} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {COUNT_FUNCTION}()"))
+
+
+def partition_questions(engine, batch_size: int = 10000,
+                        log: Callable[[str], None] = print) -> None:
+    """Convert the plain `questions` table to a partitioned one, online.
+
+    :param engine: engine of the postgres database
+    :engine type: `sqlalchemy.engine.Engine`
+    :param batch_size: number of rows copied in a transaction
+    :batch_size type: int
+    :param log: callable reporting the progress
+    :log type: Callable[[str], None]
+    """
+    if engine.dialect.name != "postgresql":
+        log("Questions are partitioned on postgres only.")
+        return
+
+    with engine.connect() as connection:
+        if is_partitioned(connection):
+            log("Questions are partitioned already.")
+            return
+
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {COPY_TABLE}"))
+        create_partitioned_copy(connection)
+
+    after_id = 0
+    while True:
+        with engine.begin() as connection:
+            last_id = copy_batch(connection, after_id, batch_size)
+        if last_id is None:
+            break
+
+        after_id = last_id
+        log(f"Copied questions up to id {after_id}.")
+
+    with engine.begin() as connection:
+        # the statement waits for the lock, other queries wait for it
+        connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+        swap_tables(connection)
+
+    log("Questions are partitioned.")
+
+
+def unpartition_questions(engine,
+                          log: Callable[[str], None] = print) -> None:
+    """Convert the partitioned `questions` table back to a plain one.
+
+    Runs in a single transaction, the table is locked meanwhile.
+    :param engine: engine of the postgres database
+    :engine type: `sqlalchemy.engine.Engine`
+    :param log: callable reporting the progress
+    :log type: Callable[[str], None]
+    """
+    if engine.dialect.name != "postgresql":
+        log("Questions are partitioned on postgres only.")
+        return
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            log("Questions are not partitioned.")
+            return
+
+        connection.execute(text(
+            "LOCK TABLE questions IN ACCESS EXCLUSIVE MODE"))
+        connection.execute(text(
+            "CREATE TABLE questions_plain (LIKE questions INCLUDING DEFAULTS, "
+            "CONSTRAINT questions_plain_pkey PRIMARY KEY (id), "
+            "FOREIGN KEY (category_id) REFERENCES categories (id))"))
+        columns = ", ".join(question_columns(connection))
+        connection.execute(text(
+            f"INSERT INTO questions_plain ({columns}) "
+            f"SELECT {columns} FROM questions"))
+
+        connection.execute(text(
+            "ALTER SEQUENCE questions_id_seq OWNED BY NONE"))
+        connection.execute(text("DROP TABLE questions CASCADE"))
+        connection.execute(text(
+            "ALTER TABLE questions_plain RENAME TO questions"))
+        connection.execute(text(
+            "ALTER TABLE questions RENAME CONSTRAINT questions_plain_pkey "
+            "TO questions_pkey"))
+        connection.execute(text(
+            "ALTER SEQUENCE questions_id_seq OWNED BY questions.id"))
+        connection.execute(text(
+            "CREATE INDEX ix_questions_category_id_id "
+            "ON questions (category_id, id)"))
+        connection.execute(text(
+            "CREATE INDEX ix_questions_category_id_difficulty "
+            "ON questions (category_id, difficulty)"))
+
+        _create_count_triggers(connection)
+
+    log("Questions are not partitioned.")
@@ -0,0 +1,403 @@
+"""Read-only binary store of the questions, shared by workers with `mmap`.
+
+The store is a single file generated from the db:
+
+- a header (`HEADER`),
+- fixed width arrays of the questions sorted by id: ids, category ids,
+  difficulties, versions and offsets of the question and answer texts in
+  the heap,
+- arrays of the categories sorted by id: ids, question counts, start of
+  their questions in the `by_category` array and offsets of their names,
+- `by_category`, indexes of the questions grouped by category,
+- the string heap, utf-8 texts one after another.
+
+The file is mapped read-only, every worker reading it shares the same pages
+of the page cache, nothing is copied until a text is decoded. A lookup by id
+is a binary search over the ids, questions of a category are a slice of
+`by_category`.
+
+Files are named by a digest of the content, the `generation` file names the
+current one. A new store is written next to the current one and the
+generation file is replaced, readers (see `StoreWatcher`) notice the change
+and map the new file.
+"""
+
+import bisect
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+from array import array
+from typing import Iterator, Optional, Tuple
+
+from models import Category, Question, db
+from quiz_sampler import QuestionBuckets
+
+MAGIC = b"TRQS"
+FORMAT_VERSION = 2
+GENERATION_FILE = "generation"
+
+# magic, format version, byte order (0 little, 1 big), question count,
+# category count, heap size, version of the content
+HEADER = struct.Struct("<4sHHIII16s")
+
+# arrays are aligned to 8 bytes
+ALIGNMENT = 8
+
+
+def _align(offset: int) -> int:
+    """Return the offset rounded up to the alignment."""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(question_count: int, category_count: int) -> list:
+    """Return (name, typecode, length) of the arrays in the file order."""
+    return [
+        ("ids", "i", question_count),
+        ("categories", "i", question_count),
+        ("difficulties", "B", question_count),
+        ("versions", "I", question_count),
+        ("text_offsets", "I", 2 * question_count + 1),
+        ("category_ids", "i", category_count),
+        ("category_counts", "I", category_count),
+        ("category_starts", "I", category_count),
+        ("category_type_offsets", "I", category_count + 1),
+        ("by_category", "I", question_count),
+    ]
+
+
+def _byte_order() -> int:
+    """Return the byte order of the arrays written by this machine."""
+    return 0 if sys.byteorder == "little" else 1
+
+
+def encode_store(categories: list, questions: list) -> bytes:
+    """Return content of a store file.
+
+    :param categories: (id, type) of the categories
+    :categories type: a list of tuples
+    :param questions: (id, category id, difficulty, version, question,
+        answer) of the questions
+    :questions type: a list of tuples
+    """
+    questions = sorted(questions)
+    categories = sorted(categories)
+
+    arrays = {name: array(typecode) for name, typecode, _
+              in _layout(0, 0)}
+    heap = bytearray()
+
+    by_category = {category_id: [] for category_id, _ in categories}
+    for index, (question_id, category_id, difficulty, version, text,
+                answer) in enumerate(questions):
+        arrays["ids"].append(question_id)
+        arrays["categories"].append(category_id)
+        arrays["difficulties"].append(difficulty)
+        arrays["versions"].append(version)
+        for value in (text, answer):
+            arrays["text_offsets"].append(len(heap))
+            heap += value.encode()
+        by_category.setdefault(category_id, []).append(index)
+    arrays["text_offsets"].append(len(heap))
+
+    # questions of a category missing in the categories are kept too,
+    # the category has no name then
+    names = dict(categories)
+    for category_id in sorted(by_category):
+        indexes = by_category[category_id]
+        arrays["category_ids"].append(category_id)
+        arrays["category_counts"].append(len(indexes))
+        arrays["category_starts"].append(len(arrays["by_category"]))
+        arrays["category_type_offsets"].append(len(heap))
+        heap += (names.get(category_id) or "").encode()
+        arrays["by_category"].extend(indexes)
+    arrays["category_type_offsets"].append(len(heap))
+
+    body = bytearray()
+    offset = HEADER.size
+    for name, _, _ in _layout(0, 0):
+        offset = _align(offset)
+        body += bytes(offset - HEADER.size - len(body))
+        body += arrays[name].tobytes()
+        offset = HEADER.size + len(body)
+    body += heap
+
+    version = hashlib.sha256(body).hexdigest()[:16].encode()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, _byte_order(),
+                         len(questions), len(arrays["category_ids"]),
+                         len(heap), version)
+
+    return header + bytes(body)
+
+
+class QuestionStore:
+    """Questions and categories of a mapped store file.
+
+    :param path: path of the store file
+    :path type: str
+    """
+
+    def __init__(self, path: str):
+        """Map the file."""
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self._mmap)
+        (magic, format_version, byte_order, self.question_count,
+         self.category_count, heap_size, version) = \
+            HEADER.unpack_from(view)
+        if magic != MAGIC or format_version != FORMAT_VERSION \
+                or byte_order != _byte_order():
+            raise ValueError(f"{path} is not a question store of this "
+                             f"format.")
+        self.version = version.decode()
+
+        offset = HEADER.size
+        for name, typecode, length in _layout(self.question_count,
+                                              self.category_count):
+            offset = _align(offset)
+            size = length * array(typecode).itemsize
+            setattr(self, f"_{name}",
+                    view[offset:offset + size].cast(typecode))
+            offset += size
+        self._heap = view[offset:offset + heap_size]
+
+        self._buckets = None
+        self._lock = threading.Lock()
+
+    def _text(self, start: int, end: int) -> str:
+        """Return a text of the heap."""
+        return str(self._heap[start:end], "utf-8")
+
+    def _format(self, index: int) -> dict:
+        """Return the question at the index formatted as `Question`."""
+        offsets = self._text_offsets
+        return {
+            "id": self._ids[index],
+            "question": self._text(offsets[2 * index],
+                                   offsets[2 * index + 1]),
+            "answer": self._text(offsets[2 * index + 1],
+                                 offsets[2 * index + 2]),
+            "category": self._categories[index],
+            "difficulty": self._difficulties[index],
+            "version": self._versions[index],
+        }
+
+    def _category_index(self, category_id: int) -> Optional[int]:
+        """Return index of the category, None if not in the store."""
+        index = bisect.bisect_left(self._category_ids, category_id)
+        if index < self.category_count \
+                and self._category_ids[index] == category_id:
+            return index
+
+        return None
+
+    def get(self, question_id: int) -> Optional[dict]:
+        """Return formatted question, None if not in the store."""
+        index = bisect.bisect_left(self._ids, question_id)
+        if index < self.question_count and self._ids[index] == question_id:
+            return self._format(index)
+
+        return None
+
+    def get_page(self, page: int, page_size: int) -> list:
+        """Return formatted questions of the page, ordered by id."""
+        start = max(page - 1, 0) * page_size
+        end = min(start + page_size, self.question_count)
+        return [self._format(index) for index in range(start, end)]
+
+    def get_by_category(self, category_id: int) -> list:
+        """Return formatted questions of the category, ordered by id."""
+        index = self._category_index(category_id)
+        if index is None:
+            return []
+
+        start = self._category_starts[index]
+        end = start + self._category_counts[index]
+        return [self._format(i) for i in self._by_category[start:end]]
+
+    def get_category(self, category_id: int) -> Optional[dict]:
+        """Return formatted category, None if not in the store."""
+        index = self._category_index(category_id)
+        offsets = self._category_type_offsets
+        # a category of questions missing in the categories has no name
+        if index is None or offsets[index] == offsets[index + 1]:
+            return None
+
+        return {
+            "id": category_id,
+            "type": self._text(offsets[index], offsets[index + 1]),
+        }
+
+    def category_question_count(self, category_id: int) -> int:
+        """Return number of questions of the category."""
+        index = self._category_index(category_id)
+        return self._category_counts[index] if index is not None else 0
+
+    def categories_as_dict(self, non_empty_only: bool = False) -> dict:
+        """Return names of the categories by their ids, see `Category`."""
+        offsets = self._category_type_offsets
+        return {
+            str(category_id): self._text(offsets[i], offsets[i + 1])
+            for i, category_id in enumerate(self._category_ids)
+            if offsets[i] != offsets[i + 1]
+            and (self._category_counts[i] or not non_empty_only)
+        }
+
+    def rows(self) -> Iterator[Tuple[int, int, int]]:
+        """Yield (id, category id, difficulty) of all questions."""
+        return zip(self._ids, self._categories, self._difficulties)
+
+    @property
+    def buckets(self) -> QuestionBuckets:
+        """Return quiz buckets of the store questions, built on first use."""
+        with self._lock:
+            if self._buckets is None:
+                buckets = QuestionBuckets(ttl=float("inf"))
+                buckets.load(self.rows())
+                self._buckets = buckets
+
+            return self._buckets
+
+
+def current_file(directory: str) -> Optional[str]:
+    """Return path of the current store file, None if there is none."""
+    try:
+        with open(os.path.join(directory, GENERATION_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    return os.path.join(directory, name) if name else None
+
+
+def write_store(directory: str, content: bytes, keep: int = 2) -> str:
+    """Write the store file and make it the current one.
+
+    :param directory: directory of the store
+    :directory type: str
+    :param content: content of the store file, see `encode_store`
+    :content type: bytes
+    :param keep: number of store files kept, including the current one,
+        a worker may still map a replaced file
+    :keep type: int
+    :return: path of the current store file
+    :rtype: str
+    """
+    version = HEADER.unpack_from(content)[-1].decode()
+    name = f"questions-{version}.bin"
+    path = os.path.join(directory, name)
+
+    if not os.path.exists(path):
+        temporary = os.path.join(directory, f".{name}.{uuid.uuid4().hex}")
+        with open(temporary, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    if current_file(directory) != path:
+        temporary = os.path.join(directory,
+                                 f".{GENERATION_FILE}.{uuid.uuid4().hex}")
+        with open(temporary, "w") as f:
+            f.write(name)
+        os.replace(temporary, os.path.join(directory, GENERATION_FILE))
+
+    files = [entry for entry in os.scandir(directory)
+             if entry.name.startswith("questions-") and entry.name != name]
+    files.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in files[max(keep - 1, 0):]:
+        os.remove(entry.path)
+
+    return path
+
+
+def build_store(directory: str, keep: int = 2) -> str:
+    """Write a store of the current data, needs app context.
+
+    Builds of processes sharing the directory run one at a time.
+    :param directory: directory of the store
+    :directory type: str
+    :param keep: number of store files kept
+    :keep type: int
+    :return: path of the current store file
+    :rtype: str
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        categories = db.session.query(Category.id, Category.type).all()
+        questions = db.session.query(
+            Question.id, Question.category_id, Question.difficulty,
+            Question.version, Question.question_text, Question.answer).all()
+
+        return write_store(directory, encode_store(categories, questions),
+                           keep)
+
+
+class StoreWatcher:
+    """Current store of a directory, mapped again when it is replaced.
+
+    The generation file is checked at most once per `check_interval`
+    seconds.
+    :param directory: directory of the store
+    :directory type: str
+    :param check_interval: seconds between checks of the generation file
+    :check_interval type: float
+    """
+
+    def __init__(self, directory: str, check_interval: float = 1):
+        """Create a watcher."""
+        self.directory = directory
+        self.check_interval = check_interval
+
+        self._store = None
+        self._stamp = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[QuestionStore]:
+        """Return the current store, None if there is none."""
+        checked_at = self._checked_at
+        if checked_at is not None \
+                and time.monotonic() - checked_at < self.check_interval:
+            return self._store
+
+        with self._lock:
+            try:
+                stat = os.stat(os.path.join(self.directory, GENERATION_FILE))
+                stamp = (stat.st_ino, stat.st_mtime_ns)
+            except FileNotFoundError:
+                stamp = None
+
+            if stamp != self._stamp:
+                path = current_file(self.directory)
+                # a replaced store is unmapped when no request uses it
+                self._store = QuestionStore(path) if path else None
+                self._stamp = stamp
+
+            self._checked_at = time.monotonic()
+
+        return self._store
+
+
+def init_question_store(app) -> None:
+    """Register the store watcher of the app if the store is enabled.
+
+    Configuration keys: `QUESTION_STORE_DIR`,
+    `QUESTION_STORE_CHECK_INTERVAL`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    directory = app.config["QUESTION_STORE_DIR"]
+    if directory:
+        app.extensions["question_store"] = StoreWatcher(
+            directory, app.config["QUESTION_STORE_CHECK_INTERVAL"])
@@ -0,0 +1,462 @@
+"""Random draws of quiz questions without querying the questions table.
+
+Question ids are kept in memory, grouped in buckets by (category,
+difficulty). A draw picks a bucket with a Walker alias table built for the
+requested category weights and difficulty range, then a question from the
+bucket, both in O(1). Alias tables are cached and rebuilt only when the
+buckets change.
+
+In the adaptive mode the difficulty of the next question follows the
+answers of the player, see `next_difficulty`, the question is drawn from the
+buckets of that difficulty, or of the nearest difficulty with a question
+left.
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from helpers import MAX_DIFFICULTY, MIN_DIFFICULTY
+from models import Question, db, on_change
+
+# difficulty of the first question of an adaptive quiz
+START_DIFFICULTY = (MIN_DIFFICULTY + MAX_DIFFICULTY) // 2
+
+
+class AliasTable:
+    """Walker alias table, draws an index with the given weights in O(1).
+
+    Built with the Vose's method in O(n).
+    :param weights: non negative weights of the indexes, not all zero
+    :weights type: List[float]
+    """
+
+    def __init__(self, weights: List[float]):
+        """Create a table."""
+        count = len(weights)
+        total = sum(weights)
+        if count == 0 or total <= 0:
+            raise ValueError("At least one weight has to be positive.")
+
+        scaled = [w * count / total for w in weights]
+        self.probability = [0.0] * count
+        self.alias = [0] * count
+
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+
+            scaled[more] = scaled[more] + scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    def draw(self, rng: random.Random = random) -> int:
+        """Return a random index."""
+        i = rng.randrange(len(self.probability))
+        if rng.random() < self.probability[i]:
+            return i
+        return self.alias[i]
+
+
+def _put(buckets: dict, positions: dict, question_id: int, category_id: int,
+         difficulty: int) -> None:
+    """Add or move a question in the buckets."""
+    _pop(buckets, positions, question_id)
+
+    key = (category_id, difficulty)
+    bucket = buckets.setdefault(key, [])
+    positions[question_id] = (key, len(bucket))
+    bucket.append(question_id)
+
+
+def _pop(buckets: dict, positions: dict, question_id: int) -> bool:
+    """Remove a question from the buckets in O(1).
+
+    :return: True if the question was in the buckets
+    :rtype: bool
+    """
+    position = positions.pop(question_id, None)
+    if position is None:
+        return False
+
+    key, index = position
+    bucket = buckets[key]
+    last = bucket.pop()
+    if last != question_id:
+        bucket[index] = last
+        positions[last] = (key, index)
+    if not bucket:
+        del buckets[key]
+    return True
+
+
+class QuestionBuckets:
+    """Question ids grouped by (category, difficulty).
+
+    Loaded from the db on the first use and again after `ttl` seconds (to
+    see changes made by other processes). Changes committed by this process
+    are applied right away. A reload reads the db and builds new buckets
+    without holding the lock, one thread reloads while the others keep
+    drawing from the old buckets.
+    :param ttl: seconds after which the buckets are reloaded
+    :ttl type: float
+    :param max_tables: number of cached alias tables
+    :max_tables type: int
+    """
+
+    def __init__(self, ttl: float = 60, max_tables: int = 256):
+        """Create buckets."""
+        self.ttl = ttl
+        self.max_tables = max_tables
+
+        self._lock = threading.RLock()
+        # one load at a time, draws do not wait for it
+        self._load_lock = threading.Lock()
+        self._buckets = {}
+        self._positions = {}
+        self._tables = OrderedDict()
+        self._loaded_at = None
+        # changes applied during a load, replayed on the new buckets
+        self._changes = None
+        # increased by `clear`, a load started before is dropped
+        self._generation = 0
+
+    def clear(self) -> None:
+        """Forget the buckets, they are loaded again on the next use."""
+        with self._lock:
+            self._buckets = {}
+            self._positions = {}
+            self._tables.clear()
+            self._loaded_at = None
+            self._generation += 1
+
+    def load(self, rows: Iterable[Tuple[int, int, int]] = None) -> None:
+        """Load the buckets.
+
+        :param rows: (id, category id, difficulty) of all questions, loaded
+            from the db if not provided (needs app context)
+        :rows type: Iterable[Tuple[int, int, int]]
+        """
+        with self._load_lock:
+            self._load(rows)
+
+    def _load(self, rows: Iterable[Tuple[int, int, int]] = None) -> None:
+        """Build new buckets and swap them in, the load lock has to be held.
+
+        The draws use the old buckets until the swap.
+        """
+        with self._lock:
+            generation = self._generation
+            self._changes = []
+
+        try:
+            if rows is None:
+                rows = db.session.query(Question.id, Question.category_id,
+                                        Question.difficulty).all()
+
+            buckets, positions = {}, {}
+            for question_id, category_id, difficulty in rows:
+                _put(buckets, positions, question_id, category_id,
+                     difficulty)
+
+            with self._lock:
+                if generation != self._generation:
+                    return
+
+                # committed after the rows were read, or notified late
+                for question_id, category_id, difficulty in self._changes:
+                    if category_id is None:
+                        _pop(buckets, positions, question_id)
+                    else:
+                        _put(buckets, positions, question_id, category_id,
+                             difficulty)
+
+                self._buckets, self._positions = buckets, positions
+                self._tables.clear()
+                self._loaded_at = time.monotonic()
+
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def _ensure_loaded(self) -> None:
+        """Load the buckets if not loaded, reload them if expired.
+
+        Called without the lock. Buckets never loaded are waited for, a
+        reload of expired buckets is left to the thread which started it.
+        """
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self._load()
+
+        elif time.monotonic() - self._loaded_at > self.ttl \
+                and self._load_lock.acquire(blocking=False):
+            try:
+                # another thread may have reloaded meanwhile
+                loaded_at = self._loaded_at
+                if loaded_at is None or \
+                        time.monotonic() - loaded_at > self.ttl:
+                    self._load()
+            finally:
+                self._load_lock.release()
+
+    def _add(self, question_id: int, category_id: int,
+             difficulty: int) -> None:
+        """Add a question, the lock has to be held."""
+        _put(self._buckets, self._positions, question_id, category_id,
+             difficulty)
+        self._tables.clear()
+
+    def _remove(self, question_id: int) -> None:
+        """Remove a question in O(1), the lock has to be held."""
+        if _pop(self._buckets, self._positions, question_id):
+            self._tables.clear()
+
+    def add(self, question_id: int, category_id: int,
+            difficulty: int) -> None:
+        """Add or move a question.
+
+        :param question_id: id of the question
+        :question_id type: int
+        :param category_id: id of the question category
+        :category_id type: int
+        :param difficulty: difficulty of the question
+        :difficulty type: int
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((question_id, category_id, difficulty))
+            if self._loaded_at is not None:
+                self._add(question_id, category_id, difficulty)
+
+    def remove(self, question_id: int) -> None:
+        """Remove a question.
+
+        :param question_id: id of the question
+        :question_id type: int
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((question_id, None, None))
+            self._remove(question_id)
+
+    def category_of(self, question_id: int) -> Optional[int]:
+        """Return category id of the question, None if not in the buckets."""
+        position = self._positions.get(question_id)
+        return position[0][0] if position is not None else None
+
+    def _table(self, weights: Optional[Tuple[Tuple[int, float], ...]],
+               difficulty: Tuple[int, int]):
+        """Return buckets, their weights and the alias table.
+
+        Within a category every question has the same chance, the category
+        as a whole has the chance given by its weight. With no weights every
+        question of all categories has the same chance.
+        """
+        cache_key = (weights, difficulty)
+        cached = self._tables.get(cache_key)
+        if cached is not None:
+            self._tables.move_to_end(cache_key)
+            return cached
+
+        low, high = difficulty
+        keys = [key for key in self._buckets if low <= key[1] <= high]
+
+        if weights is None:
+            bucket_weights = [len(self._buckets[key]) for key in keys]
+
+        else:
+            category_weights = dict(weights)
+            keys = [key for key in keys if category_weights.get(key[0])]
+            sizes = {}
+            for key in keys:
+                sizes[key[0]] = sizes.get(key[0], 0) + len(self._buckets[key])
+            bucket_weights = [category_weights[key[0]]
+                              * len(self._buckets[key]) / sizes[key[0]]
+                              for key in keys]
+
+        table = AliasTable(bucket_weights) if keys else None
+        self._tables[cache_key] = (keys, bucket_weights, table)
+        if len(self._tables) > self.max_tables:
+            self._tables.popitem(last=False)
+
+        return keys, bucket_weights, table
+
+    def draw(self, weights: Dict[int, float] = None,
+             difficulty: Tuple[int, int] = (MIN_DIFFICULTY, MAX_DIFFICULTY),
+             exclude: Iterable[int] = (),
+             rng: random.Random = random) -> Optional[int]:
+        """Return id of a random question, needs app context.
+
+        :param weights: category id: weight, all categories with the same
+            chance per question if not provided
+        :weights type: Dict[int, float]
+        :param difficulty: the lowest and the highest difficulty
+        :difficulty type: Tuple[int, int]
+        :param exclude: ids of questions not to draw
+        :exclude type: Iterable[int]
+        :return: id of the question, None if there is no question matching
+        :rtype: int
+        """
+        if weights is not None:
+            weights = tuple(sorted((c, w) for c, w in weights.items() if w))
+        exclude = set(exclude)
+
+        self._ensure_loaded()
+        with self._lock:
+            keys, bucket_weights, table = self._table(weights, difficulty)
+            if table is None:
+                return None
+
+            # excluded questions are rejected, when most of the questions
+            # are excluded, draw from what is left
+            for _ in range(2 * len(exclude) + 8):
+                bucket = self._buckets[keys[table.draw(rng)]]
+                question_id = bucket[rng.randrange(len(bucket))]
+                if question_id not in exclude:
+                    return question_id
+
+            left_keys, left_weights, left = [], [], {}
+            for key, weight in zip(keys, bucket_weights):
+                ids = [i for i in self._buckets[key] if i not in exclude]
+                if ids:
+                    left[key] = ids
+                    left_keys.append(key)
+                    left_weights.append(
+                        weight * len(ids) / len(self._buckets[key]))
+
+            if not left_keys:
+                return None
+
+            key = left_keys[AliasTable(left_weights).draw(rng)]
+            return rng.choice(left[key])
+
+
+question_buckets = QuestionBuckets()
+
+
+def init_quiz_sampler(app) -> None:
+    """Configure the buckets from the app config.
+
+    Configuration keys: `QUIZ_BUCKETS_TTL`, `QUIZ_ALIAS_TABLES`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    question_buckets.ttl = app.config["QUIZ_BUCKETS_TTL"]
+    question_buckets.max_tables = app.config["QUIZ_ALIAS_TABLES"]
+
+
+@on_change
+def _update_buckets(event_name: str, data: dict) -> None:
+    """Apply a committed question change to the buckets."""
+    if event_name in ('question.created', 'question.updated'):
+        question_buckets.add(data['id'], data['category'],
+                             data['difficulty'])
+
+    elif event_name == 'question.deleted':
+        question_buckets.remove(data['id'])
+
+
+def draw_question(weights: Dict[int, float] = None,
+                  difficulty: Tuple[int, int] = (MIN_DIFFICULTY,
+                                                 MAX_DIFFICULTY),
+                  exclude: Iterable[int] = (),
+                  store=None) -> Optional[dict]:
+    """Return a random formatted question, see `QuestionBuckets.draw`.
+
+    A question deleted by another process is dropped from the buckets and
+    the draw is repeated.
+    :param store: binary question store to draw from instead of the db,
+        see `question_store`
+    :store type: `QuestionStore`
+    """
+    exclude = set(exclude)
+
+    if store is not None:
+        question_id = store.buckets.draw(weights, difficulty, exclude)
+        return store.get(question_id) if question_id is not None else None
+
+    while True:
+        question_id = question_buckets.draw(weights, difficulty, exclude)
+        if question_id is None:
+            return None
+
+        question = Question.get_formatted(
+            question_id, question_buckets.category_of(question_id))
+        if question is not None:
+            return question
+
+        question_buckets.remove(question_id)
+
+
+def next_difficulty(previous: Optional[int] = None,
+                    correct: Optional[bool] = None) -> int:
+    """Return difficulty of the next question of an adaptive quiz.
+
+    One level up after a right answer, one level down after a wrong one,
+    within the difficulty range; `START_DIFFICULTY` for the first question.
+    :param previous: difficulty of the previous question
+    :previous type: int
+    :param correct: True if the previous answer was right
+    :correct type: bool
+    """
+    if previous is None:
+        return START_DIFFICULTY
+
+    step = 1 if correct else -1
+    return min(max(previous + step, MIN_DIFFICULTY), MAX_DIFFICULTY)
+
+
+def nearest_difficulties(target: int, harder_first: bool) -> List[int]:
+    """Return all difficulties, the target first, then the nearest ones.
+
+    :param target: the wanted difficulty
+    :target type: int
+    :param harder_first: of two equally near difficulties the harder first,
+        the player is moving up
+    :harder_first type: bool
+    """
+    return sorted(range(MIN_DIFFICULTY, MAX_DIFFICULTY + 1),
+                  key=lambda d: (abs(d - target),
+                                 d < target if harder_first else d > target))
+
+
+def draw_adaptive_question(weights: Dict[int, float] = None,
+                           previous: Optional[int] = None,
+                           correct: Optional[bool] = None,
+                           exclude: Iterable[int] = (),
+                           store=None) -> Optional[dict]:
+    """Return a random question of the next adaptive difficulty.
+
+    If there is no question of the difficulty left (the player has seen
+    them, or the category has none), the question is drawn from the nearest
+    difficulty. Every try is a draw from the buckets, the questions are not
+    scanned. See `draw_question` for the parameters.
+    :param previous: difficulty of the previous question, None for the
+        first question
+    :previous type: int
+    :param correct: True if the previous answer was right
+    :correct type: bool
+    """
+    target = next_difficulty(previous, correct)
+    exclude = set(exclude)
+
+    for difficulty in nearest_difficulties(target, bool(correct)):
+        question = draw_question(weights, (difficulty, difficulty), exclude,
+                                 store)
+        if question is not None:
+            return question
+
+    return None
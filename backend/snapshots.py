@@ -0,0 +1,374 @@
+"""Versioned static snapshot of the question bank.
+
+Categories and questions (all of them and per category) are written as json
+files, in the format of the matching api responses, next to their gzip and
+brotli (if the `brotli` package is installed) compressed copies:
+
+    <SNAPSHOT_DIR>/manifest.json
+    <SNAPSHOT_DIR>/<version>/categories.json
+    <SNAPSHOT_DIR>/<version>/questions.json
+    <SNAPSHOT_DIR>/<version>/categories/<id>/questions.json
+
+The version is a digest of the content, the files of a version never change
+and can be served by a web server or a cdn with a long cache lifetime.
+`manifest.json` points to the current version, it is returned by
+`GET /api/v1.0/snapshot`.
+
+A snapshot is built by `flask build-snapshot` and, if enabled, a few seconds
+after a change is committed (see `SnapshotBuilder`, it builds the binary
+question store of `question_store` as well).
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+import weakref
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from flask import current_app, has_app_context
+
+import question_store
+from compression import available_encodings, compress
+from logs import logger
+from models import Category, Question, db, on_change
+
+MANIFEST = "manifest.json"
+
+# extensions of the compressed copies of the files
+ENCODING_EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+
+def _dumps(data: dict) -> bytes:
+    """Return the data serialized as compact json."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+
+
+def render_files(categories: list, questions: list) -> Dict[str, bytes]:
+    """Return bodies of the snapshot files by their relative paths.
+
+    :param categories: categories formatted with `format()`
+    :categories type: a list of dicts
+    :param questions: questions formatted with `format()`
+    :questions type: a list of dicts
+    """
+    by_category = {}
+    for question in questions:
+        by_category.setdefault(question["category"], []).append(question)
+
+    files = {
+        "categories.json": _dumps({
+            "success": True,
+            "categories": {str(c["id"]): c["type"] for c in categories}
+        }),
+        "questions.json": _dumps({
+            "success": True,
+            "total_questions": len(questions),
+            "questions": questions,
+            "current_category": None,
+            "categories": {str(c["id"]): c["type"] for c in categories
+                           if c["id"] in by_category}
+        }),
+    }
+
+    for category in categories:
+        category_questions = by_category.get(category["id"])
+        # the api returns 404 for an empty category, there is no file
+        if not category_questions:
+            continue
+
+        files[f"categories/{category['id']}/questions.json"] = _dumps({
+            "success": True,
+            "total_questions": len(category_questions),
+            "questions": category_questions,
+            "current_category": category
+        })
+
+    return files
+
+
+def snapshot_version(files: Dict[str, bytes]) -> str:
+    """Return the version of the snapshot, a digest of its files."""
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        digest.update(path.encode())
+        digest.update(hashlib.sha256(files[path]).digest())
+
+    return digest.hexdigest()[:16]
+
+
+def write_files(directory: str, version: str, files: Dict[str, bytes],
+                gzip_level: int = 9, brotli_level: int = 11) -> None:
+    """Write files of the version with their compressed copies.
+
+    The files are written to a temporary directory renamed to the version at
+    the end, a version directory is always complete.
+    :param directory: directory of the snapshots
+    :directory type: str
+    :param version: version of the snapshot
+    :version type: str
+    :param files: bodies of the files by their relative paths
+    :files type: Dict[str, bytes]
+    :param gzip_level: gzip compression level, 1 - 9
+    :gzip_level type: int
+    :param brotli_level: brotli compression level, 0 - 11
+    :brotli_level type: int
+    """
+    target = os.path.join(directory, version)
+    if os.path.isdir(target):
+        return
+
+    temporary = os.path.join(directory, f".tmp-{uuid.uuid4().hex}")
+    try:
+        for path, body in files.items():
+            file_path = os.path.join(temporary, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            with open(file_path, "wb") as f:
+                f.write(body)
+
+            for encoding in available_encodings():
+                with open(file_path + ENCODING_EXTENSIONS[encoding],
+                          "wb") as f:
+                    f.write(compress(body, encoding, gzip_level,
+                                     brotli_level))
+
+        os.rename(temporary, target)
+
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def read_manifest(directory: str) -> Optional[dict]:
+    """Return the manifest of the current snapshot, None if not built."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(directory: str, manifest: dict) -> None:
+    """Replace the manifest, readers see the old or the new one whole."""
+    temporary = os.path.join(directory, f".{MANIFEST}.{uuid.uuid4().hex}")
+    with open(temporary, "w") as f:
+        json.dump(manifest, f, sort_keys=True)
+
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+
+def prune_snapshots(directory: str, current: str, keep: int) -> list:
+    """Delete old versions, keep the current one and the newest others.
+
+    Older versions are kept for clients with a manifest fetched before the
+    last build.
+    :param directory: directory of the snapshots
+    :directory type: str
+    :param current: version of the current snapshot, never deleted
+    :current type: str
+    :param keep: number of versions kept, including the current one
+    :keep type: int
+    :return: deleted versions
+    :rtype: list
+    """
+    versions = [entry for entry in os.scandir(directory)
+                if entry.is_dir() and not entry.name.startswith(".")
+                and entry.name != current]
+    versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+    deleted = []
+    for entry in versions[max(keep - 1, 0):]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        deleted.append(entry.name)
+
+    return deleted
+
+
+def build_snapshot(directory: str, keep: int = 3, gzip_level: int = 9,
+                   brotli_level: int = 11) -> dict:
+    """Write a snapshot of the current data and point the manifest to it.
+
+    Needs app context. Nothing is written if the data did not change since
+    the current snapshot. Builds of processes sharing the directory run one
+    at a time, so an older snapshot never replaces a newer one.
+    :param directory: directory of the snapshots
+    :directory type: str
+    :param keep: number of versions kept
+    :keep type: int
+    :param gzip_level: gzip compression level, 1 - 9
+    :gzip_level type: int
+    :param brotli_level: brotli compression level, 0 - 11
+    :brotli_level type: int
+    :return: manifest of the current snapshot
+    :rtype: dict
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        categories = [c.format() for c in
+                      Category.query.order_by(Category.id)]
+        questions = [q.format() for q in
+                     Question.query.order_by(Question.id)]
+
+        files = render_files(categories, questions)
+        version = snapshot_version(files)
+
+        manifest = read_manifest(directory)
+        if manifest is not None and manifest["version"] == version:
+            return manifest
+
+        write_files(directory, version, files, gzip_level, brotli_level)
+
+        manifest = {
+            "version": version,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "total_questions": len(questions),
+            "encodings": available_encodings(),
+            "categories": f"{version}/categories.json",
+            "questions": f"{version}/questions.json",
+            "category_questions": {
+                path.split("/")[1]: f"{version}/{path}"
+                for path in files if path.startswith("categories/")
+            }
+        }
+        write_manifest(directory, manifest)
+        prune_snapshots(directory, version, keep)
+
+    return manifest
+
+
+def manifest_urls(manifest: dict, base_url: str) -> dict:
+    """Return the manifest with file paths prefixed by the base url."""
+    base_url = base_url.rstrip("/")
+    manifest = dict(manifest)
+
+    for key in ("categories", "questions"):
+        manifest[key] = f"{base_url}/{manifest[key]}"
+    manifest["category_questions"] = {
+        category_id: f"{base_url}/{path}"
+        for category_id, path in manifest["category_questions"].items()
+    }
+
+    return manifest
+
+
+class SnapshotBuilder:
+    """Builds snapshots of the app data in a background thread.
+
+    A build starts `delay` seconds after it is requested, changes committed
+    meanwhile share the build. A change committed during a build requests
+    another one.
+    :param app: flask application
+    :app type: `Flask`
+    :param delay: seconds between a request and the build
+    :delay type: float
+    """
+
+    def __init__(self, app, delay: float = 5):
+        """Create a builder."""
+        self.app = app
+        self.delay = delay
+
+        self._timer = None
+        self._requested = False
+        self._lock = threading.Lock()
+
+    def request_build(self) -> None:
+        """Build a snapshot soon, unless a build is already waiting."""
+        with self._lock:
+            self._requested = True
+            if self._timer is None:
+                self._start_timer()
+
+    def _start_timer(self) -> None:
+        """Schedule a build, has to be called with the lock held."""
+        self._timer = threading.Timer(self.delay, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self) -> None:
+        """Build the snapshot, schedule another build if requested."""
+        with self._lock:
+            self._requested = False
+
+        try:
+            self.build()
+        except Exception as e:
+            logger.warning(f"Snapshot not built: {e}")
+
+        with self._lock:
+            self._timer = None
+            if self._requested:
+                self._start_timer()
+
+    def build(self) -> None:
+        """Build the enabled snapshots in a new app context.
+
+        The json snapshot if `SNAPSHOT_DIR` is set, the binary question store
+        (see `question_store`) if `QUESTION_STORE_DIR` is set.
+        """
+        config = self.app.config
+        with self.app.app_context():
+            try:
+                if config["SNAPSHOT_DIR"]:
+                    build_snapshot(config["SNAPSHOT_DIR"],
+                                   config["SNAPSHOT_KEEP"],
+                                   config["SNAPSHOT_GZIP_LEVEL"],
+                                   config["SNAPSHOT_BROTLI_LEVEL"])
+                if config["QUESTION_STORE_DIR"]:
+                    question_store.build_store(config["QUESTION_STORE_DIR"],
+                                               config["QUESTION_STORE_KEEP"])
+            finally:
+                db.session.remove()
+
+
+def _reset_builders() -> None:
+    """Forget the timers of the parent in a forked child."""
+    for builder in list(_builders):
+        builder._timer = None
+        builder._requested = False
+        builder._lock = threading.Lock()
+
+
+# builders of the apps created in the process
+_builders = weakref.WeakSet()
+
+os.register_at_fork(after_in_child=_reset_builders)
+
+
+def init_snapshots(app) -> None:
+    """Register the snapshot builder of the app.
+
+    Snapshots are built on changes only if `SNAPSHOT_DIR` or
+    `QUESTION_STORE_DIR` is set and `SNAPSHOT_AUTO_BUILD` is on.
+    Configuration keys: `SNAPSHOT_DIR`, `QUESTION_STORE_DIR`,
+    `SNAPSHOT_AUTO_BUILD`, `SNAPSHOT_BUILD_DELAY`, `SNAPSHOT_KEEP`,
+    `SNAPSHOT_GZIP_LEVEL`, `SNAPSHOT_BROTLI_LEVEL`, `QUESTION_STORE_KEEP`.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    builder = SnapshotBuilder(app, app.config["SNAPSHOT_BUILD_DELAY"])
+    app.extensions["snapshots"] = builder
+    _builders.add(builder)
+
+
+@on_change
+def _request_build(event_name: str, data: dict) -> None:
+    """Request a snapshot build of the app a change was committed in."""
+    if not has_app_context():
+        return
+
+    config = current_app.config
+    builder = current_app.extensions.get("snapshots")
+    if builder is None or not config.get("SNAPSHOT_AUTO_BUILD") \
+            or not (config.get("SNAPSHOT_DIR")
+                    or config.get("QUESTION_STORE_DIR")):
+        return
+
+    builder.request_build()
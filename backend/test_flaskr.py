@@ -1,13 +1,22 @@
 """Unittests, integration test of API."""
 
+import gzip
 import json
+import logging
 import os
+import queue
 import random
 import re
+import select
 from string import ascii_letters
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
 import time
 import unittest
+from datetime import datetime, timedelta, timezone
 from unicodedata import category
 from urllib import response
 
@@ -16,10 +25,30 @@ import sqlalchemy
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import exc
 
+import admission
+import attempts
+import batch
+import compression
+import dedupe
+import events
+import group_commit
 import init_data
-from config import Enviroment, PostgresDbParams
+import logs
+import minhash
+import models
+import partitioning
+import question_store
+import quiz_sampler
+import snapshots
+from cache import LruCache
+from category_registry import CategoryRegistry
+from benchmarks.import_time import HEAVY_MODULES, measure_import
+from config import Config, Enviroment, PostgresDbParams, TestConfig
+from flask import Flask
 from flaskr import create_app
-from models import Category, Question, setup_db
+from models import (Category, Game, LeaderboardEntry, Question,
+                    QuestionChange, QuestionSignature, QuizAttempt,
+                    category_registry, db, question_cache)
 
 
 def setup_db_server_conn():
@@ -38,14 +67,23 @@ def setup_db_server_conn():
 
 
 def create_database():
-    """Create test database."""
+    """Create test database, drop the one left by a failed run."""
     conn = setup_db_server_conn()
     params = PostgresDbParams(Enviroment.TEST)
 
     cursor = conn.cursor()
 
     sql = f"CREATE database {params.database};"
-    cursor.execute(sql)
+    try:
+        cursor.execute(sql)
+
+    except psycopg2.ProgrammingError as e:
+        if e.pgcode != "42P04":  # db exists
+            raise
+        conn.close()
+        kill_active_connections()
+        drop_database()
+        return create_database()
 
     print("Database created.......")
     conn.close()
@@ -82,75 +120,150 @@ def drop_database():
     conn.close()
 
 
-class TriviaTestCase(unittest.TestCase):
-    """This class represents the trivia test case."""
+def is_postgres_run():
+    """Return True if tests run against postgres, not SQLite."""
+    return TestConfig.TEST_DB == "postgres"
 
-    @classmethod
-    def setUpClass(cls) -> None:
-        """Define test variables and initialize app."""
-        app = create_app()
-        app.config.from_object('config.TestConfig')
-        client = app.test_client()
-        db = setup_db(app)
 
-        try:
-            create_database()
-            # binds the app to the current context
-            with app.app_context():
-                db.init_app(app)
-                db.create_all()
+def enable_sqlite_savepoints(engine):
+    """Let pysqlite use savepoints.
+
+    pysqlite starts transactions on its own and breaks `SAVEPOINT`,
+    transactions are started by SQLAlchemy instead.
+    """
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @sqlalchemy.event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+
+# app and database shared by all tests of the process, created once
+test_app = None
+
+
+def setUpModule():
+    """Create the app, the database schema and load the sample data.
 
-            init_data.run(app)
+    Runs once per process, with pytest-xdist every worker process has its own
+    database (in-memory SQLite or postgres database named after the worker).
+    """
+    global test_app
 
-        except sqlalchemy.exc.OperationalError as e:
-            print(f"Connection to the db failed. "
-                  f"Details: {e.code}, {e.orig}")
+    if is_postgres_run():
+        create_database()
+
+    test_app = create_app('config.TestConfig')
+
+    with test_app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            db.engine.dispose()
+            enable_sqlite_savepoints(db.engine)
+
+        db.create_all()
+        init_data.insert_categories(init_data.get_categories())
+        init_data.insert_questions(init_data.get_questions())
+        db.session.remove()
+
+
+def tearDownModule():
+    """Clean resources."""
+    with test_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+    if is_postgres_run():
+        try:
+            drop_database()
 
         except psycopg2.OperationalError as e:
-            print(f"Connection to the db failed. "
-                  f"Details: {e.pgcode}, {e.pgerror}")
+            if e.pgcode != "55006":  # ObjectInUse
+                raise
+            kill_active_connections()
+            drop_database()
+
+
+class DbTestCase(unittest.TestCase):
+    """Test case running every test in a transaction rolled back after it.
 
-        except psycopg2.ProgrammingError as e:
-            if e.pgcode == "42P04":  # db exists
-                kill_active_connections()
-                drop_database()
-                cls.setUpClass()
+    The session is bound to a connection with an open transaction, the
+    commits of the app release savepoints only, so tests do not see each
+    other changes and the sample data are loaded only once.
+    """
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.app.config.from_object('config.TestConfig')
+        """Push the app context and open the test transaction."""
+        self.app = test_app
         self.client = self.app.test_client()
-        self.db = setup_db(self.app)
+        self.db = db
 
-        try:
-            # binds the app to the current context
-            with self.app.app_context():
-                self.db.init_app(self.app)
-                self.db.create_all()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
 
-        except sqlalchemy.exc.OperationalError as e:
-            print(f"Connection to the db failed. "
-                  f"Details: {e.code}, {e.orig}")
+        # in-memory state built from the db would outlive the rollback
+        quiz_sampler.question_buckets.clear()
+        dedupe.duplicate_index.clear()
+        question_cache.clear()
+        category_registry.invalidate()
 
-        except psycopg2.OperationalError as e:
-            print(f"Connection to the db failed. "
-                  f"Details: {e.pgcode}, {e.pgerror}")
+        self.connection = self.db.engine.connect()
+        self.transaction = self.connection.begin()
+
+        self.app_session = self.db.session
+        self.db.session = self.db.create_scoped_session(
+            options={"bind": self.connection, "binds": {}})
+        self.nested = self.connection.begin_nested()
+
+        @sqlalchemy.event.listens_for(self.db.session,
+                                      "after_transaction_end")
+        def restart_savepoint(session, transaction):
+            if not self.nested.is_active:
+                self.nested = self.connection.begin_nested()
 
     def tearDown(self):
-        """Execute after reach test."""
-        super(TriviaTestCase, self).tearDown()
+        """Roll back the changes made by the test."""
+        self.db.session.remove()
+        self.db.session = self.app_session
+
+        self.transaction.rollback()
+        self.connection.close()
+        self.ctx.pop()
+
+    def captured_statements(self, call):
+        """Return statements sent to the db by the call."""
+        statements = []
 
-    @classmethod
-    def tearDownClass(cls):
-        """Clean resources."""
+        def capture(conn, cursor, statement, parameters, context, many):
+            statements.append((statement, parameters))
+
+        sqlalchemy.event.listen(self.connection, "before_cursor_execute",
+                                capture)
         try:
-            drop_database()
+            call()
+        finally:
+            sqlalchemy.event.remove(self.connection, "before_cursor_execute",
+                                    capture)
 
-        except psycopg2.OperationalError as e:
-            if e.pgcode == "55006":  # ObjectInUse
-                kill_active_connections()
-                cls.tearDownClass()
+        return statements
+
+
+class TriviaTestCase(DbTestCase):
+    """This class represents the trivia test case."""
+
+    def test_changes_rolled_back_after_test(self):
+        """Test changes made by a test are not seen by the next one."""
+        count = Question.get_count()
+        category = random.choice(Category.get_all())
+
+        Question("Test question", "Test answer", category.id, 1).insert()
+        self.assertEqual(Question.get_count(), count + 1)
+
+        self.tearDown()
+        self.setUp()
+
+        self.assertEqual(Question.get_count(), count)
 
     # test headers added to all requests
     def test_is_content_json_header(self):
@@ -217,6 +330,56 @@ class TriviaTestCase(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(not_empty, True)
 
+    def test_get_categories_with_emptyIncluded_false_skips_empty(self):
+        """Test category without questions is returned only if included."""
+        category = Category("Empty category").insert()
+
+        all_res = self.client.get("/api/v1.0/categories")
+        non_empty_res = self.client.get(
+            "/api/v1.0/categories?emptyIncluded=false")
+
+        self.assertIn(str(category.id), all_res.json["categories"])
+        self.assertNotIn(str(category.id), non_empty_res.json["categories"])
+
+    # question counts of categories
+    def test_question_count_kept_by_insert_and_delete(self):
+        """Test counts follow questions added, moved and deleted."""
+        first, second = Category("First").insert(), Category("Second").insert()
+
+        question = Question("Test question", "Test answer", first.id, 1)
+        question.insert()
+        self.assertEqual(Category.get_by_id(first.id).question_count, 1)
+
+        question.category_id = second.id
+        question.update()
+        self.assertEqual(Category.get_by_id(first.id).question_count, 0)
+        self.assertEqual(Category.get_by_id(second.id).question_count, 1)
+
+        question.delete()
+        self.assertEqual(Category.get_by_id(second.id).question_count, 0)
+
+    def test_repair_question_counts(self):
+        """Test counts are recomputed from the questions table."""
+        self.db.session.execute(
+            Category.__table__.update().values(question_count=0))
+
+        Category.repair_question_counts()
+
+        for category in Category.get_all():
+            self.assertEqual(category.question_count,
+                             len(Question.get_by_category_id(category.id)))
+
+    def test_quizzes_empty_category_not_found(self):
+        """Test quiz from a category without questions returns 404."""
+        category = Category("Empty category").insert()
+
+        response = self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": category.format()
+        })
+
+        self.assertEqual(response.status_code, 404)
+
     # GET /api/v1.0/questions endpoint
     def test_get_questions_default_page_success(self):
         """Test success.
@@ -502,6 +665,2395 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(response.status_code, 404)
 
+    def test_quizzes_never_returns_previous_questions(self):
+        """Test all but one question excluded, the one left is returned."""
+        category = random.choice(
+            [c for c in Category.get_all() if c.question_count > 1])
+        questions = Question.get_by_category_id(category.id)
+        previous_questions = [q.id for q in questions[1:]]
+
+        response = self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": previous_questions,
+            "quiz_category": category.format()
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["question"]["id"], questions[0].id)
+
+    def test_quizzes_difficulty_range(self):
+        """Test returned questions are within the difficulty range."""
+        for _ in range(20):
+            response = self.client.post("/api/v1.0/quizzes", json={
+                "previous_questions": [],
+                "quiz_category": {"id": 0, "type": "click"},
+                "difficulty": {"min": 2, "max": 3}
+            })
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(response.json["question"]["difficulty"], [2, 3])
+
+    def test_quizzes_weighted_categories(self):
+        """Test questions are drawn only from the weighted categories."""
+        categories = [c.id for c in Category.get_all() if c.question_count]
+        weighted = categories[:2]
+
+        for _ in range(20):
+            response = self.client.post("/api/v1.0/quizzes", json={
+                "previous_questions": [],
+                "categories": {str(c): 0.5 for c in weighted}
+            })
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(response.json["question"]["category"], weighted)
+
+    def test_quizzes_error_wrong_difficulty(self):
+        """Test error: difficulty out of range. Status 400."""
+        response = self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": {"id": 0, "type": "click"},
+            "difficulty": 7
+        })
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_quizzes_new_question_drawn_after_insert(self):
+        """Test buckets follow questions created after they are loaded."""
+        category = Category("New category").insert()
+        self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": {"id": 0, "type": "click"}
+        })
+
+        question = Question("Test question", "Test answer", category.id, 1)
+        question.insert()
+        response = self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": category.format()
+        })
+
+        self.assertEqual(response.json["question"]["id"], question.id)
+
+    def test_quizzes_adaptive_difficulty_follows_answers(self):
+        """Test next question is harder after a right answer, else easier."""
+        first = self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": {"id": 0, "type": "click"},
+            "adaptive": True
+        }).json["question"]
+        self.assertEqual(first["difficulty"], quiz_sampler.START_DIFFICULTY)
+
+        for correct, expected in [(True, 4), (False, 2)]:
+            response = self.client.post("/api/v1.0/quizzes", json={
+                "previous_questions": [first["id"]],
+                "quiz_category": {"id": 0, "type": "click"},
+                "adaptive": {"difficulty": 3, "correct": correct}
+            })
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json["question"]["difficulty"],
+                             expected)
+
+    def test_quizzes_adaptive_nearest_difficulty_left(self):
+        """Test the nearest difficulty is drawn when none is left."""
+        category = Category("Adaptive category").insert()
+        easy = Question("Easy", "Answer", category.id, 1).insert().id
+        hard = Question("Hard", "Answer", category.id, 5).insert().id
+        Question.get_by_id(hard).delete()
+
+        response = self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": category.format(),
+            "adaptive": {"difficulty": 4, "correct": True}
+        })
+        self.assertEqual(response.json["question"]["id"], easy)
+
+        response = self.client.post("/api/v1.0/quizzes", json={
+            "previous_questions": [easy],
+            "quiz_category": category.format(),
+            "adaptive": {"difficulty": 1, "correct": True}
+        })
+        self.assertEqual(response.status_code, 404)
+
+    def test_quizzes_adaptive_error_wrong_answer(self):
+        """Test error: wrong previous answer or fixed difficulty. 400."""
+        for adaptive, difficulty in [({"difficulty": 3}, None),
+                                     ({"difficulty": 6, "correct": True},
+                                      None),
+                                     ("yes", None), (True, 2)]:
+            response = self.client.post("/api/v1.0/quizzes", json={
+                "previous_questions": [],
+                "quiz_category": {"id": 0, "type": "click"},
+                "adaptive": adaptive,
+                "difficulty": difficulty
+            })
+
+            self.assertEqual(response.status_code, 400, adaptive)
+
+    # POST /api/v1.0/quizzes/batch
+    def test_quiz_batch_returns_distinct_questions(self):
+        """Test success.
+
+        - Status code 200.
+        - Requested number of distinct questions from the category.
+        - Previous questions excluded.
+        """
+        category = max(Category.get_all(), key=lambda c: c.question_count)
+        excluded = Question.get_by_category_id(category.id)[0].id
+
+        response = self.client.post("/api/v1.0/quizzes/batch", json={
+            "count": category.question_count - 1,
+            "quiz_category": category.format(),
+            "previous_questions": [excluded]
+        })
+
+        questions = response.json["questions"]
+        ids = [q["id"] for q in questions]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ids), category.question_count - 1)
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertNotIn(excluded, ids)
+        self.assertTrue(all(q["category"] == category.id for q in questions))
+
+    def test_quiz_batch_all_categories_fewer_than_count(self):
+        """Test all questions returned if fewer than requested exist."""
+        response = self.client.post("/api/v1.0/quizzes/batch", json={
+            "count": 50,
+            "quiz_category": {"id": 0, "type": "click"}
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["total_questions"],
+                         min(50, Question.get_count()))
+
+    def test_quiz_batch_error_count_too_big(self):
+        """Test error: count over the limit. Status 400."""
+        response = self.client.post("/api/v1.0/quizzes/batch", json={
+            "count": self.app.config["QUIZ_BATCH_MAX"] + 1,
+            "quiz_category": {"id": 0, "type": "click"}
+        })
+
+        self.assertEqual(response.status_code, 400)
+
+
+class QuizSamplerTestCase(unittest.TestCase):
+    """Tests of the alias table and question buckets."""
+
+    def test_alias_table_follows_weights(self):
+        """Test indexes are drawn in proportion to the weights."""
+        table = quiz_sampler.AliasTable([1, 3, 0, 4])
+        rng = random.Random(7)
+
+        counts = [0] * 4
+        for _ in range(80000):
+            counts[table.draw(rng)] += 1
+
+        self.assertEqual(counts[2], 0)
+        for count, expected in zip(counts, [10000, 30000, 0, 40000]):
+            self.assertAlmostEqual(count, expected, delta=1000)
+
+    def test_alias_table_error_no_positive_weight(self):
+        """Test table can not be built from zero weights."""
+        with self.assertRaises(ValueError):
+            quiz_sampler.AliasTable([0, 0])
+
+    def test_buckets_weight_categories_not_questions(self):
+        """Test category chance does not depend on its size."""
+        buckets = quiz_sampler.QuestionBuckets(ttl=float("inf"))
+        buckets.load([(i, 1 if i <= 90 else 2, i % 5 + 1)
+                      for i in range(1, 101)])
+        rng = random.Random(3)
+
+        drawn = [buckets.draw({1: 0.5, 2: 0.5}, rng=rng)
+                 for _ in range(10000)]
+
+        from_second = len([q for q in drawn if q > 90])
+        self.assertAlmostEqual(from_second, 5000, delta=300)
+
+    def test_buckets_draw_left_questions_when_most_excluded(self):
+        """Test draw finds the only question not excluded."""
+        buckets = quiz_sampler.QuestionBuckets(ttl=float("inf"))
+        buckets.load([(i, 1, 1) for i in range(1, 1001)])
+
+        drawn = buckets.draw(exclude=range(1, 1000))
+
+        self.assertEqual(drawn, 1000)
+        self.assertIsNone(buckets.draw(exclude=range(1, 1001)))
+
+    def test_buckets_remove_keeps_positions(self):
+        """Test removed question is never drawn, others still are."""
+        buckets = quiz_sampler.QuestionBuckets(ttl=float("inf"))
+        buckets.load([(i, 1, 1) for i in range(1, 4)])
+
+        buckets.remove(1)
+        drawn = {buckets.draw() for _ in range(200)}
+
+        self.assertEqual(drawn, {2, 3})
+
+    def test_draw_not_blocked_by_reload(self):
+        """Test expired buckets are drawn from while another thread loads."""
+        buckets = quiz_sampler.QuestionBuckets(ttl=float("inf"))
+        buckets.load([(1, 1, 1)])
+        buckets.ttl = 0
+
+        # a reload in progress in another thread
+        with buckets._load_lock:
+            drawn = buckets.draw()
+
+        self.assertEqual(drawn, 1)
+
+    def test_reload_keeps_changes_made_meanwhile(self):
+        """Test changes applied during a reload are in the new buckets."""
+        buckets = quiz_sampler.QuestionBuckets(ttl=float("inf"))
+        buckets.load([(1, 1, 1), (2, 1, 1)])
+
+        def rows():
+            # read before the changes were committed
+            yield from [(1, 1, 1), (2, 1, 1)]
+            buckets.add(3, 1, 1)
+            buckets.remove(1)
+
+        buckets.load(rows())
+        drawn = {buckets.draw() for _ in range(200)}
+
+        self.assertEqual(drawn, {2, 3})
+
+    def test_next_difficulty_steps_within_range(self):
+        """Test difficulty moves by one level and stays in the range."""
+        self.assertEqual(quiz_sampler.next_difficulty(), 3)
+        self.assertEqual(quiz_sampler.next_difficulty(3, True), 4)
+        self.assertEqual(quiz_sampler.next_difficulty(3, False), 2)
+        self.assertEqual(quiz_sampler.next_difficulty(5, True), 5)
+        self.assertEqual(quiz_sampler.next_difficulty(1, False), 1)
+
+    def test_nearest_difficulties_prefer_direction(self):
+        """Test equally near difficulties are ordered by the answer."""
+        self.assertEqual(quiz_sampler.nearest_difficulties(3, True),
+                         [3, 4, 2, 5, 1])
+        self.assertEqual(quiz_sampler.nearest_difficulties(3, False),
+                         [3, 2, 4, 1, 5])
+        self.assertEqual(quiz_sampler.nearest_difficulties(5, False),
+                         [5, 4, 3, 2, 1])
+
+
+class QueryPlanTestCase(DbTestCase):
+    """Tests of the model queries plans at a benchmark scale.
+
+    Every query sent by a model method is explained, a full scan of
+    the `questions` table fails the test. The queries reading all the
+    questions by design may read the table once, without sorting it.
+    """
+
+    categories = 200
+    questions = 20000
+
+    def setUp(self):
+        """Fill the database with generated data."""
+        super().setUp()
+
+        first_id = max(c.id for c in Category.get_all()) + 1
+        category_ids = range(first_id, first_id + self.categories)
+        self.db.session.execute(
+            Category.__table__.insert(),
+            [{"id": i, "type": f"Category {i}"} for i in category_ids])
+        self.db.session.execute(
+            Question.__table__.insert(),
+            [{"question_text": f"Question {i}", "answer": f"Answer {i}",
+              "category_id": category_ids[i % self.categories],
+              "difficulty": i % 5 + 1} for i in range(self.questions)])
+        self.db.session.execute(sqlalchemy.text("ANALYZE"))
+
+        self.category_id = category_ids[0]
+        self.question_id = self.db.session.query(
+            sqlalchemy.func.max(Question.id)).scalar()
+        self.db.session.expunge_all()
+
+    def query_plan(self, statement, parameters):
+        """Return lines of the query plan, empty for savepoints."""
+        if not statement.lstrip().upper().startswith(
+                ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+            return []
+
+        if self.connection.dialect.name == "sqlite":
+            plan = self.connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            return [row[-1] for row in plan]
+
+        plan = self.connection.exec_driver_sql(
+            f"EXPLAIN {statement}", parameters).fetchall()
+        return [row[0] for row in plan]
+
+    def full_scans(self, statement, parameters):
+        """Return lines of the query plan scanning the whole table."""
+        plan = self.query_plan(statement, parameters)
+        if self.connection.dialect.name == "sqlite":
+            return [line for line in plan
+                    if line.startswith("SCAN questions")]
+
+        return [line for line in plan if "Seq Scan on questions" in line]
+
+    def table_reads(self, statement, parameters):
+        """Return lines of the query plan reading or sorting the table."""
+        plan = self.query_plan(statement, parameters)
+        if self.connection.dialect.name == "sqlite":
+            pattern = r"^(SCAN|SEARCH) questions\b|TEMP B-TREE"
+        else:
+            pattern = r"Scan (using \w+ )?on questions\b|Sort"
+        return [line for line in plan if re.search(pattern, line)]
+
+    def assertNoFullScan(self, call):
+        """Check none of the statements sent by the call scans the table."""
+        statements = self.captured_statements(call)
+        self.assertTrue(statements)
+
+        for statement, parameters in statements:
+            self.assertEqual(self.full_scans(statement, parameters), [],
+                             statement)
+
+    def assertSingleRead(self, call):
+        """Check the call reads the table once, in a single statement."""
+        statements = [(statement, parameters) for statement, parameters
+                      in self.captured_statements(call)
+                      if self.query_plan(statement, parameters)]
+        self.assertEqual(len(statements), 1)
+
+        statement, parameters = statements[0]
+        self.assertEqual(len(self.table_reads(statement, parameters)), 1,
+                         self.query_plan(statement, parameters))
+
+    def test_get_by_id_uses_index(self):
+        """Test question lookup by id."""
+        self.assertNoFullScan(lambda: Question.get_by_id(self.question_id))
+
+    def test_get_many_uses_index(self):
+        """Test questions lookup by ids."""
+        self.assertNoFullScan(lambda: Question.get_many(
+            [self.question_id, self.question_id - 1]))
+
+    def test_get_by_category_id_uses_index(self):
+        """Test questions lookup by category."""
+        self.assertNoFullScan(
+            lambda: Question.get_by_category_id(self.category_id))
+
+    def test_category_and_difficulty_lookup_uses_index(self):
+        """Test questions lookup by category and difficulty."""
+        self.assertNoFullScan(lambda: Question.query.filter(
+            Question.category_id == self.category_id,
+            Question.difficulty == 3).all())
+
+    def test_get_formatted_uses_index(self):
+        """Test question lookup of the quiz draw, with and without category."""
+        self.assertNoFullScan(lambda: Question.get_formatted(
+            self.question_id, self.category_id))
+        question_cache.clear()
+        self.assertNoFullScan(
+            lambda: Question.get_formatted(self.question_id))
+
+    def test_bucket_load_reads_table_once(self):
+        """Test the quiz buckets are loaded by a single read."""
+        self.assertSingleRead(quiz_sampler.QuestionBuckets().load)
+
+    def test_question_count_reads_table_once(self):
+        """Test all questions are counted by a single read."""
+        self.assertSingleRead(Question.get_count)
+
+    def test_category_emptiness_does_not_read_questions(self):
+        """Test non empty categories are found by their kept counts."""
+        statements = self.captured_statements(
+            lambda: Category.all_as_dict(non_empty_only=True))
+        self.assertTrue(statements)
+
+        for statement, parameters in statements:
+            plan = self.query_plan(statement, parameters)
+            self.assertFalse([line for line in plan
+                              if re.search(r"\bquestions\b", line)], plan)
+
+    def test_repair_question_counts_uses_index(self):
+        """Test questions are counted by the category index."""
+        self.assertNoFullScan(Category.repair_question_counts)
+
+
+class LoggingTestCase(unittest.TestCase):
+    """Tests of the structured, queue based logging."""
+
+    def make_record(self, status=None, exc_info=None):
+        """Create a record like the one emitted for a request."""
+        record = logging.makeLogRecord({
+            "name": logs.LOGGER_NAME,
+            "levelno": logging.WARNING,
+            "levelname": "WARNING",
+            "msg": "request %s",
+            "args": ("handled",),
+            "exc_info": exc_info,
+        })
+        if status is not None:
+            record.status = status
+            record.route = "/api/v1.0/questions"
+            record.request_id = "abc"
+        return record
+
+    def test_json_formatter_includes_request_fields(self):
+        """Test formatted record is a json with the request details."""
+        record = self.make_record(status=404)
+
+        entry = json.loads(logs.JsonFormatter().format(record))
+
+        self.assertEqual(entry["message"], "request handled")
+        self.assertEqual(entry["status"], 404)
+        self.assertEqual(entry["route"], "/api/v1.0/questions")
+        self.assertEqual(entry["request_id"], "abc")
+
+    def test_sampler_drops_client_errors_only(self):
+        """Test 4xx records are sampled, other records always pass."""
+        sampler = logs.ClientErrorSampler(rate=0.0)
+
+        self.assertFalse(sampler.filter(self.make_record(status=404)))
+        self.assertTrue(sampler.filter(self.make_record(status=500)))
+        self.assertTrue(sampler.filter(self.make_record()))
+
+    def test_queue_handler_does_not_block_on_full_queue(self):
+        """Test records are dropped when the queue is full."""
+        handler = logs.DroppingQueueHandler(queue.Queue(1))
+
+        handler.emit(self.make_record())
+        handler.emit(self.make_record())
+
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.dropped, 1)
+
+    def test_queued_record_keeps_traceback_apart(self):
+        """Test traceback is moved to `exc_text`, message stays clean."""
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = self.make_record(exc_info=sys.exc_info())
+
+        prepared = logs.DroppingQueueHandler(queue.Queue()).prepare(record)
+        entry = json.loads(logs.JsonFormatter().format(prepared))
+
+        self.assertEqual(entry["message"], "request handled")
+        self.assertIn("ValueError: boom", entry["exc_info"])
+
+    def test_forked_worker_logs_through_parent(self):
+        """Test only the process creating the listener writes the file."""
+        path = os.path.join(tempfile.mkdtemp(), "trivia.log")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        listener = logs._get_listener(path, "midnight", 1, 100)
+        self.addCleanup(logs._listeners.pop, path)
+        self.addCleanup(listener.handlers[0].close)
+
+        pid = os.fork()
+        if pid == 0:
+            forwarding = all(isinstance(handler, logs.ForwardingHandler)
+                             for handler in listener.handlers)
+            listener.queue.put(self.make_record(status=500))
+            listener.stop()
+            os._exit(0 if forwarding else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIsInstance(listener.handlers[0],
+                              logs.TimedRotatingFileHandler)
+
+        lines = []
+        deadline = time.monotonic() + 5
+        while not lines and time.monotonic() < deadline:
+            time.sleep(0.01)
+            if os.path.exists(path):
+                with open(path, encoding="utf8") as log_file:
+                    lines = [line for line in log_file if line.endswith("\n")]
+        entries = [json.loads(line) for line in lines]
+
+        self.assertEqual([entry["status"] for entry in entries], [500])
+        self.assertEqual(entries[0]["message"], "request handled")
+
+
+class ImportTimeTestCase(unittest.TestCase):
+    """Tests of the app import time.
+
+    The budget in milliseconds can be changed with the environment variable
+    `TRIVIA_IMPORT_BUDGET_MS`.
+    """
+
+    budget_ms = int(os.environ.get("TRIVIA_IMPORT_BUDGET_MS", 1000))
+
+    def test_app_import_within_budget(self):
+        """Test importing the app takes less than the budget."""
+        total, _ = measure_import("flaskr")
+
+        self.assertLess(total / 1000, self.budget_ms)
+
+    def test_app_creation_within_budget(self):
+        """Test importing and creating the app takes less than the budget."""
+        total, _ = measure_import("flaskr", "create_app")
+
+        self.assertLess(total / 1000, self.budget_ms)
+
+    def test_heavy_modules_not_imported(self):
+        """Test the serving path and the data tooling skip heavy modules."""
+        for module, function in (("flaskr", None), ("flaskr", "create_app"),
+                                 ("init_data", None)):
+            _, modules = measure_import(module, function)
+            heavy = [m for m in modules if m.split(".")[0] in HEAVY_MODULES]
+
+            self.assertEqual(heavy, [], (module, function))
+
+    def test_migrate_registered_for_command_line(self):
+        """Test `flask db` commands find Flask-Migrate, the app does not."""
+        self.assertNotIn("migrate", create_app(TestConfig).extensions)
+
+        env = dict(os.environ, FLASK_APP="flaskr:create_app")
+        result = subprocess.run(
+            [sys.executable, "-m", "flask", "db", "heads",
+             "--directory", "../migrations"],
+            env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+class AdmissionTestCase(unittest.TestCase):
+    """Tests of the admission control."""
+
+    def test_limiter_rejects_when_queue_deadline_passes(self):
+        """Test request is shed if no slot is freed in time."""
+        limiter = admission.ConcurrencyLimiter(1, 1, queue_timeout=0.01)
+
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(limiter.queued, 0)
+
+    def test_limiter_hands_slot_to_higher_priority(self):
+        """Test released slot goes to the most important waiter."""
+        limiter = admission.ConcurrencyLimiter(1, 2, queue_timeout=5)
+        limiter.acquire()
+        admitted = []
+
+        def wait(priority):
+            if limiter.acquire(priority):
+                admitted.append(priority)
+
+        low = threading.Thread(target=wait, args=(admission.LOW_PRIORITY,))
+        low.start()
+        while limiter.queued < 1:
+            time.sleep(0.001)
+        high = threading.Thread(target=wait, args=(admission.HIGH_PRIORITY,))
+        high.start()
+        while limiter.queued < 2:
+            time.sleep(0.001)
+
+        limiter.release()
+        high.join()
+        limiter.release()
+        low.join()
+
+        self.assertEqual(admitted,
+                         [admission.HIGH_PRIORITY, admission.LOW_PRIORITY])
+
+    def test_limiter_sheds_lower_priority_when_queue_full(self):
+        """Test full queue drops the low priority waiter for a read."""
+        limiter = admission.ConcurrencyLimiter(1, 1, queue_timeout=5)
+        limiter.acquire()
+        results = {}
+
+        def wait(priority):
+            results[priority] = limiter.acquire(priority)
+
+        low = threading.Thread(target=wait, args=(admission.LOW_PRIORITY,))
+        low.start()
+        while limiter.queued < 1:
+            time.sleep(0.001)
+        high = threading.Thread(target=wait, args=(admission.HIGH_PRIORITY,))
+        high.start()
+        low.join()
+        limiter.release()
+        high.join()
+
+        self.assertFalse(results[admission.LOW_PRIORITY])
+        self.assertTrue(results[admission.HIGH_PRIORITY])
+
+    def test_token_bucket_limits_client(self):
+        """Test bucket allows the burst, then returns time to wait."""
+        backend = admission.InMemoryRateLimitBackend()
+
+        allowed = [backend.take("client", rate=1, burst=2)[0]
+                   for _ in range(3)]
+        retry_after = backend.take("client", rate=1, burst=2)[1]
+
+        self.assertEqual(allowed, [True, True, False])
+        self.assertGreater(retry_after, 0)
+        self.assertTrue(backend.take("other", rate=1, burst=2)[0])
+
+    def test_rate_limited_request_returns_429_with_retry_after(self):
+        """Test rejected request gets 429 and `Retry-After` header."""
+        app = Flask(__name__)
+        app.config.from_object(Config)
+        app.config.update(RATE_LIMIT_PER_SECOND=0.1, RATE_LIMIT_BURST=1)
+        admission.init_admission(app)
+
+        @app.route("/ping")
+        def ping():
+            return "pong"
+
+        client = app.test_client()
+        first = client.get("/ping")
+        second = client.get("/ping")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second.headers["Retry-After"], "10")
+        self.assertEqual(app.extensions["admission"].active, 0)
+
+
+class CompressionTestCase(DbTestCase):
+    """Tests of the response compression."""
+
+    def setUp(self):
+        """Start every test with an empty compressed cache."""
+        super().setUp()
+        self.cache = self.app.extensions["compression"]
+        self.cache.clear()
+
+    def test_gzip_response_when_accepted(self):
+        """Test big json body is gzipped for a client accepting gzip."""
+        plain = self.client.get('/api/v1.0/questions')
+        response = self.client.get('/api/v1.0/questions',
+                                   headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(int(response.headers["Content-Length"]),
+                         len(response.data))
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+
+    @unittest.skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli_preferred_when_accepted(self):
+        """Test brotli is used when the client accepts both."""
+        response = self.client.get(
+            '/api/v1.0/questions',
+            headers={"Accept-Encoding": "gzip, deflate, br"})
+
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        data = json.loads(compression.brotli.decompress(response.data))
+        self.assertTrue(data["success"])
+
+    def test_uncompressed_without_accept_encoding(self):
+        """Test body is not compressed for a client not asking for it."""
+        response = self.client.get('/api/v1.0/questions',
+                                   headers={"Accept-Encoding": "identity"})
+
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertTrue(json.loads(response.data)["success"])
+
+    def test_small_body_not_compressed(self):
+        """Test body under the size threshold is sent as it is."""
+        response = self.client.get('/api/v1.0/categories',
+                                   headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(response.data),
+                        self.app.config["COMPRESS_MIN_SIZE"])
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_same_body_compressed_once(self):
+        """Test repeated response is served from the compressed cache."""
+        for _ in range(3):
+            response = self.client.get('/api/v1.0/questions',
+                                       headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_cache_forgets_least_recently_used(self):
+        """Test cache keeps only the configured number of bodies."""
+        cache = LruCache(max_entries=2)
+        cache.put(("a", "gzip"), b"a")
+        cache.put(("b", "gzip"), b"b")
+        cache.get(("a", "gzip"))
+        cache.put(("c", "gzip"), b"c")
+
+        self.assertEqual(cache.get(("a", "gzip")), b"a")
+        self.assertIsNone(cache.get(("b", "gzip")))
+
+
+class BatchTestCase(DbTestCase):
+    """Tests of the batch endpoint."""
+
+    def test_batch_returns_responses_in_order(self):
+        """Test every sub-request gets the response of its endpoint."""
+        category = random.choice(Category.get_all())
+        response = self.client.post('/api/v1.0/batch', json={"requests": [
+            {"path": "/api/v1.0/categories"},
+            {"method": "GET", "path": "/api/v1.0/questions?page=2"},
+            {"path": f"/api/v1.0/categories/{category.id}/questions"},
+        ]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["success"])
+        self.assertEqual([r["status"] for r in data["responses"]],
+                         [200, 200, 200])
+        self.assertEqual(data["responses"][0]["body"],
+                         self.client.get('/api/v1.0/categories').get_json())
+        self.assertEqual(
+            data["responses"][1]["body"],
+            self.client.get('/api/v1.0/questions?page=2').get_json())
+        self.assertEqual(
+            data["responses"][2]["body"]["current_category"]["id"],
+            category.id)
+
+    def test_batch_reports_sub_request_errors(self):
+        """Test failed sub-request does not fail the batch."""
+        response = self.client.post('/api/v1.0/batch', json={"requests": [
+            {"path": "/api/v1.0/questions/1000000"},
+            {"method": "POST", "path": "/api/v1.0/questions", "body": {}},
+            {"path": "/api/v1.0/categories"},
+        ]})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["status"] for r in data["responses"]],
+                         [404, 400, 200])
+        self.assertFalse(data["responses"][0]["body"]["success"])
+
+    def test_failed_write_does_not_fail_next_sub_requests(self):
+        """Test a sub-request failing in the db is rolled back."""
+        category = random.choice(Category.get_all())
+        response = self.client.post('/api/v1.0/batch', json={"requests": [
+            # passes the validation, can not be stored
+            {"method": "POST", "path": "/api/v1.0/questions", "body": {
+                "question": "Batch question", "answer": {"not": "text"},
+                "difficulty": 1, "category": category.id}},
+            {"path": "/api/v1.0/categories"},
+        ]})
+        data = json.loads(response.data)
+
+        self.assertEqual([r["status"] for r in data["responses"]],
+                         [500, 200])
+        self.assertEqual(data["responses"][1]["body"],
+                         self.client.get('/api/v1.0/categories').get_json())
+
+    def test_batch_writes_seen_by_next_sub_request(self):
+        """Test sub-requests run in order in one session."""
+        count = Question.get_count()
+        category = random.choice(Category.get_all())
+        response = self.client.post('/api/v1.0/batch', json={"requests": [
+            {"method": "POST", "path": "/api/v1.0/questions", "body": {
+                "question": "Batch question", "answer": "Batch answer",
+                "difficulty": 1, "category": category.id}},
+            {"path": "/api/v1.0/questions"},
+        ]})
+        data = json.loads(response.data)
+
+        self.assertEqual(data["responses"][0]["status"], 201)
+        self.assertEqual(data["responses"][1]["body"]["total_questions"],
+                         count + 1)
+
+    def test_batch_sub_requests_skip_admission(self):
+        """Test the batch takes one admission slot only."""
+        limiter = self.app.extensions["admission"]
+        limiter_concurrency = limiter.max_concurrency
+        limiter.max_concurrency = limiter.active + 1
+        try:
+            response = self.client.post('/api/v1.0/batch', json={
+                "requests": [{"path": "/api/v1.0/categories"}] * 3})
+        finally:
+            limiter.max_concurrency = limiter_concurrency
+
+        data = json.loads(response.data)
+        self.assertEqual([r["status"] for r in data["responses"]],
+                         [200, 200, 200])
+        self.assertEqual(limiter.active, 0)
+
+    def test_invalid_batch_returns_400(self):
+        """Test malformed and nested batches are rejected."""
+        max_requests = self.app.config["BATCH_MAX_REQUESTS"]
+        bodies = [
+            {},
+            {"requests": []},
+            {"requests": [{"method": "GET"}]},
+            {"requests": [{"path": "/api/v1.0/batch", "method": "POST"}]},
+            {"requests": [{"path": "/api/v1.0/categories", "method": "X"}]},
+            {"requests": [{"path": "/api/v1.0/categories"}]
+             * (max_requests + 1)},
+        ]
+
+        for body in bodies:
+            response = self.client.post('/api/v1.0/batch', json=body)
+            self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_reads(self):
+        """Test reads run in the thread pool when enabled."""
+        app = Flask(__name__)
+        app.config.update(BATCH_CONCURRENT_READS=True, BATCH_MAX_WORKERS=3)
+        barrier = threading.Barrier(3, timeout=5)
+
+        @app.route("/api/wait/<int:n>")
+        def wait(n):
+            barrier.wait()
+            return {"n": n, "thread": threading.current_thread().name}
+
+        with app.test_request_context("/api/v1.0/batch", method="POST"):
+            responses = batch.run_batch(
+                app, [{"path": f"/api/wait/{n}"} for n in range(3)])
+
+        self.assertEqual([r["body"]["n"] for r in responses], [0, 1, 2])
+        self.assertTrue(all(r["body"]["thread"].startswith("batch")
+                            for r in responses))
+
+
+class QuestionCacheTestCase(DbTestCase):
+    """Tests of the cache of formatted questions."""
+
+    def setUp(self):
+        """Pick a question to look up."""
+        super().setUp()
+        self.question = random.choice(Question.get_all())
+        self.db.session.expunge_all()
+
+    def test_repeated_lookup_served_from_cache(self):
+        """Test second lookup of a question does not query the db."""
+        url = f'/api/v1.0/questions/{self.question.id}'
+        first = self.client.get(url)
+        second = []
+        statements = self.captured_statements(
+            lambda: second.append(self.client.get(url)))
+
+        self.assertEqual(first.get_json(), second[0].get_json())
+        self.assertEqual(statements, [])
+        self.assertEqual(question_cache.hits, 1)
+        self.assertEqual(question_cache.misses, 1)
+
+    def test_update_invalidates_cached_question(self):
+        """Test updated question is read from the db again."""
+        Question.get_formatted(self.question.id)
+
+        question = Question.get_by_id(self.question.id)
+        question.answer = "Changed answer"
+        question.update()
+
+        self.assertEqual(Question.get_formatted(self.question.id)["answer"],
+                         "Changed answer")
+
+    def test_deleted_question_not_returned(self):
+        """Test deleted question is dropped from the cache."""
+        url = f'/api/v1.0/questions/{self.question.id}'
+        self.client.get(url)
+
+        self.client.delete(url)
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_expired_entry_read_again(self):
+        """Test entry older than ttl is not returned."""
+        cache = LruCache(max_entries=2, ttl=0.01)
+        cache.put(1, {"id": 1})
+
+        self.assertEqual(cache.get(1), {"id": 1})
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache), 0)
+
+    def test_stats_endpoint_reports_hit_rate(self):
+        """Test stats of the caches are returned."""
+        url = f'/api/v1.0/questions/{self.question.id}'
+        for _ in range(4):
+            self.client.get(url)
+
+        response = self.client.get('/api/v1.0/stats/caches')
+        stats = json.loads(response.data)["caches"]["questions"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.75)
+        self.assertEqual(stats["size"], 1)
+
+
+class QuestionsByIdsTestCase(DbTestCase):
+    """Tests of the questions lookup by ids."""
+
+    def setUp(self):
+        """Pick questions to look up."""
+        super().setUp()
+        self.ids = [q.id for q in random.sample(Question.get_all(), 3)]
+        self.missing_id = max(q.id for q in Question.get_all()) + 1
+        self.db.session.expunge_all()
+
+    def test_get_questions_by_ids_in_order(self):
+        """Test questions are returned in the requested order."""
+        ids = [self.ids[2], self.missing_id, self.ids[0], self.ids[1]]
+        response = self.client.get(
+            f'/api/v1.0/questions?ids={",".join(map(str, ids))}')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q["id"] for q in data["questions"]],
+                         [self.ids[2], self.ids[0], self.ids[1]])
+        self.assertEqual(data["missing_ids"], [self.missing_id])
+        self.assertEqual(data["total_questions"], 3)
+
+    def test_post_lookup_questions(self):
+        """Test POST variant returns the same as GET."""
+        ids = self.ids + [self.ids[0]]
+        response = self.client.post('/api/v1.0/questions/lookups',
+                                    json={"ids": ids})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q["id"] for q in data["questions"]], self.ids)
+        self.assertEqual(data["missing_ids"], [])
+
+    def test_questions_fetched_in_one_query(self):
+        """Test all questions are read with a single statement."""
+        statements = self.captured_statements(
+            lambda: Question.get_many(self.ids))
+
+        self.assertEqual(len(statements), 1)
+
+    def test_cached_questions_not_read_again(self):
+        """Test only the questions missing in the cache are queried."""
+        Question.get_formatted(self.ids[0])
+
+        statements = self.captured_statements(
+            lambda: self.assertEqual(
+                [q["id"] for q in Question.get_many_formatted(self.ids)],
+                self.ids))
+
+        self.assertEqual(len(statements), 1)
+        parameters = statements[0][1]
+        if isinstance(parameters, dict):
+            # postgres sends the ids as one array
+            parameters = parameters["question_ids"]
+        self.assertEqual(sorted(parameters), sorted(self.ids[1:]))
+        self.assertEqual(self.captured_statements(
+            lambda: Question.get_many_formatted(self.ids)), [])
+
+    def test_too_many_ids_returns_400(self):
+        """Test number of ids is limited."""
+        ids = range(1, self.app.config["QUESTIONS_IDS_MAX"] + 2)
+        response = self.client.post('/api/v1.0/questions/lookups',
+                                    json={"ids": list(ids)})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_ids_return_400(self):
+        """Test ids which are not numbers are rejected."""
+        get = self.client.get('/api/v1.0/questions?ids=1,a')
+        empty = self.client.get('/api/v1.0/questions?ids=')
+        post = self.client.post('/api/v1.0/questions/lookups',
+                                json={"ids": "1"})
+
+        self.assertEqual(get.status_code, 400)
+        self.assertEqual(empty.status_code, 400)
+        self.assertEqual(post.status_code, 400)
+
+
+class QuestionPatchTestCase(DbTestCase):
+    """Tests of partial question updates with optimistic concurrency."""
+
+    def setUp(self):
+        """Create a question to change."""
+        super().setUp()
+        self.categories = Category.get_all()
+        self.question = Question("Patched question", "Patched answer",
+                                 self.categories[0].id, 2).insert()
+        self.question_id = self.question.id
+
+    def patch(self, **body):
+        """Send a change of the question."""
+        return self.client.patch(f'/api/v1.0/questions/{self.question_id}',
+                                 json=body)
+
+    def test_patch_changes_given_fields(self):
+        """Test only the given fields change and the version increases."""
+        response = self.patch(version=1, answer="New answer", difficulty=4)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["question"], {
+            "id": self.question_id, "question": "Patched question",
+            "answer": "New answer", "category": self.categories[0].id,
+            "difficulty": 4, "version": 2})
+
+        stored = self.client.get(f'/api/v1.0/questions/{self.question_id}')
+        self.assertEqual(json.loads(stored.data)["question"],
+                         data["question"])
+        self.assertEqual(QuestionChange.get_since(0, 1000)[-1].operation,
+                         "updated")
+
+    def test_stale_version_conflicts(self):
+        """Test a change based on an old version is rejected with 409."""
+        self.assertEqual(self.patch(version=1, answer="First").status_code,
+                         200)
+
+        response = self.patch(version=1, answer="Second")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(json.loads(response.data)["success"])
+        self.assertEqual(Question.get_by_id(self.question_id).answer,
+                         "First")
+
+    def test_patch_missing_question(self):
+        """Test 404 is returned for a question which does not exist."""
+        self.question_id = self.question_id + 1000
+
+        response = self.patch(version=1, answer="Nothing")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_wrong_changes_rejected(self):
+        """Test changes without a version or a valid field return 400."""
+        for body in ({"answer": "No version"}, {"version": 1},
+                     {"version": True, "answer": "Bool version"},
+                     {"version": 1, "difficulty": 6},
+                     {"version": 1, "answer": " "},
+                     {"version": 1, "id": 5},
+                     {"version": 1, "category": 10_000}):
+            response = self.patch(**body)
+            self.assertEqual(response.status_code, 400, body)
+
+        self.assertEqual(Question.get_by_id(self.question_id).version, 1)
+
+    def test_category_change_moves_count(self):
+        """Test counts, quiz draws and the category list follow a move."""
+        source, target = self.categories[0], self.categories[1]
+        counts = (source.question_count, target.question_count)
+
+        response = self.patch(version=1, category=target.id)
+        self.assertEqual(response.status_code, 200)
+
+        self.db.session.expire_all()
+        self.assertEqual(source.question_count, counts[0] - 1)
+        self.assertEqual(target.question_count, counts[1] + 1)
+        self.assertEqual(quiz_sampler.question_buckets.category_of(
+            self.question_id), None if quiz_sampler.question_buckets
+            ._loaded_at is None else target.id)
+        self.assertIn(self.question_id,
+                      [q.id for q in Question.get_by_category_id(target.id)])
+
+    def test_single_statement_on_postgres(self):
+        """Test the question is not read before it is changed."""
+        if not is_postgres_run():
+            self.skipTest("RETURNING is used on postgres")
+
+        statements = self.captured_statements(
+            lambda: self.patch(version=1, question="One statement"))
+        touching = [statement for statement, _ in statements
+                    if "questions" in statement
+                    and "question_changes" not in statement]
+
+        self.assertEqual(len(touching), 1)
+        self.assertTrue(touching[0].lstrip().startswith("UPDATE questions"))
+        self.assertIn("RETURNING", touching[0])
+
+
+class QuestionChangesTestCase(DbTestCase):
+    """Tests of the question change feed."""
+
+    def setUp(self):
+        """Remember the last change before the test."""
+        super().setUp()
+        self.since = self.client.get(
+            '/api/v1.0/questions/changes?since=0&limit=1000') \
+            .get_json()["last_seq"]
+        self.category = random.choice(Category.get_all())
+
+    def changes(self, since=None, limit=None):
+        """Return the changes feed response data."""
+        url = f'/api/v1.0/questions/changes?since={self.since}' \
+            if since is None else \
+            f'/api/v1.0/questions/changes?since={since}'
+        if limit is not None:
+            url += f'&limit={limit}'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_mutations_recorded_in_order(self):
+        """Test insert, update and delete are logged with growing seq."""
+        question = Question("Change question", "Change answer",
+                            self.category.id, 2).insert()
+        question_id = question.id
+        question.difficulty = 3
+        question.update()
+        question.delete()
+
+        data = self.changes()
+
+        self.assertEqual([c["operation"] for c in data["changes"]],
+                         ["created", "updated", "deleted"])
+        self.assertEqual({c["question_id"] for c in data["changes"]},
+                         {question_id})
+        seqs = [c["seq"] for c in data["changes"]]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertGreater(seqs[0], self.since)
+        self.assertEqual(data["changes"][1]["question"]["difficulty"], 3)
+        self.assertEqual(data["last_seq"], seqs[-1])
+        self.assertFalse(data["has_more"])
+
+    def test_changes_paginated(self):
+        """Test a mirror follows the changes page by page."""
+        for i in range(5):
+            Question(f"Page question {i}", "Answer", self.category.id,
+                     1).insert()
+
+        first = self.changes(limit=3)
+        second = self.changes(since=first["last_seq"], limit=3)
+
+        self.assertTrue(first["has_more"])
+        self.assertEqual(len(first["changes"]), 3)
+        self.assertFalse(second["has_more"])
+        self.assertEqual([c["question"]["question"]
+                          for c in first["changes"] + second["changes"]],
+                         [f"Page question {i}" for i in range(5)])
+
+    def test_no_changes_keeps_since(self):
+        """Test empty page returns the requested seq."""
+        data = self.changes()
+
+        self.assertEqual(data["changes"], [])
+        self.assertEqual(data["last_seq"], self.since)
+        self.assertEqual(data["head_seq"], self.since)
+
+    def test_every_page_has_head_seq(self):
+        """Test a page behind the newest change tells the head."""
+        for i in range(3):
+            Question(f"Head question {i}", "Answer", self.category.id,
+                     1).insert()
+
+        data = self.changes(limit=1)
+
+        self.assertTrue(data["has_more"])
+        self.assertEqual(data["head_seq"], data["last_seq"] + 2)
+        self.assertEqual(data["head_seq"], QuestionChange.get_head_seq())
+
+    def test_pruned_changes_return_410(self):
+        """Test a mirror behind the pruned changes has to resync."""
+        for i in range(2):
+            Question(f"Pruned question {i}", "Answer", self.category.id,
+                     1).insert()
+        QuestionChange.prune(datetime.now(timezone.utc) + timedelta(days=1))
+        Question("Kept question", "Answer", self.category.id, 1).insert()
+
+        response = self.client.get(
+            f'/api/v1.0/questions/changes?since={self.since}')
+
+        self.assertEqual(response.status_code, 410)
+        kept_seq = QuestionChange.get_first_seq()
+        self.assertEqual(len(self.changes(since=kept_seq - 1)["changes"]), 1)
+
+        # resync: the head, then all questions, then the changes after it
+        head_seq = response.get_json()["head_seq"]
+        self.assertEqual(head_seq, kept_seq)
+        Question("After resync", "Answer", self.category.id, 1).insert()
+        self.assertEqual([c["question"]["question"] for c in
+                          self.changes(since=head_seq)["changes"]],
+                         ["After resync"])
+
+    def test_wrong_paging_returns_400(self):
+        """Test negative since and too big limit are rejected."""
+        max_limit = self.app.config["QUESTION_CHANGES_MAX_PAGE_SIZE"]
+        for url in ('/api/v1.0/questions/changes?since=-1',
+                    '/api/v1.0/questions/changes?limit=0',
+                    f'/api/v1.0/questions/changes?limit={max_limit + 1}'):
+            self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class EventsTestCase(DbTestCase):
+    """Tests of the server-sent events stream."""
+
+    def setUp(self):
+        """Start every test without subscribers."""
+        super().setUp()
+        events.broker.clear()
+        self.category = random.choice(Category.get_all())
+
+    def open_stream(self, **headers):
+        """Return the stream response and an iterator of its chunks."""
+        response = self.client.get('/api/v1.0/events', headers=headers)
+        self.addCleanup(response.close)
+        chunks = (chunk.decode() if isinstance(chunk, bytes) else chunk
+                  for chunk in response.response)
+
+        self.assertEqual(next(chunks), "retry: 3000\n\n")
+        return response, chunks
+
+    @unittest.skipIf(is_postgres_run(),
+                     "NOTIFY of the rolled back test transaction is not sent")
+    def test_committed_question_pushed_to_subscriber(self):
+        """Test created and deleted questions are streamed."""
+        response, chunks = self.open_stream()
+
+        question = Question("Event question", "Event answer",
+                            self.category.id, 1).insert()
+        question_id = question.id
+        question.delete()
+
+        created, deleted = next(chunks), next(chunks)
+        self.assertTrue(created.startswith("event: question.created\n"))
+        self.assertEqual(json.loads(created.split("data: ")[1])["id"],
+                         question_id)
+        self.assertTrue(deleted.startswith("event: question.deleted\n"))
+        self.assertEqual(response.mimetype, "text/event-stream")
+
+    @unittest.skipIf(is_postgres_run(),
+                     "NOTIFY of the rolled back test transaction is not sent")
+    def test_category_change_pushed(self):
+        """Test category changes are streamed as `category.changed`."""
+        response, chunks = self.open_stream()
+
+        Category("Event category").insert()
+
+        self.assertTrue(next(chunks).startswith("event: category.changed\n"))
+
+    def test_idle_stream_gets_heartbeat(self):
+        """Test a comment is sent when there is no event."""
+        heartbeat = self.app.config["EVENTS_HEARTBEAT"]
+        self.app.config["EVENTS_HEARTBEAT"] = 0.01
+        try:
+            response, chunks = self.open_stream()
+        finally:
+            self.app.config["EVENTS_HEARTBEAT"] = heartbeat
+
+        self.assertEqual(next(chunks), ": heartbeat\n\n")
+
+    def test_stream_not_compressed(self):
+        """Test the stream is sent as it is to a client accepting gzip."""
+        response, chunks = self.open_stream(**{"Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_slow_subscriber_dropped(self):
+        """Test subscriber with a full queue gets reset and is removed."""
+        broker = events.EventBroker(max_queue=2)
+        subscriber = broker.subscribe()
+
+        for i in range(3):
+            broker.publish("question.created", {"id": i})
+
+        chunks = list(events.stream(subscriber, heartbeat=0.01))
+
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(chunks[-1].startswith("event: reset\n"))
+        self.assertEqual(broker.subscribers, 0)
+
+    def test_stream_admitted_when_limiter_full(self):
+        """Test streams are exempt from the admission control."""
+        limiter = self.app.extensions["admission"]
+        queue_timeout, limiter.queue_timeout = limiter.queue_timeout, 0.01
+        self.addCleanup(setattr, limiter, "queue_timeout", queue_timeout)
+        for _ in range(limiter.max_concurrency):
+            self.assertTrue(limiter.acquire())
+            self.addCleanup(limiter.release)
+
+        self.assertEqual(
+            self.client.get('/api/v1.0/categories').status_code, 503)
+        response, chunks = self.open_stream()
+
+        self.assertEqual(response.status_code, 200)
+        for name in ("ADMISSION_EXEMPT_ENDPOINTS",
+                     "COMPRESS_EXEMPT_ENDPOINTS"):
+            self.assertLessEqual(self.app.config[name],
+                                 set(self.app.view_functions), name)
+
+    def test_head_request_does_not_keep_subscriber(self):
+        """Test a stream never iterated unsubscribes when closed."""
+        for _ in range(5):
+            response = self.client.head('/api/v1.0/events')
+            response.close()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(events.broker.subscribers, 0)
+
+    def test_stream_refused_in_batch(self):
+        """Test a batch can not open streams."""
+        response = self.client.post('/api/v1.0/batch', json={
+            "requests": [{"path": "/api/v1.0/events"}] * 5})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(events.broker.subscribers, 0)
+
+    def test_notify_payloads_within_limit(self):
+        """Test events are packed in payloads postgres accepts."""
+        changes = [("question.created", {"id": i, "question": "x" * 1000})
+                   for i in range(20)]
+        changes.append(("question.created",
+                        {"id": 20, "question": "x" * 9000}))
+
+        with self.assertLogs(logs.logger, logging.WARNING):
+            payloads = events.notify_payloads(changes)
+
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.encode("utf8"))
+                            <= events.MAX_PAYLOAD_BYTES
+                            for payload in payloads))
+        self.assertEqual([data["id"] for payload in payloads
+                          for _, data in json.loads(payload)],
+                         list(range(20)))
+
+    def test_too_many_subscribers_returns_503(self):
+        """Test subscribers over the limit are rejected."""
+        max_subscribers = events.broker.max_subscribers
+        events.broker.max_subscribers = 1
+        try:
+            self.open_stream()
+            response = self.client.get('/api/v1.0/events')
+        finally:
+            events.broker.max_subscribers = max_subscribers
+
+        self.assertEqual(response.status_code, 503)
+
+
+@unittest.skipUnless(is_postgres_run(), "NOTIFY needs postgres")
+class PostgresEventsTestCase(unittest.TestCase):
+    """Tests of the events sent by `NOTIFY`, with committed changes."""
+
+    def setUp(self):
+        """Listen on the events channel on a connection of its own."""
+        self.ctx = test_app.app_context()
+        self.ctx.push()
+        self.addCleanup(self.ctx.pop)
+        self.addCleanup(db.session.remove)
+
+        self.listening = db.engine.raw_connection()
+        self.addCleanup(self.listening.invalidate)
+        self.listening.connection.set_session(autocommit=True)
+        with self.listening.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {events.CHANNEL}")
+
+        self.category = random.choice(Category.get_all())
+
+    def notifications(self, timeout=1):
+        """Return payloads of the notifications received in time."""
+        connection = self.listening.connection
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not connection.notifies:
+            select.select([connection], [], [], 0.05)
+            connection.poll()
+        connection.poll()
+
+        payloads = [json.loads(n.payload) for n in connection.notifies]
+        connection.notifies.clear()
+        return payloads
+
+    def test_one_notification_per_commit(self):
+        """Test a group of created questions is sent in one notification."""
+        created = Question.insert_many([
+            {"question": f"Notified question {i}", "answer": "Answer",
+             "category": self.category.id, "difficulty": 1}
+            for i in range(3)])
+        for data in created:
+            self.addCleanup(lambda i=data["id"]: Question.get_by_id(i)
+                            .delete())
+
+        payloads = self.notifications()
+
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual([(name, data["id"]) for name, data in payloads[0]],
+                         [("question.created", data["id"])
+                          for data in created])
+
+    def test_rolled_back_changes_not_sent(self):
+        """Test changes of a rolled back transaction are not notified."""
+        question = Question("Rolled back question", "Answer",
+                            self.category.id, 1)
+        db.session.add(question)
+        db.session.flush()
+        models.QuestionChange.record("created", question.format())
+        db.session.rollback()
+
+        Category("Notified category").insert().delete()
+
+        self.assertEqual([[name for name, _ in payload]
+                          for payload in self.notifications()],
+                         [["category.changed"], ["category.changed"]])
+
+
+class SnapshotTestCase(DbTestCase):
+    """Tests of the static snapshot of the question bank."""
+
+    def setUp(self):
+        """Build snapshots in a temporary directory."""
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read(self, path):
+        """Return json content of a snapshot file."""
+        with open(os.path.join(self.directory, path), "rb") as f:
+            return json.loads(f.read())
+
+    def test_files_match_api_responses(self):
+        """Test snapshot files have the bodies of the api responses."""
+        manifest = snapshots.build_snapshot(self.directory)
+
+        categories = self.client.get('/api/v1.0/categories')
+        self.assertEqual(self.read(manifest["categories"]),
+                         json.loads(categories.data))
+
+        for category_id, path in manifest["category_questions"].items():
+            response = self.client.get(
+                f'/api/v1.0/categories/{category_id}/questions')
+            self.assertEqual(self.read(path), json.loads(response.data))
+
+        questions = self.read(manifest["questions"])
+        self.assertEqual(questions["total_questions"], Question.get_count())
+        self.assertEqual(manifest["total_questions"], Question.get_count())
+
+        with open(os.path.join(self.directory,
+                               manifest["questions"] + ".gz"), "rb") as f:
+            self.assertEqual(json.loads(gzip.decompress(f.read())),
+                             questions)
+
+    def test_empty_category_has_no_file(self):
+        """Test categories without questions are left out, as in the api."""
+        category = Category("Empty snapshot category").insert()
+
+        manifest = snapshots.build_snapshot(self.directory)
+
+        self.assertNotIn(str(category.id), manifest["category_questions"])
+        self.assertIn(str(category.id),
+                      self.read(manifest["categories"])["categories"])
+
+    def test_version_changes_with_data_only(self):
+        """Test unchanged data keep the version, a change makes a new one."""
+        first = snapshots.build_snapshot(self.directory)
+        self.assertEqual(snapshots.build_snapshot(self.directory), first)
+
+        Question("Snapshot question", "Snapshot answer",
+                 Category.get_all()[0].id, 2).insert()
+        second = snapshots.build_snapshot(self.directory)
+
+        self.assertNotEqual(second["version"], first["version"])
+        self.assertEqual(second["total_questions"],
+                         first["total_questions"] + 1)
+        self.assertEqual(snapshots.read_manifest(self.directory), second)
+        # clients holding the previous manifest can still fetch its files
+        self.assertTrue(os.path.isdir(os.path.join(self.directory,
+                                                   first["version"])))
+
+    def test_old_versions_pruned(self):
+        """Test only the newest versions are kept."""
+        category_id = Category.get_all()[0].id
+        versions = []
+        for i in range(3):
+            Question(f"Prune question {i}", "Answer", category_id, 1).insert()
+            versions.append(snapshots.build_snapshot(
+                self.directory, keep=2)["version"])
+
+        kept = {entry.name for entry in os.scandir(self.directory)
+                if entry.is_dir() and not entry.name.startswith(".")}
+        self.assertEqual(kept, set(versions[1:]))
+
+    def test_manifest_endpoint(self):
+        """Test the manifest points to the files under the snapshot url."""
+        self.app.config["SNAPSHOT_DIR"] = self.directory
+        self.addCleanup(self.app.config.__setitem__, "SNAPSHOT_DIR", None)
+        manifest = snapshots.build_snapshot(self.directory)
+
+        response = self.client.get('/api/v1.0/snapshot')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["snapshot"]["version"], manifest["version"])
+        self.assertEqual(data["snapshot"]["questions"],
+                         f"/snapshots/{manifest['version']}/questions.json")
+        self.assertIn("max-age=", response.headers["Cache-Control"])
+
+    def test_manifest_not_found_when_disabled(self):
+        """Test 404 is returned when snapshots are not built."""
+        response = self.client.get('/api/v1.0/snapshot')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(json.loads(response.data)["success"])
+
+    def test_committed_change_requests_build(self):
+        """Test a build is requested after a change when enabled."""
+        builder = self.app.extensions["snapshots"]
+        requested = []
+        builder.request_build = lambda: requested.append(True)
+        self.addCleanup(vars(builder).pop, "request_build")
+
+        category_id = Category.get_all()[0].id
+        Question("Not built", "Answer", category_id, 1).insert()
+        self.assertEqual(requested, [])
+
+        self.app.config["SNAPSHOT_DIR"] = self.directory
+        self.addCleanup(self.app.config.__setitem__, "SNAPSHOT_DIR", None)
+        Question("Built", "Answer", category_id, 1).insert()
+        self.assertEqual(requested, [True])
+
+    def test_requests_share_a_build(self):
+        """Test requests made before a build starts are built once."""
+        builder = snapshots.SnapshotBuilder(self.app, delay=0.05)
+        built = threading.Event()
+        builds = []
+
+        def build():
+            builds.append(True)
+            built.set()
+
+        builder.build = build
+        for _ in range(5):
+            builder.request_build()
+
+        self.assertTrue(built.wait(5))
+        time.sleep(0.1)
+        self.assertEqual(builds, [True])
+
+
+class QuestionStoreTestCase(DbTestCase):
+    """Tests of the memory-mapped binary question store."""
+
+    def setUp(self):
+        """Serve reads from a store built in a temporary directory."""
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        question_store.build_store(self.directory)
+        self.watcher = question_store.StoreWatcher(self.directory,
+                                                   check_interval=0)
+        self.store = self.watcher.current()
+
+    def serve_from_store(self):
+        """Make the app serve reads from the store until the test ends."""
+        self.app.extensions["question_store"] = self.watcher
+        self.addCleanup(self.app.extensions.pop, "question_store")
+
+    def test_store_matches_db(self):
+        """Test questions and categories of the store are those of the db."""
+        questions = Question.get_all()
+
+        self.assertEqual(self.store.question_count, len(questions))
+        for question in questions:
+            self.assertEqual(self.store.get(question.id), question.format())
+        self.assertIsNone(self.store.get(max(q.id for q in questions) + 1))
+
+        self.assertEqual(self.store.categories_as_dict(),
+                         Category.all_as_dict())
+        self.assertEqual(self.store.categories_as_dict(non_empty_only=True),
+                         Category.all_as_dict(non_empty_only=True))
+        for category in Category.get_all():
+            self.assertEqual(self.store.get_category(category.id),
+                             category.format())
+            self.assertEqual(
+                self.store.get_by_category(category.id),
+                [q.format() for q in Question.get_by_category_id(category.id)])
+
+    def test_texts_round_trip(self):
+        """Test non ascii texts and an empty bank are stored as they are."""
+        path = os.path.join(self.directory, "texts.bin")
+        with open(path, "wb") as f:
+            f.write(question_store.encode_store(
+                [(2, "Géographie")],
+                [(7, 2, 3, 1, "Où est Zürich?", "En Suisse ✓")]))
+        store = question_store.QuestionStore(path)
+
+        self.assertEqual(store.get(7), {
+            "id": 7, "question": "Où est Zürich?", "answer": "En Suisse ✓",
+            "category": 2, "difficulty": 3, "version": 1})
+        self.assertEqual(store.categories_as_dict(), {"2": "Géographie"})
+
+        with open(path, "wb") as f:
+            f.write(question_store.encode_store([], []))
+        store = question_store.QuestionStore(path)
+
+        self.assertEqual(store.question_count, 0)
+        self.assertIsNone(store.get(7))
+        self.assertEqual(store.get_page(1, 10), [])
+
+    def test_reads_served_without_db(self):
+        """Test store reads give the db responses with no db statement."""
+        category_id = Category.get_all()[0].id
+        question_id = Question.get_all()[0].id
+        paths = ['/api/v1.0/questions?page=1', '/api/v1.0/questions?page=2',
+                 f'/api/v1.0/questions/{question_id}',
+                 f'/api/v1.0/categories/{category_id}/questions']
+        from_db = [json.loads(self.client.get(path).data) for path in paths]
+
+        self.serve_from_store()
+        from_store = []
+        statements = self.captured_statements(lambda: from_store.extend(
+            json.loads(self.client.get(path).data) for path in paths))
+
+        self.assertEqual(from_store, from_db)
+        self.assertEqual(statements, [])
+
+    def test_quiz_drawn_from_store(self):
+        """Test quiz questions are drawn from the store with no db query."""
+        self.serve_from_store()
+        category = Category.get_all()[0]
+        ids = [q.id for q in Question.get_by_category_id(category.id)]
+        responses = []
+
+        def play():
+            for _ in ids:
+                responses.append(self.client.post(
+                    '/api/v1.0/quizzes', json={
+                        "previous_questions": [r.json["question"]["id"]
+                                               for r in responses],
+                        "quiz_category": category.format()}))
+
+        statements = self.captured_statements(play)
+
+        self.assertEqual(statements, [])
+        self.assertEqual(sorted(r.json["question"]["id"] for r in responses),
+                         sorted(ids))
+        response = self.client.post('/api/v1.0/quizzes', json={
+            "previous_questions": ids, "quiz_category": category.format()})
+        self.assertEqual(response.status_code, 404)
+
+    def test_new_generation_mapped(self):
+        """Test a rebuilt store replaces the mapped one."""
+        question = Question("Stored question", "Stored answer",
+                            Category.get_all()[0].id, 4).insert()
+        self.assertIsNone(self.store.get(question.id))
+
+        question_store.build_store(self.directory)
+        store = self.watcher.current()
+
+        self.assertNotEqual(store.version, self.store.version)
+        self.assertEqual(store.get(question.id), question.format())
+        # the replaced file stays for workers still reading it
+        self.assertTrue(os.path.exists(self.store.path))
+        self.assertEqual(self.store.get(question.id), None)
+
+    def test_unchanged_data_keep_the_store(self):
+        """Test a build of unchanged data does not replace the store."""
+        path = question_store.build_store(self.directory)
+
+        self.assertEqual(path, self.store.path)
+        self.assertIs(self.watcher.current(), self.store)
+
+
+class CategoryRegistryTestCase(DbTestCase):
+    """Tests of the categories shared by the worker processes."""
+
+    def shared_registries(self, count=2, ttl=60):
+        """Return registries sharing files, as in separate processes."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "categories")
+
+        registries = [CategoryRegistry(ttl) for _ in range(count)]
+        for registry in registries:
+            self.assertTrue(registry.open(path))
+        return registries
+
+    def test_categories_read_without_db(self):
+        """Test only the first read of the categories queries the db."""
+        categories = Category.all_as_dict()
+
+        statements = self.captured_statements(lambda: [
+            self.client.get('/api/v1.0/categories'),
+            Category.all_as_dict(non_empty_only=True)])
+
+        self.assertEqual(statements, [])
+        self.assertEqual(
+            categories, {str(c.id): c.type for c in Category.get_all()})
+
+    def test_category_changes_published(self):
+        """Test inserted and deleted categories are seen without a query."""
+        Category.all_as_dict()
+        version = category_registry.version
+
+        category = Category("Registry category").insert()
+        self.assertGreater(category_registry.version, version)
+        statements = self.captured_statements(Category.all_as_dict)
+        self.assertEqual(statements, [])
+        self.assertIn(str(category.id), Category.all_as_dict())
+
+        category_id = category.id
+        category.delete()
+        self.assertNotIn(str(category_id), Category.all_as_dict())
+
+    def test_question_changes_update_non_empty(self):
+        """Test a category emptied by deletes is no longer non empty."""
+        category = Category("Registry questions").insert()
+        question = Question("Registry question", "Answer",
+                            category.id, 1).insert()
+        self.assertIn(str(category.id),
+                      Category.all_as_dict(non_empty_only=True))
+
+        question.delete()
+        self.assertNotIn(str(category.id),
+                         Category.all_as_dict(non_empty_only=True))
+
+    def test_question_changes_keep_registry(self):
+        """Test questions of non empty categories do not reload it."""
+        category = Category("Registry questions").insert()
+        Question("Registry question", "Answer", category.id, 1).insert()
+        Category.all_as_dict()
+
+        def changes():
+            question = Question("Another question", "Answer",
+                                category.id, 1).insert()
+            question.delete()
+            Category.all_as_dict(non_empty_only=True)
+
+        statements = self.captured_statements(changes)
+
+        self.assertFalse([statement for statement, _ in statements
+                          if "FROM categories ORDER BY" in statement])
+        self.assertIsNotNone(category_registry.get())
+
+    def test_version_shared_by_processes(self):
+        """Test a version published by one process is read by another."""
+        first, second = self.shared_registries()
+
+        first.publish(lambda: {1: ("Science", 3)})
+        self.assertEqual(second.get(), {1: ("Science", 3)})
+        self.assertEqual(second.version, first.version)
+
+        second.publish(lambda: {1: ("Science", 3), 2: ("Art", 0)})
+        self.assertEqual(first.get(), {1: ("Science", 3), 2: ("Art", 0)})
+
+        first.invalidate()
+        self.assertIsNone(second.get())
+
+    def test_published_categories_expire(self):
+        """Test categories are loaded again after the ttl."""
+        registry, = self.shared_registries(count=1, ttl=0)
+
+        registry.publish(lambda: {1: ("Science", 3)})
+        time.sleep(0.01)
+
+        self.assertIsNone(registry.get())
+
+    def test_kept_in_process_when_not_shareable(self):
+        """Test the registry falls back to the process memory."""
+        registry = CategoryRegistry()
+
+        with self.assertLogs("trivia", "WARNING"):
+            shared = registry.open("/nonexistent/trivia/categories")
+
+        self.assertFalse(shared)
+        self.assertFalse(registry.shared)
+        self.assertIsNone(registry.get())
+        registry.publish(lambda: {1: ("Science", 3)})
+        self.assertEqual(registry.get(), {1: ("Science", 3)})
+        registry.invalidate()
+        self.assertIsNone(registry.get())
+
+
+class GroupCommitTestCase(DbTestCase):
+    """Tests of the group commit of created questions."""
+
+    def setUp(self):
+        """Enable a writer with a long wait, to group the test questions."""
+        super().setUp()
+        self.category = random.choice(Category.get_all())
+        self.writer = group_commit.GroupCommitWriter(self.app, max_delay=0.2,
+                                                     max_size=3)
+        self.app.extensions["group_commit"] = self.writer
+        self.addCleanup(self.app.extensions.pop, "group_commit")
+
+    def item(self, text):
+        """Return fields of a question as posted."""
+        return {"question": text, "answer": f"{text} answer",
+                "category": self.category.id, "difficulty": 2}
+
+    def test_created_question_returned_with_location(self):
+        """Test the request gets the committed question and its url."""
+        count = self.category.question_count
+
+        response = self.client.post("/api/v1.0/questions",
+                                    json=self.item("Grouped question"))
+
+        # committed by the session of the writer thread
+        db.session.expire_all()
+        question_id = int(response.location.split("/")[-1])
+        question = Question.get_by_id(question_id)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(question.question_text, "Grouped question")
+        self.assertEqual(self.category.question_count, count + 1)
+        self.assertEqual(QuestionChange.query.filter_by(
+            question_id=question_id).one().operation, "created")
+
+    def test_questions_created_in_one_insert(self):
+        """Test questions waiting together are one insert and one commit."""
+        commits = []
+        record = commits.append
+        # the writer thread commits in its own session
+        sqlalchemy.event.listen(sqlalchemy.orm.Session, "after_commit",
+                                record)
+        self.addCleanup(sqlalchemy.event.remove, sqlalchemy.orm.Session,
+                        "after_commit", record)
+
+        statements = self.captured_statements(lambda: [
+            future.result(timeout=5) for future in
+            [self.writer.submit(self.item(f"Grouped {i}")) for i in range(3)]
+        ])
+
+        inserts = [statement for statement, _ in statements
+                   if statement.startswith("INSERT INTO questions")]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len(commits), 1)
+
+    def test_each_request_gets_its_question(self):
+        """Test the futures get the questions in the order of the items."""
+        futures = [self.writer.submit(self.item(f"Grouped {i}"))
+                   for i in range(3)]
+
+        created = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual([q["question"] for q in created],
+                         [f"Grouped {i}" for i in range(3)])
+        for question in created:
+            self.assertEqual(Question.get_formatted(question["id"]), question)
+
+    def test_group_larger_than_max_size_split(self):
+        """Test a group has at most `max_size` questions."""
+        groups = []
+        insert_many = Question.insert_many
+
+        def recorded(items, **kwargs):
+            groups.append(len(items))
+            return insert_many(items, **kwargs)
+
+        Question.insert_many = recorded
+        self.addCleanup(setattr, Question, "insert_many", insert_many)
+
+        futures = [self.writer.submit(self.item(f"Grouped {i}"))
+                   for i in range(5)]
+        [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(groups, [3, 2])
+
+    def test_failing_listener_does_not_create_group_again(self):
+        """Test a committed group is not retried when a listener fails."""
+        def failing(event_name, data):
+            raise RuntimeError("listener failed")
+
+        models.on_change(failing)
+        self.addCleanup(models._change_listeners.remove, failing)
+        count = Question.get_count()
+
+        created = [future.result(timeout=5) for future in
+                   [self.writer.submit(self.item(f"Grouped {i}"))
+                    for i in range(3)]]
+
+        db.session.expire_all()
+        self.assertEqual(Question.get_count(), count + 3)
+        self.assertEqual(len({question["id"] for question in created}), 3)
+
+    def test_request_not_committed_in_time_gets_503(self):
+        """Test a request stops waiting, its question is not created."""
+        self.writer.timeout = 0.05
+        count = Question.get_count()
+
+        response = self.client.post("/api/v1.0/questions",
+                                    json=self.item("Late question"))
+        # the writer collects for `max_delay`, then skips the question
+        self.writer.submit(self.item("Next question")).result(timeout=5)
+
+        db.session.expire_all()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(Question.get_count(), count + 1)
+        self.assertEqual(Question.search("Late question"), [])
+
+    def test_wrong_question_fails_only_its_request(self):
+        """Test a failed group is retried question by question."""
+        futures = [self.writer.submit(self.item("Good question")),
+                   self.writer.submit(dict(self.item("Bad question"),
+                                           answer=None)),
+                   self.writer.submit(self.item("Other good question"))]
+
+        good, other = futures[0].result(timeout=5), futures[2].result(5)
+
+        with self.assertRaises(exc.IntegrityError):
+            futures[1].result(timeout=5)
+        self.assertEqual(Question.get_formatted(good["id"])["question"],
+                         "Good question")
+        self.assertIsNotNone(Question.get_by_id(other["id"]))
+
+
+class QuizAttemptsTestCase(DbTestCase):
+    """Tests of the buffered recording of quiz attempts."""
+
+    def setUp(self):
+        """Start every test with an empty buffer."""
+        super().setUp()
+        self.buffer = self.app.extensions["attempts"]
+        self.addCleanup(self.buffer._rows.clear)
+        # the flushes end the session of the test
+        self.question_id = random.choice(Question.get_all()).id
+
+    def attempt(self, correct=True, time_ms=1500):
+        """Return an attempt as posted."""
+        return {"question_id": self.question_id, "correct": correct,
+                "time_ms": time_ms}
+
+    def rows(self, count):
+        """Return buffered rows of attempts."""
+        now = datetime.now(timezone.utc)
+        return [(self.question_id, i % 2 == 0, 100 * i, now)
+                for i in range(count)]
+
+    def test_attempts_accepted_without_db_write(self):
+        """Test the request only buffers the attempts."""
+        statements = self.captured_statements(lambda: self.assertEqual(
+            self.client.post("/api/v1.0/quizzes/attempts", json={
+                "attempts": [self.attempt(), self.attempt(False, 9000)]
+            }).status_code, 202))
+
+        self.assertEqual(statements, [])
+        self.assertEqual(self.buffer.pending, 2)
+        self.assertEqual(QuizAttempt.query.count(), 0)
+
+    def test_flush_writes_buffered_attempts(self):
+        """Test a flush writes all waiting attempts in one transaction."""
+        self.client.post("/api/v1.0/quizzes/attempts", json={
+            "attempts": [self.attempt(), self.attempt(False, 9000)]})
+
+        self.assertEqual(self.buffer.flush(), 2)
+
+        attempts = QuizAttempt.query.order_by(QuizAttempt.id).all()
+        self.assertEqual([(a.question_id, a.correct, a.time_ms)
+                          for a in attempts],
+                         [(self.question_id, True, 1500),
+                          (self.question_id, False, 9000)])
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_wrong_attempts_return_400(self):
+        """Test attempts with missing or wrong fields are rejected."""
+        bodies = [{}, {"attempts": []}, {"attempts": [{"question_id": 1}]},
+                  {"attempts": [dict(self.attempt(), correct="yes")]},
+                  {"attempts": [dict(self.attempt(), time_ms=-1)]},
+                  {"attempts": [dict(self.attempt(), time_ms=2 ** 31)]},
+                  {"attempts": [dict(self.attempt(), question_id=2 ** 31)]},
+                  {"attempts": [self.attempt()] * (
+                      self.app.config["QUIZ_ATTEMPTS_MAX_BATCH"] + 1)}]
+
+        for body in bodies:
+            response = self.client.post("/api/v1.0/quizzes/attempts",
+                                        json=body)
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_full_buffer_returns_503(self):
+        """Test attempts over the pending limit are rejected."""
+        max_pending = self.buffer.max_pending
+        self.buffer.max_pending = 1
+        self.addCleanup(setattr, self.buffer, "max_pending", max_pending)
+
+        response = self.client.post("/api/v1.0/quizzes/attempts", json={
+            "attempts": [self.attempt(), self.attempt()]})
+
+        self.assertEqual(response.status_code, 503)
+
+    def test_failed_flush_keeps_attempts(self):
+        """Test attempts of a failed flush are written by the next one."""
+        self.buffer.add(self.rows(3))
+        insert_many = QuizAttempt.insert_many
+
+        def failing(rows):
+            raise exc.OperationalError("COPY", {}, Exception("db is gone"))
+
+        QuizAttempt.insert_many = failing
+        try:
+            self.assertEqual(self.buffer.flush(), 0)
+        finally:
+            QuizAttempt.insert_many = insert_many
+
+        self.assertEqual(self.buffer.pending, 3)
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(QuizAttempt.query.count(), 3)
+
+    def test_refused_attempt_dropped(self):
+        """Test an attempt refused by the db does not block the others."""
+        rows = self.rows(5)
+        rows[3] = (self.question_id, None, 100, rows[3][3])
+        self.buffer.add(rows)
+
+        with self.assertLogs(logs.logger, logging.WARNING) as logged:
+            self.assertEqual(self.buffer.flush(), 4)
+
+        self.assertEqual(self.buffer.pending, 0)
+        self.assertEqual(QuizAttempt.query.count(), 4)
+        self.assertEqual(len(logged.records), 1)
+        self.assertIn("refused", logged.records[0].getMessage())
+
+    def test_full_batch_flushed_by_thread(self):
+        """Test the flusher thread writes a batch reaching the flush size."""
+        buffer = attempts.AttemptBuffer(self.app, flush_size=3,
+                                        flush_interval=3600)
+
+        buffer.add(self.rows(3))
+
+        deadline = time.monotonic() + 5
+        while buffer.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # the thread releases the flush lock after the commit
+        with buffer._flush_lock:
+            self.assertEqual(QuizAttempt.query.count(), 3)
+
+    def test_exit_flushes_all_buffers(self):
+        """Test the exit hook writes attempts of every buffer."""
+        self.buffer.add(self.rows(2))
+
+        attempts.flush_all()
+
+        self.assertEqual(QuizAttempt.query.count(), 2)
+        self.assertEqual(self.buffer.pending, 0)
+
+
+class LeaderboardTestCase(DbTestCase):
+    """Tests of the games and the leaderboards."""
+
+    def setUp(self):
+        """Pick categories of the games."""
+        super().setUp()
+        self.category_id, self.other_category_id = \
+            [c.id for c in random.sample(Category.get_all(), 2)]
+
+    def play(self, score, category_id=None, player="Player", size=100):
+        """Insert a game, return its id."""
+        return Game(player, category_id, score, 10).insert(size)["id"]
+
+    def scores(self, category_id=None):
+        """Return the leaderboard as (score, game id) pairs."""
+        return [(e.score, e.game_id)
+                for e in LeaderboardEntry.get_top(100, category_id)]
+
+    def test_game_created_and_ranked(self):
+        """Test a posted game is on the leaderboards, the best first."""
+        self.play(3, self.category_id)
+
+        response = self.client.post("/api/v1.0/games", json={
+            "player": "Ada", "score": 5, "questions": 5,
+            "category": self.category_id})
+        leaderboard = self.client.get(
+            f"/api/v1.0/leaderboard?category={self.category_id}")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["game"]["player"], "Ada")
+        games = leaderboard.json["games"]
+        self.assertEqual([(g["rank"], g["player"], g["score"]) for g in games],
+                         [(1, "Ada", 5), (2, "Player", 3)])
+        self.assertEqual(
+            self.client.get("/api/v1.0/leaderboard").json["games"][0]
+            ["game_id"], response.json["game"]["id"])
+
+    def test_leaderboard_keeps_best_games_only(self):
+        """Test a leaderboard holds `size` games however many are played."""
+        scores = [random.randint(0, 10) for _ in range(40)]
+        ids = [self.play(score, self.category_id, size=5) for score in scores]
+
+        best = sorted(zip(scores, ids), key=lambda g: (-g[0], g[1]))[:5]
+        self.assertEqual(self.scores(self.category_id), best)
+        self.assertEqual(self.scores(), best)
+        self.assertEqual(LeaderboardEntry.query.count(), 10)
+
+    def test_same_score_ranks_earlier_game_first(self):
+        """Test a later game with the same score does not enter."""
+        first = self.play(7, size=2)
+        second = self.play(7, size=2)
+        self.play(7, size=2)
+
+        self.assertEqual(self.scores(), [(7, first), (7, second)])
+
+    def test_category_leaderboards_separate(self):
+        """Test games of a category are not on another category board."""
+        game_id = self.play(4, self.category_id)
+        other_id = self.play(9, self.other_category_id)
+
+        self.assertEqual(self.scores(self.category_id), [(4, game_id)])
+        self.assertEqual(self.scores(), [(9, other_id), (4, game_id)])
+
+    def test_worse_game_reads_one_entry(self):
+        """Test a game not entering a full leaderboard changes nothing."""
+        for score in (9, 8):
+            self.play(score, size=2)
+
+        statements = self.captured_statements(
+            lambda: self.play(1, size=2))
+
+        self.assertFalse([s for s, _ in statements
+                          if s.startswith(("INSERT INTO leaderboard",
+                                           "DELETE FROM leaderboard"))])
+
+    def test_top_k_read_is_limited(self):
+        """Test the leaderboard read takes `limit` rows by the index."""
+        for score in range(5):
+            self.play(score)
+
+        statements = self.captured_statements(lambda: self.assertEqual(
+            len(self.client.get("/api/v1.0/leaderboard?limit=3")
+                .json["games"]), 3))
+
+        reads = [(s, p) for s, p in statements if "leaderboard" in s]
+        self.assertEqual(len(reads), 1)
+        self.assertIn("LIMIT", reads[0][0])
+
+    def test_rebuild_matches_incremental(self):
+        """Test the leaderboards rebuilt from games are the kept ones."""
+        for _ in range(30):
+            self.play(random.randint(0, 10),
+                      random.choice([None, self.category_id,
+                                     self.other_category_id]), size=4)
+        kept = {scope: self.scores(scope) for scope in
+                (None, self.category_id, self.other_category_id)}
+
+        LeaderboardEntry.rebuild(4)
+
+        self.assertEqual({scope: self.scores(scope) for scope in kept}, kept)
+
+    def test_wrong_game_and_limit_return_400(self):
+        """Test wrong bodies, unknown categories and limits are rejected."""
+        bodies = [{}, {"player": "", "score": 1, "questions": 5},
+                  {"player": "Ada", "score": 6, "questions": 5},
+                  {"player": "Ada", "score": True, "questions": 5},
+                  {"player": "Ada", "score": 1, "questions": 5,
+                   "category": 999_999}]
+        for body in bodies:
+            self.assertEqual(
+                self.client.post("/api/v1.0/games", json=body).status_code,
+                400, body)
+
+        self.assertEqual(self.client.get(
+            "/api/v1.0/leaderboard?limit=0").status_code, 400)
+        self.assertEqual(self.client.get(
+            "/api/v1.0/leaderboard?category=999999").status_code, 404)
+
+
+class DedupeTestCase(DbTestCase):
+    """Tests of the near-duplicate detection of questions."""
+
+    TEXT = "Which planet of the solar system has the most moons?"
+
+    def setUp(self):
+        """Insert a question the tests post near-duplicates of."""
+        super().setUp()
+        self.category = random.choice(Category.get_all())
+        self.question = Question(self.TEXT, "Saturn", self.category.id,
+                                 2).insert()
+
+    def set_mode(self, mode):
+        """Set `QUESTION_DEDUPE_MODE` for the test."""
+        self.addCleanup(self.app.config.__setitem__, "QUESTION_DEDUPE_MODE",
+                        self.app.config["QUESTION_DEDUPE_MODE"])
+        self.app.config["QUESTION_DEDUPE_MODE"] = mode
+
+    def post(self, text):
+        """Post a question in the category of the test question."""
+        return self.client.post("/api/v1.0/questions", json={
+            "question": text, "answer": "Saturn",
+            "category": self.category.id, "difficulty": 2})
+
+    def test_signature_ignores_case_accents_and_punctuation(self):
+        """Test normalized texts have equal signatures."""
+        self.assertEqual(minhash.signature("Who painted the Mona Lisa?"),
+                         minhash.signature("who  painted the Moná-Lisa"))
+        self.assertLess(
+            minhash.similarity(minhash.signature(self.TEXT),
+                               minhash.signature("Who painted Guernica?")),
+            0.3)
+
+    def test_near_duplicate_found_unrelated_not(self):
+        """Test the index finds a reworded question only."""
+        found = dedupe.find_duplicates(
+            "Which planet in the solar system has the most moons")
+
+        self.assertEqual([i for i, _ in found], [self.question.id])
+        self.assertEqual(dedupe.find_duplicates("Who painted Guernica?"), [])
+
+    def test_signature_follows_question_changes(self):
+        """Test signatures are stored, changed and deleted with questions."""
+        def stored():
+            return db.session.get(QuestionSignature, self.question.id)
+
+        self.assertEqual(stored().signature, minhash.signature(self.TEXT))
+
+        Question.patch(self.question.id, self.question.version,
+                       {"question_text": "Who painted Guernica?"})
+        db.session.expire_all()
+        self.assertEqual(stored().signature,
+                         minhash.signature("Who painted Guernica?"))
+        self.assertEqual(dedupe.find_duplicates(self.TEXT), [])
+
+        Question.get_by_id(self.question.id).delete()
+        self.assertIsNone(stored())
+
+    def test_warn_creates_and_lists_duplicates(self):
+        """Test a near-duplicate is created with the duplicates listed."""
+        count = Question.get_count()
+
+        response = self.post(self.TEXT.upper())
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["duplicates"],
+                         [{"id": self.question.id, "similarity": 1.0}])
+        self.assertEqual(Question.get_count(), count + 1)
+        self.assertNotIn("duplicates", self.post("Who painted Guernica?").json)
+
+    def test_reject_returns_409(self):
+        """Test a near-duplicate is refused in the reject mode."""
+        self.set_mode("reject")
+        count = Question.get_count()
+
+        response = self.post(self.TEXT)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertIn(str(self.question.id), response.json["error_message"])
+        self.assertEqual(Question.get_count(), count)
+
+    def test_merge_returns_existing_question(self):
+        """Test a near-duplicate is answered with the existing question."""
+        self.set_mode("merge")
+        count = Question.get_count()
+
+        response = self.post(self.TEXT)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.location.endswith(
+            f"/questions/{self.question.id}"))
+        self.assertEqual(Question.get_count(), count)
+
+    def test_find_not_blocked_by_reload(self):
+        """Test an expired index is looked up while another thread loads."""
+        signature = minhash.signature(self.TEXT)
+        index = dedupe.DuplicateIndex(ttl=float("inf"))
+        index.load([(1, signature)])
+        index.ttl = 0
+
+        # a reload in progress in another thread
+        with index._load_lock:
+            found = index.find(signature)
+
+        self.assertEqual(found, [(1, 1.0)])
+
+    def test_reload_keeps_changes_made_meanwhile(self):
+        """Test changes applied during a reload are in the new index."""
+        signature = minhash.signature(self.TEXT)
+        index = dedupe.DuplicateIndex(ttl=float("inf"))
+        index.load([(1, signature), (2, signature)])
+
+        def rows():
+            # read before the changes were committed
+            yield from [(1, signature), (2, signature)]
+            index.add(3, signature)
+            index.remove(1)
+
+        index.load(rows())
+
+        self.assertEqual([i for i, _ in index.find(signature)], [2, 3])
+
+    def test_created_question_signed_once(self):
+        """Test one signature is looked up, stored and indexed."""
+        text = "Which planet of the solar system has the longest day?"
+        signature = minhash.signature
+        signed = []
+
+        def counting(value):
+            signed.append(value)
+            return signature(value)
+
+        minhash.signature = counting
+        try:
+            self.assertEqual(self.post(text).status_code, 201)
+        finally:
+            minhash.signature = signature
+
+        self.assertEqual(signed, [text])
+        self.assertEqual(len(dedupe.find_duplicates(text)), 1)
+
+    def test_bulk_load_checks_bank_and_batch(self):
+        """Test a bulk load finds duplicates of loaded questions too."""
+        questions = [Question(text, "Answer", self.category.id, 1)
+                     for text in (self.TEXT, "Who painted Guernica?",
+                                  "Who painted Guernica")]
+
+        self.assertEqual(init_data.insert_questions(questions, "merge"),
+                         [self.question, questions[1], questions[1]])
+        self.assertEqual(
+            init_data.insert_questions(
+                [Question(self.TEXT, "Answer", self.category.id, 1)],
+                "reject"), [None])
+
+    def test_report_clusters_whole_bank(self):
+        """Test the report groups near-duplicates, missing signed first."""
+        copy = Question(self.TEXT + "!", "Saturn", self.category.id,
+                        2).insert()
+        # loaded by sql, without a signature
+        db.session.execute(QuestionSignature.__table__.delete().where(
+            QuestionSignature.question_id == copy.id))
+
+        clusters = dedupe.dedupe_report(0.8)
+
+        ids = [[q["id"] for q in c["questions"]] for c in clusters]
+        self.assertIn(sorted([self.question.id, copy.id]), ids)
+        self.assertIsNotNone(db.session.get(QuestionSignature, copy.id))
+
+
+@unittest.skipUnless(is_postgres_run(), "partitioning needs postgres")
+class PartitioningTestCase(unittest.TestCase):
+    """Tests of the questions partitioned by category."""
+
+    def setUp(self):
+        """Partition the questions of the test database."""
+        self.ctx = test_app.app_context()
+        self.ctx.push()
+        self.count = Question.get_count()
+        # the swap waits for the lock held by the session
+        db.session.remove()
+        partitioning.partition_questions(db.engine, batch_size=7,
+                                         log=lambda message: None)
+
+    def tearDown(self):
+        """Convert the questions back to a plain table."""
+        db.session.remove()
+        partitioning.unpartition_questions(db.engine,
+                                           log=lambda message: None)
+        self.ctx.pop()
+
+    def scanned_tables(self, statement, **parameters):
+        """Return tables read by the statement."""
+        plan = db.session.execute(sqlalchemy.text(f"EXPLAIN {statement}"),
+                                  parameters).scalars().all()
+        return {table for line in plan for table in
+                re.findall(r"\b(questions_(?:c\d+|default))\b", line)}
+
+    def test_existing_questions_moved_to_partitions(self):
+        """Test every category has a partition with its questions."""
+        self.assertTrue(partitioning.is_partitioned(db.session))
+        self.assertEqual(Question.get_count(), self.count)
+
+        for category in Category.get_all():
+            name = partitioning.partition_name(category.id)
+            count = db.session.execute(
+                sqlalchemy.text(f"SELECT count(*) FROM {name}")).scalar()
+            self.assertEqual(count, category.question_count)
+
+    def test_category_insert_creates_partition(self):
+        """Test questions of a new category go to its own partition."""
+        category = Category("Partitioned").insert()
+        category_id = category.id
+        try:
+            question = Question("Partitioned question", "Answer",
+                                category_id, 1).insert()
+            tables = self.scanned_tables(
+                "SELECT * FROM questions WHERE category_id = :id",
+                id=category_id)
+
+            self.assertEqual(tables,
+                             {partitioning.partition_name(category_id)})
+            self.assertEqual(Category.get_by_id(category_id).question_count,
+                             1)
+            self.assertEqual(Question.get_by_category_id(category_id),
+                             [question])
+
+            question.delete()
+        finally:
+            Category.get_by_id(category_id).delete()
+
+        self.assertFalse(db.session.execute(sqlalchemy.text(
+            "SELECT to_regclass(:name) IS NOT NULL"),
+            {"name": partitioning.partition_name(category_id)}).scalar())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+"""WSGI entry point of the api for a production server.
+
+Run from the `backend` directory (settings are read from `gunicorn.conf.py`):
+
+    gunicorn wsgi:app
+
+The app is created and warmed up once in the master process and the workers
+are forked from it.
+"""
+
+import os
+
+from dedupe import duplicate_index
+from flaskr import QUESTIONS_PER_PAGE, create_app
+from logs import logger
+from models import Category, Question, db
+from quiz_sampler import question_buckets
+
+
+def configure_pool(app, pool_size: int) -> None:
+    """Size the connection pool of the app to the number of threads.
+
+    :param app: flask application
+    :app type: `Flask`
+    :param pool_size: number of connections kept in the pool
+    :pool_size type: int
+    """
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    options.setdefault("pool_size", pool_size)
+    options.setdefault("max_overflow", pool_size)
+    options.setdefault("pool_pre_ping", True)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def warm_up(app) -> None:
+    """Run the hot queries once to fill the caches of the app.
+
+    Fills the compiled statement cache of the engine, loads the quiz
+    question buckets and the near-duplicate index and opens a connection.
+    A failure is logged, the app is served anyway.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    with app.app_context():
+        try:
+            Category.all_as_dict()
+            Question.get_count()
+            Question.get_paginated(1, QUESTIONS_PER_PAGE)
+            question_buckets.load()
+            if app.config["QUESTION_DEDUPE_MODE"] != "off":
+                duplicate_index.load()
+
+        except Exception as e:
+            logger.warning(f"Warm up failed: {e}")
+
+        finally:
+            db.session.remove()
+
+
+def dispose_inherited_connections(app) -> None:
+    """Drop the connections inherited from the parent process.
+
+    To be called in a forked worker. The connections are not closed, they are
+    still used by the parent, the worker opens its own.
+    :param app: flask application
+    :app type: `Flask`
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+app = create_app()
+configure_pool(app, int(os.environ.get("TRIVIA_DB_POOL_SIZE", 5)))
+warm_up(app)
@@ -9,11 +9,13 @@ class QuizView extends Component {
     super();
     this.state = {
       quizCategory: null,
+      quizQuestions: [],
       previousQuestions: [],
       showAnswer: false,
       categories: {},
       numCorrect: 0,
       currentQuestion: {},
+      questionShownAt: null,
       guess: '',
       forceEnd: false,
       emptyIncluded: false
@@ -36,26 +38,21 @@ class QuizView extends Component {
   }
 
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.getQuizQuestions);
   };
 
   handleChange = (event) => {
     this.setState({ [event.target.name]: event.target.value });
   };
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions];
-    if (this.state.currentQuestion.id) {
-      previousQuestions.push(this.state.currentQuestion.id);
-    }
-
+  getQuizQuestions = () => {
     $.ajax({
-      url: '/api/v1.0/quizzes', //TODO: update request URL
+      url: '/api/v1.0/quizzes/batch',
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
+        count: questionsPerPlay,
         quiz_category: this.state.quizCategory,
       }),
       xhrFields: {
@@ -63,34 +60,74 @@ class QuizView extends Component {
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true,
-        });
+        this.setState({ quizQuestions: result.questions }, this.getNextQuestion);
         return;
       },
       error: (error) => {
-        alert('Unable to load question. Please try your request again');
+        if (error.status === 404) {
+          this.setState({ forceEnd: true });
+          return;
+        }
+        alert('Unable to load questions. Please try your request again');
         return;
       },
     });
   };
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions];
+    if (this.state.currentQuestion.id) {
+      previousQuestions.push(this.state.currentQuestion.id);
+    }
+
+    const nextQuestion = this.state.quizQuestions[previousQuestions.length];
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      currentQuestion: nextQuestion || {},
+      questionShownAt: Date.now(),
+      guess: '',
+      forceEnd: nextQuestion ? false : true,
+    });
+  };
+
   submitGuess = (event) => {
     event.preventDefault();
     let evaluate = this.evaluateAnswer();
+    this.recordAttempt(evaluate);
     this.setState({
       numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
       showAnswer: true,
     });
   };
 
+  // answers are recorded for analytics, a failure does not stop the game
+  recordAttempt = (correct) => {
+    $.ajax({
+      url: '/api/v1.0/quizzes/attempts',
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        attempts: [
+          {
+            question_id: this.state.currentQuestion.id,
+            correct: correct,
+            time_ms: Date.now() - this.state.questionShownAt,
+          },
+        ],
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+    });
+  };
+
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizQuestions: [],
       previousQuestions: [],
       showAnswer: false,
       numCorrect: 0,
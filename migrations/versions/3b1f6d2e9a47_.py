@@ -0,0 +1,35 @@
+"""quiz_attempts of quiz players
+
+Revision ID: 3b1f6d2e9a47
+Revises: 8f09a7e97d06
+Create Date: 2026-10-19 18:12:40.527913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f6d2e9a47'
+down_revision = '8f09a7e97d06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('quiz_attempts',
+                    sa.Column('id', sa.BigInteger().with_variant(
+                        sa.Integer(), 'sqlite'), nullable=False),
+                    sa.Column('question_id', sa.Integer(), nullable=False),
+                    sa.Column('correct', sa.Boolean(), nullable=False),
+                    sa.Column('time_ms', sa.Integer(), nullable=False),
+                    sa.Column('answered_at', sa.DateTime(timezone=True),
+                              nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_quiz_attempts_question_id', 'quiz_attempts',
+                    ['question_id'])
+
+
+def downgrade():
+    op.drop_index('ix_quiz_attempts_question_id', table_name='quiz_attempts')
+    op.drop_table('quiz_attempts')
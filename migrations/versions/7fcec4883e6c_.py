@@ -0,0 +1,86 @@
+"""question_count column on categories kept by models and triggers
+
+Revision ID: 7fcec4883e6c
+Revises: baf98a0b5852
+Create Date: 2026-10-19 10:02:17.530981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7fcec4883e6c'
+down_revision = 'baf98a0b5852'
+branch_labels = None
+depends_on = None
+
+
+COUNT_FUNCTION = """
+CREATE OR REPLACE FUNCTION questions_count_trigger() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('trivia.question_counts', true) = 'orm' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE categories c SET question_count = c.question_count + n.count
+        FROM (SELECT category_id, count(*) AS count FROM new_rows
+              GROUP BY category_id) n
+        WHERE c.id = n.category_id;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE categories c SET question_count = c.question_count - o.count
+        FROM (SELECT category_id, count(*) AS count FROM old_rows
+              GROUP BY category_id) o
+        WHERE c.id = o.category_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+COUNT_TRIGGERS = [
+    """
+    CREATE TRIGGER questions_count_insert AFTER INSERT ON questions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION questions_count_trigger()
+    """,
+    """
+    CREATE TRIGGER questions_count_delete AFTER DELETE ON questions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION questions_count_trigger()
+    """,
+    """
+    CREATE TRIGGER questions_count_update
+    AFTER UPDATE ON questions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION questions_count_trigger()
+    """,
+]
+
+
+def upgrade():
+    op.add_column('categories',
+                  sa.Column('question_count', sa.Integer(), nullable=False,
+                            server_default='0'))
+    op.execute("""
+        UPDATE categories SET question_count = (
+            SELECT count(*) FROM questions
+            WHERE questions.category_id = categories.id)
+    """)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(COUNT_FUNCTION)
+        for trigger in COUNT_TRIGGERS:
+            op.execute(trigger)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TRIGGER questions_count_update ON questions")
+        op.execute("DROP TRIGGER questions_count_delete ON questions")
+        op.execute("DROP TRIGGER questions_count_insert ON questions")
+        op.execute("DROP FUNCTION questions_count_trigger()")
+
+    with op.batch_alter_table('categories') as batch_op:
+        batch_op.drop_column('question_count')
@@ -0,0 +1,34 @@
+"""question_changes log of question changes
+
+Revision ID: 856f5a423c71
+Revises: 7fcec4883e6c
+Create Date: 2026-10-19 13:41:08.215604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '856f5a423c71'
+down_revision = '7fcec4883e6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('question_changes',
+                    sa.Column('seq', sa.Integer(), nullable=False),
+                    sa.Column('question_id', sa.Integer(), nullable=False),
+                    sa.Column('operation', sa.String(length=10),
+                              nullable=False),
+                    sa.Column('data', sa.JSON(), nullable=False),
+                    sa.Column('changed_at', sa.DateTime(timezone=True),
+                              server_default=sa.func.now(),
+                              nullable=False),
+                    sa.PrimaryKeyConstraint('seq'),
+                    sqlite_autoincrement=True)
+
+
+def downgrade():
+    op.drop_table('question_changes')
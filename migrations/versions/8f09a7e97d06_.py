@@ -0,0 +1,27 @@
+"""version column on questions for optimistic concurrency
+
+Revision ID: 8f09a7e97d06
+Revises: c47f4594f0c1
+Create Date: 2026-10-19 17:05:12.381604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f09a7e97d06'
+down_revision = 'c47f4594f0c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('questions',
+                  sa.Column('version', sa.Integer(), nullable=False,
+                            server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_column('version')
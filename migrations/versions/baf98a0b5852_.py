@@ -0,0 +1,36 @@
+"""indexes on questions for category and difficulty lookups
+
+Revision ID: baf98a0b5852
+Revises: 857da2a87963
+Create Date: 2026-10-19 09:12:41.204337
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'baf98a0b5852'
+down_revision = '857da2a87963'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # built concurrently, the table stays writable while indexes are built,
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_questions_category_id_id', 'questions',
+                        ['category_id', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_questions_category_id_difficulty', 'questions',
+                        ['category_id', 'difficulty'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_questions_category_id_difficulty',
+                      table_name='questions',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_questions_category_id_id', table_name='questions',
+                      postgresql_concurrently=True)
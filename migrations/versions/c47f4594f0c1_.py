@@ -0,0 +1,35 @@
+"""questions list partitioned by category on postgres
+
+Revision ID: c47f4594f0c1
+Revises: 856f5a423c71
+Create Date: 2026-10-19 15:20:44.908117
+
+"""
+from alembic import op
+
+import partitioning
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47f4594f0c1'
+down_revision = '856f5a423c71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # rows are copied in batches, each committed on its own, the table
+    # stays readable and writable until the final swap
+    with op.get_context().autocommit_block():
+        partitioning.partition_questions(op.get_bind().engine)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    with op.get_context().autocommit_block():
+        partitioning.unpartition_questions(op.get_bind().engine)
@@ -0,0 +1,50 @@
+"""games and leaderboard_entries for the leaderboards
+
+Revision ID: d5a8c31e7b20
+Revises: 3b1f6d2e9a47
+Create Date: 2026-10-19 19:26:03.148297
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8c31e7b20'
+down_revision = '3b1f6d2e9a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('games',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('player', sa.String(length=64),
+                              nullable=False),
+                    sa.Column('category_id', sa.Integer(), nullable=True),
+                    sa.Column('score', sa.Integer(), nullable=False),
+                    sa.Column('questions', sa.Integer(), nullable=False),
+                    sa.Column('played_at', sa.DateTime(timezone=True),
+                              server_default=sa.func.now(),
+                              nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('leaderboard_entries',
+                    sa.Column('scope', sa.Integer(), nullable=False),
+                    sa.Column('game_id', sa.Integer(), nullable=False),
+                    sa.Column('player', sa.String(length=64),
+                              nullable=False),
+                    sa.Column('score', sa.Integer(), nullable=False),
+                    sa.Column('played_at', sa.DateTime(timezone=True),
+                              nullable=False),
+                    sa.ForeignKeyConstraint(['game_id'], ['games.id']),
+                    sa.PrimaryKeyConstraint('scope', 'game_id'))
+    op.create_index('ix_leaderboard_entries_scope_score',
+                    'leaderboard_entries',
+                    ['scope', sa.text('score DESC'), 'game_id'])
+
+
+def downgrade():
+    op.drop_index('ix_leaderboard_entries_scope_score',
+                  table_name='leaderboard_entries')
+    op.drop_table('leaderboard_entries')
+    op.drop_table('games')
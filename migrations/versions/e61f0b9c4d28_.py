@@ -0,0 +1,50 @@
+"""question_signatures for near-duplicate detection
+
+Revision ID: e61f0b9c4d28
+Revises: d5a8c31e7b20
+Create Date: 2026-10-19 20:41:17.503126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import minhash
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61f0b9c4d28'
+down_revision = 'd5a8c31e7b20'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    signatures = op.create_table(
+        'question_signatures',
+        sa.Column('question_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('signature', sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint('question_id'))
+
+    # existing questions are signed in batches of ids
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text("SELECT id, question_text FROM questions WHERE id > :id "
+                    "ORDER BY id LIMIT :limit"),
+            {"id": last_id, "limit": BATCH_SIZE}).all()
+        if not rows:
+            break
+
+        op.bulk_insert(signatures, [
+            {'question_id': row.id,
+             'signature': minhash.signature(row.question_text)}
+            for row in rows])
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_table('question_signatures')